@@ -0,0 +1,62 @@
+# Compare writing the slices of a volume with pydicom and with the
+# TemplateEncoder in dbdicom.utils.encoder.
+#
+# Run from the top folder of the repository:
+# >>> python dev/benchmark_encoder.py
+
+import os
+import shutil
+import timeit
+
+import numpy as np
+import vreg
+import pydicom
+
+import dbdicom.dataset as dbdataset
+from dbdicom.dbd import _set_slice
+from dbdicom.utils.encoder import TemplateEncoder
+
+
+tmp = os.path.join(os.path.dirname(__file__), 'tmp')
+
+
+def write(ds, slices, encoder=None):
+    for i, sl in enumerate(slices):
+        _set_slice(ds, sl, 3)
+        ds.SOPInstanceUID = pydicom.uid.generate_uid()
+        ds.InstanceNumber = i + 1
+        file = os.path.join(tmp, f'{i}.dcm')
+        if encoder is None:
+            dbdataset.write(ds, file)
+        else:
+            encoder.write(ds, file)
+
+
+def benchmark(shape, repeat=5):
+    vol = vreg.volume(np.random.rand(*shape).astype(np.float32))
+    slices = vol.split()
+    ds = dbdataset.new_dataset('MRImage')
+    times = {
+        'pydicom': min(timeit.repeat(
+            lambda: write(ds, slices),
+            number=1, repeat=repeat,
+        )),
+        'encoder': min(timeit.repeat(
+            lambda: write(ds, slices, TemplateEncoder()),
+            number=1, repeat=repeat,
+        )),
+    }
+    print(f"{shape[2]} slices of {shape[0]}x{shape[1]}")
+    for method, t in times.items():
+        print(f"    {method}: {1000*t:.1f} ms ({1e6*t/shape[2]:.0f} us/slice)")
+    print(f"    speedup: {times['pydicom']/times['encoder']:.1f}x")
+
+
+if __name__ == '__main__':
+
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    benchmark((64, 64, 200))
+    benchmark((256, 256, 200))
+    shutil.rmtree(tmp)
@@ -0,0 +1,49 @@
+# Compare the scan engines of dbdicom.database on the test data.
+#
+# Run from the top folder of the repository:
+# >>> python dev/benchmark_scan.py
+
+import os
+import shutil
+import timeit
+
+import numpy as np
+import vreg
+
+import dbdicom as db
+import dbdicom.database as dbdatabase
+import dbdicom.utils.files as filetools
+
+
+datapath = os.path.join(os.path.dirname(__file__), '..', 'tests', 'data')
+tmp = os.path.join(os.path.dirname(__file__), 'tmp')
+
+
+def benchmark(path, repeat=5):
+    files = filetools.all_files(path)
+    tags = dbdatabase.COLUMNS + ['NumberOfFrames']
+    times = {}
+    for engine in dbdatabase.ENGINES:
+        t = timeit.repeat(
+            lambda: dbdatabase._read_files(path, files, tags, engine),
+            number=1, repeat=repeat,
+        )
+        times[engine] = min(t)
+    print(f"{path}: {len(files)} files")
+    for engine, t in times.items():
+        print(f"    {engine}: {1000*t:.1f} ms ({1e6*t/len(files):.0f} us/file)")
+    print(f"    speedup: {times['pydicom']/times['raw']:.1f}x")
+
+
+if __name__ == '__main__':
+
+    # Multiframe files in the test data
+    benchmark(datapath)
+
+    # A single-frame series
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    vol = vreg.volume(np.random.rand(64, 64, 200).astype(np.float32))
+    db.write_volume(vol, [tmp, '007', 'test', 'ax'], verbose=0)
+    benchmark(tmp)
+    shutil.rmtree(tmp)
@@ -1,4 +1,5 @@
 import os
+import atexit
 import shutil
 import zipfile
 from pathlib import Path
@@ -8,20 +9,143 @@ import numpy as np
 import vreg
 
 from dbdicom.dbd import DataBaseDicom
+from dbdicom.utils.pixel_map import LazyVolume
+from dbdicom.utils.slice_cache import SliceCache
+import dbdicom.register as register
 
 
+# Databases opened by the functions in this module, which are kept 
+# open between calls: {path: (DataBaseDicom, stamp of register file)}
+_SESSIONS = {}
 
 
-def open(path:str) -> DataBaseDicom:
+
+
+def open(path:str, workers=1, engine='pydicom', backend=None, mode='a', cache=None, columns=None, split_multiframe=None) -> DataBaseDicom:
     """Open a DICOM database
 
     Args:
         path (str): path to the DICOM folder
+        workers (int, optional): number of processes used when the 
+            folder needs to be scanned. If workers is None, all 
+            available CPUs are used. Defaults to 1.
+        engine (str, optional): how to read the file headers when the 
+            folder needs to be scanned. With 'pydicom' the headers 
+            are read by pydicom. With 'raw' the header bytes are 
+            parsed directly, falling back on pydicom for less common 
+            encodings. Defaults to 'pydicom'.
+        backend (str, optional): where the register is saved. With 
+            'json' it is saved in dbtree.json when the database is 
+            closed. With 'sqlite' it is saved in an SQLite database 
+            dbtree.sqlite, which is updated as changes are made. An 
+            existing register is converted to the backend. If None, 
+            the backend of the existing register is used, or 'json' 
+            for a new register. Defaults to None.
+        mode (str, optional): 'a' to read and modify the database, 
+            or 'r' to open it read-only. In read-only mode nothing is 
+            written to the folder, and functions that modify the 
+            database raise an error. Defaults to 'a'.
+        cache (int, optional): memory budget in bytes for a cache of 
+            decoded files, so that files which are read again are 
+            not decoded again. If None, there is no cache. 
+            Defaults to None.
+        columns (list, optional): attributes to save in the register 
+            for each file, such as ['EchoTime', 'FlipAngle']. Then 
+            values(), unique() and split_series() read them from the 
+            register instead of the files. The columns are saved with 
+            the register and used by all later calls. Defaults to None.
+        split_multiframe (bool, optional): if True, multiframe files 
+            found when the folder is scanned are split into 
+            single-frame files. If False, the files are kept and each 
+            frame is registered as a virtual instance, which is read 
+            from the multiframe file. The setting is saved with the 
+            register and used by all later calls. If None, the saved 
+            setting is used, or True if there is none. Defaults to None.
 
     Returns:
         DataBaseDicom: database instance.
     """
-    return DataBaseDicom(path)
+    # Save changes made by other functions in this module first
+    flush(path)
+    return DataBaseDicom(path, workers, engine, backend, mode, cache, columns, split_multiframe)
+
+def refresh(path, workers=1, engine='pydicom'):
+    """Update the register with changes in the DICOM folder
+
+    Only files that are new or have changed since the last scan 
+    are read, and files that have been removed are dropped.
+
+    Args:
+        path (str): path to the DICOM folder
+        workers (int, optional): number of processes used to read 
+            the new files. If workers is None, all available CPUs 
+            are used. Defaults to 1.
+        engine (str, optional): how to read the file headers 
+            ('pydicom' or 'raw'). Defaults to 'pydicom'.
+    """
+    dbd = _open(path)
+    dbd.refresh(workers, engine)
+
+def flush(path=None):
+    """Save changes to the register of DICOM folders
+
+    The functions in this module keep the databases they open in 
+    memory, so that the register does not need to be read from disk 
+    and saved again on every call. Changes are saved when the 
+    program exits, or when this function is called. Until then, a 
+    DataBaseDicom that is created directly for the same folder reads 
+    the register as it was last saved, and does not see these changes. 
+    open() calls this function first, so databases opened with open() 
+    are up to date.
+
+    If the register of a folder is changed on disk in the meantime, 
+    for instance by another process, it is read again before the 
+    changes are saved, and files that have been added or removed 
+    since are updated with refresh().
+
+    Args:
+        path (str, optional): path to the DICOM folder. If this is 
+            not provided, the changes in all folders are saved.
+    """
+    if path is None:
+        paths = list(_SESSIONS.keys())
+    else:
+        paths = [os.path.abspath(path)]
+    for path in paths:
+        if path not in _SESSIONS:
+            continue
+        if not os.path.isdir(path):
+            # The folder has been deleted
+            del _SESSIONS[path]
+            continue
+        if not _SESSIONS[path][0].dirty:
+            continue
+        dbd = _open(path)
+        dbd.close()
+        _SESSIONS[path] = (dbd, _stamp(dbd))
+
+def set_cache(path, max_bytes=None):
+    """Cache decoded files between calls of the functions in this module
+
+    Functions that read pixel data or headers, such as volume(), 
+    pixel_data() and values(), then keep the decoded files of the 
+    folder in memory, and only read them again from disk when they 
+    have changed.
+
+    Args:
+        path (str): path to the DICOM folder
+        max_bytes (int, optional): memory budget of the cache in 
+            bytes. If this is None, the cache is removed. 
+            Defaults to None.
+
+    Returns:
+        SliceCache: the cache, with counters of hits and misses, 
+        or None if the cache is removed.
+    """
+    dbd = _open(path)
+    dbd.cache = None if max_bytes is None else SliceCache(dbd.path, max_bytes)
+    return dbd.cache
+
 
 def to_json(path):
     """Summarise the contents of the DICOM folder in a json file
@@ -29,8 +153,8 @@ def to_json(path):
     Args:
         path (str): path to the DICOM folder
     """
-    dbd = open(path)
-    dbd.close()   
+    _open(path)
+    flush(path)
 
 def print(path):
     """Print the contents of the DICOM folder
@@ -38,9 +162,8 @@ def print(path):
     Args:
         path (str): path to the DICOM folder
     """
-    dbd = open(path)
+    dbd = _open(path)
     dbd.print()
-    dbd.close()
 
 
 def summary(path) -> dict:
@@ -52,9 +175,8 @@ def summary(path) -> dict:
     Returns:
         dict: Nested dictionary with summary information on the database.
     """
-    dbd = open(path)
+    dbd = _open(path)
     s = dbd.summary()
-    dbd.close()
     return s
 
 
@@ -67,9 +189,8 @@ def tree(path) -> dict:
     Returns:
         dict: Nested dictionary with summary information on the database.
     """
-    dbd = open(path)
-    s = dbd.register
-    dbd.close()
+    dbd = _open(path)
+    s = register.to_list(dbd.register)
     return s
 
 
@@ -89,9 +210,8 @@ def patients(path, name:str=None, contains:str=None, isin:list=None)->list:
     Returns:
         list: list of patients fulfilling the criteria.
     """
-    dbd = open(path)
+    dbd = _open(path)
     p = dbd.patients(name, contains, isin)
-    dbd.close()
     return p
 
 
@@ -114,14 +234,12 @@ def studies(entity:str | list, desc:str=None, contains:str=None, isin:list=None)
         list: list of studies fulfilling the criteria.
     """
     if isinstance(entity, str): # path = folder
-        dbd = open(entity)
+        dbd = _open(entity)
         s = dbd.studies(entity, desc, contains, isin)
-        dbd.close()
         return s
     elif len(entity)==2: # path = patient
-        dbd = open(entity[0])
+        dbd = _open(entity[0])
         s = dbd.studies(entity, desc, contains, isin)
-        dbd.close()
         return s
     else:
         raise ValueError(
@@ -149,14 +267,12 @@ def series(entity:str | list, desc:str=None, contains:str=None, isin:list=None)-
         list: list of series fulfilling the criteria.
     """
     if isinstance(entity, str): # path = folder
-        dbd = open(entity)
+        dbd = _open(entity)
         s = dbd.series(entity, desc, contains, isin)
-        dbd.close()
         return s
     elif len(entity) in [2,3]:
-        dbd = open(entity[0])
+        dbd = _open(entity[0])
         s = dbd.series(entity, desc, contains, isin)
-        dbd.close()
         return s
     else:
         raise ValueError(
@@ -175,9 +291,9 @@ def copy(from_entity:list, to_entity=None):
         entity: the copied entity. If th to_entity is provided, this is 
         returned.
     """
-    dbd = open(from_entity[0])
+    _flush_other(from_entity, to_entity)
+    dbd = _open(from_entity[0])
     from_entity_copy = dbd.copy(from_entity, to_entity)
-    dbd.close()
     return from_entity_copy
 
 
@@ -189,9 +305,8 @@ def delete(entity:list, not_exists_ok=False):
         not_exists_ok (bool): By default, an exception is raised when attempting 
             to delete an entity that does not exist. Set this to True to pass over this silently.
     """
-    dbd = open(entity[0])
+    dbd = _open(entity[0])
     dbd.delete(entity, not_exists_ok)
-    dbd.close()
 
 
 def move(from_entity:list, to_entity:list):
@@ -200,10 +315,10 @@ def move(from_entity:list, to_entity:list):
     Args:
         entity (list): entity to move
     """
-    dbd = open(from_entity[0])
+    _flush_other(from_entity, to_entity)
+    dbd = _open(from_entity[0])
     dbd.copy(from_entity, to_entity)
     dbd.delete(from_entity)
-    dbd.close()
 
 def split_series(series:list, attr:Union[str, tuple], key=None)->list:
     """
@@ -217,43 +332,95 @@ def split_series(series:list, attr:Union[str, tuple], key=None)->list:
         list: list of two-element tuples, where the first element is
         is the value and the second element is the series corresponding to that value.      
     """
-    dbd = open(series[0])
+    dbd = _open(series[0])
     split_series = dbd.split_series(series, attr, key)
-    dbd.close()
     return split_series
 
 
-def volume(series:list, dims:list=None, verbose=1) -> vreg.Volume3D:
+def volume(series:list, dims:list=None, verbose=1, workers=1, bbox=None, slices=None) -> vreg.Volume3D:
     """Read volume from a series.
 
     Args:
         series (list, str): DICOM entity to read
         dims (list, optional): Non-spatial dimensions of the volume. Defaults to None.
         verbose (bool, optional): If set to 1, shows progress bar. Defaults to 1.
+        workers (int, optional): number of files read at the same 
+            time. Files are read in threads, or in processes if the 
+            pixel data are compressed. If workers is None, all 
+            available CPUs are used. Defaults to 1.
+        bbox (tuple, optional): in-plane window ((xmin, xmax), 
+            (ymin, ymax)) to read, in pixel indices along the first 
+            two axes, with the maximum excluded. Defaults to None.
+        slices (tuple, optional): range (min, max) of slice locations 
+            to read, limits included. Only the files in this range 
+            are decoded. Defaults to None.
 
     Returns:
         vreg.Volume3D.
     """
-    dbd = open(series[0])
-    vol = dbd.volume(series, dims, verbose)
-    dbd.close()
+    dbd = _open(series[0])
+    vol = dbd.volume(series, dims, verbose, workers, bbox, slices)
     return vol
 
 
-def volumes_2d(series:list, dims:list=None, verbose=1) -> vreg.Volume3D:
+def lazy_volume(series:list, dims:list=None, verbose=1) -> LazyVolume:
+    """Read the geometry of a volume, and the pixel data on demand.
+
+    Args:
+        series (list): DICOM series to read
+        dims (list, optional): Non-spatial dimensions of the volume. Defaults to None.
+        verbose (bool, optional): If set to 1, shows progress bar. Defaults to 1.
+
+    Returns:
+        LazyVolume: with the shape, affine, dims and coords of the 
+        volume. Indexing reads only the slices that are needed, and 
+        LazyVolume.volume() reads all of them into a vreg.Volume3D.
+    """
+    dbd = _open(series[0])
+    return dbd.lazy_volume(series, dims, verbose)
+
+
+def iter_volumes(series:list, dims:list=None, over='AcquisitionTime', verbose=1, workers=1):
+    """Iterate over the volumes of a series along one dimension.
+
+    Args:
+        series (list): DICOM series to read
+        dims (list, optional): Non-spatial dimensions of the series. 
+            If over is not in dims, it is added as the last 
+            dimension. Defaults to None.
+        over (str, optional): Dimension to iterate over. 
+            Defaults to 'AcquisitionTime'.
+        verbose (bool, optional): If set to 1, shows progress bar. Defaults to 1.
+        workers (int, optional): number of files read at the same 
+            time, as in volume(). Defaults to 1.
+
+    Yields:
+        vreg.Volume3D: one volume for each value of over, reading 
+        only the files of that volume.
+    """
+    dbd = _open(series[0])
+    yield from dbd.iter_volumes(series, dims, over, verbose, workers)
+
+
+def volumes_2d(series:list, dims:list=None, verbose=1, workers=1, bbox=None, slices=None) -> vreg.Volume3D:
     """Read 2D volumes from the series
 
     Args:
         entity (list, str): DICOM series to read
         dims (list, optional): Non-spatial dimensions of the volume. Defaults to None.
         verbose (bool, optional): If set to 1, shows progress bar. Defaults to 1.
+        workers (int, optional): number of files read at the same 
+            time, as in volume(). Defaults to 1.
+        bbox (tuple, optional): in-plane window to read, as in 
+            volume(). Defaults to None.
+        slices (tuple, optional): range of slice locations to read, 
+            as in volume(). Defaults to None.
 
     Returns:
         list of vreg.Volume3D
     """
-    dbd = open(series[0])
-    vol = dbd.volumes_2d(series, dims, verbose)
-    dbd.close()
+    dbd = _open(series[0])
+    vol = dbd.volumes_2d(series, dims, verbose, workers, bbox, slices)
     return vol
 
 
@@ -270,15 +437,15 @@ def values(series:list, *attr, dims:list=None, verbose=1) -> Union[np.ndarray, l
     Returns:
         tuple: arrays with values for the attributes.
     """
-    dbd = open(series[0])
+    dbd = _open(series[0])
     values = dbd.values(series, *attr, dims=dims, verbose=verbose)
-    dbd.close()
     return values
 
 
 
 def write_volume(vol:Union[vreg.Volume3D, tuple], series:list, 
-                 ref:list=None, append=False, verbose=1):
+                 ref:list=None, append=False, verbose=1, workers=1, 
+                 multiframe=False):
     """Write a vreg.Volume3D to a DICOM series
 
     Args:
@@ -290,13 +457,19 @@ def write_volume(vol:Union[vreg.Volume3D, tuple], series:list,
             To overrule this behaviour and add the volume to an existing series, set append to True. 
             Default is False.
         verbose (bool): if set to 1, a progress bar is shown. verbose=0 does not show updates.
+        workers (int, optional): number of processes used to write the 
+            slices. If workers is None, all available CPUs are used. 
+            Defaults to 1.
+        multiframe (bool, optional): if True, the volume is written to a 
+            single Enhanced MR file rather than one file per slice. 
+            Defaults to False.
     """
-    dbd = open(series[0])
-    dbd.write_volume(vol, series, ref, append, verbose)
-    dbd.close()
+    _flush_other(series, ref)
+    dbd = _open(series[0])
+    dbd.write_volume(vol, series, ref, append, verbose, workers, multiframe)
 
 
-def edit(series:list, new_values:dict, dims:list=None, verbose=1):
+def edit(series:list, new_values:dict, dims:list=None, verbose=1, inplace=False):
     """Edit attribute values in a DICOM series
 
     Warning: this function edits all values as requested. Please take care 
@@ -308,11 +481,12 @@ def edit(series:list, new_values:dict, dims:list=None, verbose=1):
         new_values (dict): dictionary with attribute: value pairs to write to the series
         dims (list, optional): Non-spatial dimensions of the volume. Defaults to None.
         verbose (bool, optional): If set to 1, shows progress bar. Defaults to 1.
+        inplace (bool, optional): If True, the values are changed in the 
+            existing files rather than in new copies. Defaults to False.
         
     """
-    dbd = open(series[0])
-    dbd.edit(series, new_values, dims=dims, verbose=verbose)
-    dbd.close()
+    dbd = _open(series[0])
+    dbd.edit(series, new_values, dims=dims, verbose=verbose, inplace=inplace)
 
 def to_nifti(series:list, file:str, dims:list=None, verbose=1):
     """Save a DICOM series in nifti format.
@@ -324,9 +498,8 @@ def to_nifti(series:list, file:str, dims:list=None, verbose=1):
             Defaults to None.
         verbose (bool, optional): If set to 1, shows progress bar. Defaults to 1.
     """
-    dbd = open(series[0])
+    dbd = _open(series[0])
     dbd.to_nifti(series, file, dims, verbose)
-    dbd.close()
 
 def from_nifti(file:str, series:list, ref:list=None):
     """Create a DICOM series from a nifti file.
@@ -336,9 +509,9 @@ def from_nifti(file:str, series:list, ref:list=None):
         series (list): DICOM series to create
         ref (list): DICOM series to use as template.
     """
-    dbd = open(series[0])
+    _flush_other(series, ref)
+    dbd = _open(series[0])
     dbd.from_nifti(file, series, ref)
-    dbd.close()
 
 
 def files(entity:list) -> list:
@@ -355,13 +528,12 @@ def files(entity:list) -> list:
     """
     if isinstance(entity, str):
         entity = [entity]
-    dbd = open(entity[0])
+    dbd = _open(entity[0])
     files = dbd.files(entity)
-    dbd.close()
     return files
 
 
-def pixel_data(series:list, dims:list=None, verbose=1) -> tuple:
+def pixel_data(series:list, dims:list=None, verbose=1, out=None, mmap=False, bbox=None, slices=None) -> tuple:
     """Read the pixel data from a DICOM series
 
     Args:
@@ -370,6 +542,19 @@ def pixel_data(series:list, dims:list=None, verbose=1) -> tuple:
             patient or study to read all series in that patient or 
             study. In those cases a list is returned.
         dims (list, optional): Dimensions of the array.
+        out (numpy.ndarray, optional): array to write the pixel 
+            values into. This must have the shape of the result, 
+            and values are cast to its data type. If this is not 
+            provided, a new array is returned.
+        mmap (bool, optional): if True, the pixel data are 
+            memory-mapped instead of read, and a PixelMap is returned. 
+            Values are read and rescaled only for the part of the 
+            array that is indexed. This requires uncompressed little 
+            endian files with one frame each. Defaults to False.
+        bbox (tuple, optional): in-plane window to read, as in 
+            volume(). Can't be used with mmap. Defaults to None.
+        slices (tuple, optional): range of slice locations to read, 
+            as in volume(). Defaults to None.
 
     Returns:
         numpy.ndarray or tuple: numpy array with pixel values, with 
@@ -377,9 +562,8 @@ def pixel_data(series:list, dims:list=None, verbose=1) -> tuple:
     """
     if isinstance(series, str):
         series = [series]
-    dbd = open(series[0])
-    array = dbd.pixel_data(series, dims, verbose)
-    dbd.close()
+    dbd = _open(series[0])
+    array = dbd.pixel_data(series, dims, verbose, out, mmap, bbox, slices)
     return array
 
 
@@ -394,22 +578,20 @@ def unique(pars:list, entity:list) -> dict:
         dict: if a pars is a list, this returns a dictionary with 
         unique values for each attribute. If pars is a scalar this returnes a list of values
     """
-    dbd = open(entity[0])
+    dbd = _open(entity[0])
     u = dbd.unique(pars, entity)
-    dbd.close()
     return u
 
 
 def archive(path, archive_path):
-    dbd = open(path)
+    dbd = _open(path)
     dbd.archive(archive_path)
-    dbd.close()
 
 
 def restore(archive_path, path):
     _copy_and_extract_zips(archive_path, path)
-    dbd = open(path)
-    dbd.close()
+    _open(path)
+    flush(path)
 
 
 def _copy_and_extract_zips(src_folder, dest_folder):
@@ -472,6 +654,67 @@ def _flatten_folder(root_folder):
                 print(f"Could not remove {dirpath} — not empty or in use.")
 
 
+def _open(path) -> DataBaseDicom:
+    # Return the database for a folder, opening it if needed. If the 
+    # register has changed on disk since it was opened, it is opened 
+    # again, and unsaved changes are recovered from the files. Folders 
+    # that can't be written to are opened read-only.
+    key = os.path.abspath(path)
+    dirty = False
+    cache = None
+    if key in _SESSIONS:
+        dbd, stamp = _SESSIONS[key]
+        if os.path.isdir(key) and stamp == _stamp(dbd):
+            return dbd
+        dirty = dbd.dirty
+        # Entries of changed files are not used, so the cache is kept
+        cache = dbd.cache
+        if dbd.backend == 'sqlite':
+            dbd.close()
+    if os.path.isdir(key) and not os.access(key, os.W_OK):
+        dbd = DataBaseDicom(path, mode='r')
+        dbd.cache = cache
+        _SESSIONS[key] = (dbd, _stamp(dbd))
+        return dbd
+    dbd = DataBaseDicom(path)
+    dbd.cache = cache
+    if dirty:
+        dbd.refresh()
+    # Save a new register straight away so that later changes on 
+    # disk can be detected.
+    dbd.close()
+    _SESSIONS[key] = (dbd, _stamp(dbd))
+    return dbd
+
+
+def _flush_other(entity, other):
+    # Copying to another folder, or using a reference series in 
+    # another folder, opens that folder separately, so changes in 
+    # that folder need to be saved first.
+    if other is not None:
+        if os.path.abspath(other[0]) != os.path.abspath(entity[0]):
+            flush(other[0])
+
+
+def _stamp(dbd:DataBaseDicom):
+    # Identifies the version of the register on disk. An SQLite 
+    # register is updated on every change, and only needs to be the 
+    # same file.
+    if dbd.backend == 'sqlite':
+        file = dbd._sqlite_file()
+    else:
+        file = dbd._register_file()
+    try:
+        stat = os.stat(file)
+    except FileNotFoundError:
+        return None
+    if dbd.backend == 'sqlite':
+        return stat.st_ino
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+atexit.register(flush)
+
 
 if __name__=='__main__':
-    pass
\ No newline at end of file
+    pass
@@ -1,12 +1,16 @@
 import os
+import math
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
 
-import numpy as np
-import pandas as pd
 import pydicom
 
 import dbdicom.utils.dcm4che as dcm4che
+import dbdicom.utils.multiframe as multiframe
 import dbdicom.utils.files as filetools
+import dbdicom.utils.header as header
+import dbdicom.register as register
+from dbdicom.sop_classes import enhanced_mr_image
 from dbdicom.utils.pydicom_dataset import get_values
 
 
@@ -26,101 +30,363 @@ COLUMNS = [
     'InstanceNumber', 
 ]
 
-def read(path):
-    files = filetools.all_files(path)
+ENGINES = ['pydicom', 'raw']
+
+# Multiframe files written by dbdicom have this private creator
+PRIVATE_CREATOR = (enhanced_mr_image.PRIVATE_GROUP << 16) | 0x0010
+
+
+def read(path, workers=1, files=None, engine='pydicom', split_multiframe=True):
+    """Read the DICOM folder and return the register tree.
+
+    Args:
+        path (str): path to the DICOM folder.
+        workers (int, optional): number of processes used to read 
+            the file headers. If workers is None, all available CPUs 
+            are used. Defaults to 1 (serial scan).
+        files (list, optional): files to read. If this is not 
+            provided, all files in the folder are read.
+        engine (str, optional): how to read the file headers. With 
+            'pydicom' the headers are read by pydicom. With 'raw' the 
+            bytes of the header are parsed directly, falling back 
+            on pydicom for encodings that the raw reader does not 
+            support. Defaults to 'pydicom'.
+        split_multiframe (bool, optional): if True, multiframe files 
+            are replaced by single-frame files. If False, the files 
+            are kept and each frame is included as a virtual instance, 
+            with the path returned by multiframe.frame_path(). 
+            Defaults to True.
+
+    Returns:
+        register.DbTree: the register tree.
+    """
+    rows = _read(path, files, workers, engine, None, split_multiframe)
+    return _tree(rows)
+
+
+def read_columns(path, columns, workers=1, files=None, engine='pydicom', split_multiframe=True):
+    """Read the DICOM folder and the values of extra columns.
+
+    The folder is read once, as with read(), and the values of the 
+    columns are returned alongside the register tree.
+
+    Args:
+        path (str): path to the DICOM folder.
+        columns (list): extra attributes to read from each file.
+        workers (int, optional): number of processes used to read 
+            the file headers. Defaults to 1.
+        files (list, optional): files to read. If this is not 
+            provided, all files in the folder are read.
+        engine (str, optional): how to read the file headers 
+            ('pydicom' or 'raw'). Defaults to 'pydicom'.
+        split_multiframe (bool, optional): see read(). Defaults to True.
+
+    Returns:
+        tuple: the register tree, and a dictionary with the values of 
+        the columns for each file, indexed by the relative path.
+    """
+    rows = _read(path, files, workers, engine, columns, split_multiframe)
+    values = {f: [row[c] for c in columns] for f, row in rows.items()}
+    return _tree(rows), values
+
+
+def instances(path, files, workers=1, engine='pydicom', columns=None, split_multiframe=True):
+    """Read the register attributes of a list of files.
+
+    Args:
+        path (str): path to the DICOM folder.
+        files (list): files to read.
+        workers (int, optional): number of processes used to read 
+            the file headers. Defaults to 1.
+        engine (str, optional): how to read the file headers 
+            ('pydicom' or 'raw'). Defaults to 'pydicom'.
+        columns (list, optional): extra attributes to read from each 
+            file. Their values are included in the attributes as they 
+            are, without filling in missing values. Defaults to None.
+        split_multiframe (bool, optional): if False, frames of 
+            multiframe files are returned as virtual instances 
+            instead of splitting the files. Defaults to True.
+
+    Returns:
+        dict: attributes of each DICOM file, indexed by the path 
+        relative to the folder. Files that are not DICOM images 
+        are not included.
+    """
+    rows = _read(path, files, workers, engine, columns, split_multiframe)
+    instances = {}
+    for relpath, row in rows.items():
+        attr = _attributes(row)
+        for c in (columns or []):
+            attr[c] = row[c]
+        instances[relpath] = attr
+    return instances
+
+
+def attributes(ds) -> dict:
+    """Register attributes of a dataset
+
+    Args:
+        ds (pydicom.Dataset): dataset.
+
+    Returns:
+        dict: the attributes in COLUMNS, in the same format as the 
+        attributes returned by instances().
+    """
+    return _attributes(dict(zip(COLUMNS, get_values(ds, COLUMNS))))
+
+
+def _attributes(row):
+    attr = {c: _fill(row[c]) for c in COLUMNS}
+    attr['SeriesNumber'] = int(attr['SeriesNumber'])
+    attr['InstanceNumber'] = str(int(attr['InstanceNumber']))
+    return attr
+
+
+def _read(path, files, workers, engine, columns=None, split_multiframe=True):
+    if engine not in ENGINES:
+        raise ValueError(
+            f"Unknown engine {engine}. Available engines are {ENGINES}."
+        )
+    if files is None:
+        files = filetools.all_files(path)
     tags = COLUMNS + ['NumberOfFrames'] # + ['SOPClassUID']
+    if columns is not None:
+        tags += [c for c in columns if c not in tags]
+    # The private creator is only needed to decide how multiframe 
+    # files are converted
+    read_tags = tags + [PRIVATE_CREATOR]
+    if workers == 1:
+        array, dicom_files = _read_files(path, files, read_tags, engine, verbose=1)
+    else:
+        array, dicom_files = _read_files_parallel(path, files, read_tags, engine, workers)
+    rows = {f: dict(zip(read_tags, row)) for f, row in zip(dicom_files, array)}
+    rows = _multiframe_to_singleframe(path, rows, tags, engine, workers, split_multiframe)
+    for row in rows.values():
+        row.pop(PRIVATE_CREATOR, None)
+    return rows
+
+
+def _read_files(path, files, tags, engine='pydicom', verbose=0):
     array = []
     dicom_files = []
-    for i, file in tqdm(enumerate(files), total=len(files), desc='Reading DICOM folder'):
-        try:
-            ds = pydicom.dcmread(file, force=True, specific_tags=tags+['Rows'])
-        except:
-            pass
+    for file in tqdm(files, desc='Reading DICOM folder', disable=(verbose==0)):
+        if engine == 'raw':
+            row = _read_header(file, tags)
         else:
-            if isinstance(ds, pydicom.dataset.FileDataset):
-                if 'TransferSyntaxUID' in ds.file_meta:
-                    if not 'Rows' in ds: # Image only
-                        continue
-                    row = get_values(ds, tags)
-                    array.append(row)
-                    index = os.path.relpath(file, path)
-                    dicom_files.append(index) 
-    df = pd.DataFrame(array, index = dicom_files, columns = tags)
-    df = _multiframe_to_singleframe(path, df)
-    dbtree = _tree(df)
-    return dbtree
-
-
-def _multiframe_to_singleframe(path, df):
+            row = _read_dataset(file, tags)
+        if row is None:
+            continue
+        array.append(row)
+        index = os.path.relpath(file, path)
+        dicom_files.append(index) 
+    return array, dicom_files
+
+
+def _read_dataset(file, tags):
+    specific_tags = tags + ['Rows']
+    if 'SliceLocation' in tags:
+        # Needed to derive it when it is missing
+        specific_tags += ['ImageOrientationPatient', 'ImagePositionPatient']
+    try:
+        ds = pydicom.dcmread(file, force=True, specific_tags=specific_tags)
+    except:
+        return None
+    if not isinstance(ds, pydicom.dataset.FileDataset):
+        return None
+    if 'TransferSyntaxUID' not in ds.file_meta:
+        return None
+    if not 'Rows' in ds: # Image only
+        return None
+    return get_values(ds, tags)
+
+
+def _read_header(file, tags):
+    try:
+        row = header.read(file, tags+['Rows'])
+    except Exception:
+        # Anything the raw reader can't handle is left to pydicom
+        return _read_dataset(file, tags)
+    if row is None:
+        return None
+    if row[-1] is None: # Image only
+        return None
+    return row[:-1]
+
+
+def _read_files_parallel(path, files, tags, engine='pydicom', workers=None):
+    # Shard the files in contiguous chunks so that concatenating 
+    # the results in order reproduces the serial scan exactly.
+    if workers is None:
+        workers = os.cpu_count()
+    size = max(1, math.ceil(len(files) / (4 * workers)))
+    chunks = [files[i:i+size] for i in range(0, len(files), size)]
+    array = []
+    dicom_files = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(
+            _read_files, 
+            [path] * len(chunks), 
+            chunks, 
+            [tags] * len(chunks),
+            [engine] * len(chunks),
+        )
+        for array_c, dicom_files_c in tqdm(
+                results, total=len(chunks), desc='Reading DICOM folder'):
+            array += array_c
+            dicom_files += dicom_files_c
+    return array, dicom_files
+
+
+def _multiframe_to_singleframe(path, rows, tags, engine, workers=1, split=True):
     """Converts all multiframe files in the folder into single-frame files.
     
     Reads all the multi-frame files in the folder,
     converts them to singleframe files, and delete the original multiframe file.
+    With more than one worker, the files are converted in parallel.
+    If split is False, the frames are listed as virtual instances 
+    instead, and the files are only split if this is not supported.
+    Files written by dbdicom with write_volume(multiframe=True) are 
+    never split.
     """
-    singleframe = df.NumberOfFrames.isnull() 
-    multiframe = singleframe == False
-    nr_multiframe = multiframe.sum()
-    if nr_multiframe != 0: 
-        for relpath in tqdm(df[multiframe].index.values, desc="Converting multiframe file " + relpath):
-            filepath = os.path.join(path, relpath)
-            singleframe_files = dcm4che.split_multiframe(filepath) 
-            if singleframe_files != []:            
-                # add the single frame files to the dataframe
-                dfnew = read(singleframe_files, df.columns, path)
-                df = pd.concat([df, dfnew])
-                # delete the original multiframe 
-                os.remove(filepath)
-            # drop the file also if the conversion has failed
-            df.drop(index=relpath, inplace=True)
-    df.drop('NumberOfFrames', axis=1, inplace=True)
-    return df
-
-
-def _tree(df):
+    multiframe = [f for f, row in rows.items() if row['NumberOfFrames'] is not None]
+    if multiframe == []:
+        return rows
+    n = len(multiframe)
+    keep = [not split or _written_by_dbdicom(rows[f]) for f in multiframe]
+    args = [[path]*n, multiframe, [tags]*n, [engine]*n, keep]
+    desc = "Converting multiframe files"
+    convert = _convert_multiframe
+    if workers == 1:
+        results = list(tqdm(map(convert, *args), total=n, desc=desc))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(tqdm(pool.map(convert, *args), total=n, desc=desc))
+    for relpath, singleframe_rows in zip(multiframe, results):
+        rows.update(singleframe_rows)
+        # drop the file also if the conversion has failed
+        del rows[relpath]
+    return rows
+
+
+def _frame_instances(path, relpath, tags, engine):
+    # Returns the rows of the frames as virtual instances
+    try:
+        array = multiframe.frame_values(os.path.join(path, relpath), tags)
+    except Exception:
+        return _split(path, relpath, tags, engine)
+    return {
+        multiframe.frame_path(relpath, n+1): dict(zip(tags, row)) 
+        for n, row in enumerate(array)
+    }
+
+
+def _written_by_dbdicom(row):
+    return row.get(PRIVATE_CREATOR) == enhanced_mr_image.PRIVATE_CREATOR
+
+
+def _convert_multiframe(path, relpath, tags, engine, keep):
+    # Returns the rows of the frames as virtual instances if keep is 
+    # True. Otherwise returns the rows of the single-frame files, or 
+    # {} if the conversion has failed.
+    if keep:
+        return _frame_instances(path, relpath, tags, engine)
+    return _split(path, relpath, tags, engine)
+
+
+def _split(path, relpath, tags, engine):
+    filepath = os.path.join(path, relpath)
+    try:
+        singleframe_files, array = multiframe.split_multiframe(filepath, tags)
+    except Exception:
+        # Classes that are not supported natively are left to dcm4che
+        singleframe_files = dcm4che.split_multiframe(filepath)
+        array = None
+    if singleframe_files == []:
+        return {}
+    if array is None:
+        array, dicom_files = _read_files(path, singleframe_files, tags, engine)
+    else:
+        dicom_files = [os.path.relpath(f, path) for f in singleframe_files]
+    # delete the original multiframe 
+    os.remove(filepath)
+    return {f: dict(zip(tags, row)) for f, row in zip(dicom_files, array)}
+
+
+def _tree(rows):
     # A human-readable summary tree
     # TODO: Add version number
 
-    df.sort_values(['PatientID','StudyInstanceUID','SeriesNumber'], inplace=True)
-    df = df.fillna('None')
+    # Single pass over the instances sorted by patient, study and 
+    # series number. The sort is stable, so instances of the same 
+    # series remain in the order in which they were read. 
+    relpaths = sorted(rows, key=lambda f: (
+        _sort_key(rows[f]['PatientID']), 
+        _sort_key(rows[f]['StudyInstanceUID']), 
+        _sort_key(rows[f]['SeriesNumber']),
+    ))
+
     summary = []
+    patients = {}
+    studies = {}
+    series = {}
+    instances = set()
 
-    for uid_patient in df.PatientID.unique():
-        df_patient = df[df.PatientID == uid_patient]
-        patient_name = df_patient.PatientName.values[0]
-        patient = {
-            'PatientName': patient_name,
-            'PatientID': uid_patient,
-            'studies': [],
-        }
-        summary.append(patient)
-        for uid_study in df_patient.StudyInstanceUID.unique():
-            df_study = df_patient[df_patient.StudyInstanceUID == uid_study]
-            study_desc = df_study.StudyDescription.values[0]
-            study_id = df_study.StudyID.values[0]
-            study_date = df_study.StudyDate.values[0]
+    for relpath in relpaths:
+        row = rows[relpath]
+
+        uid_patient = _fill(row['PatientID'])
+        patient = patients.get(uid_patient)
+        if patient is None:
+            patient = {
+                'PatientName': _fill(row['PatientName']),
+                'PatientID': uid_patient,
+                'studies': [],
+            }
+            patients[uid_patient] = patient
+            summary.append(patient)
+
+        uid_study = (uid_patient, _fill(row['StudyInstanceUID']))
+        study = studies.get(uid_study)
+        if study is None:
             study = {
-                'StudyDescription': study_desc,
-                'StudyDate': study_date,
-                'StudyID': study_id,
-                'StudyInstanceUID': uid_study,
+                'StudyDescription': _fill(row['StudyDescription']),
+                'StudyDate': _fill(row['StudyDate']),
+                'StudyID': _fill(row['StudyID']),
+                'StudyInstanceUID': uid_study[1],
                 'series': [],
             }
+            studies[uid_study] = study
             patient['studies'].append(study)
-            for uid_sery in df_study.SeriesInstanceUID.unique():
-                df_series = df_study[df_study.SeriesInstanceUID == uid_sery]
-                series_desc = df_series.SeriesDescription.values[0]
-                series_nr = int(df_series.SeriesNumber.values[0])
-                series = {
-                    'SeriesNumber': series_nr,
-                    'SeriesDescription': series_desc,
-                    'SeriesInstanceUID': uid_sery,
-                    'instances': {},
-                }
-                study['series'].append(series)
-                for uid_instance in df_series.SOPInstanceUID.unique():
-                    df_instance = df_series[df_series.SOPInstanceUID == uid_instance]
-                    instance_nr = int(df_instance.InstanceNumber.values[0])
-                    relpath = df_instance.index[0]
-                    series['instances'][instance_nr]=relpath
-
-    return summary
\ No newline at end of file
+
+        uid_sery = uid_study + (_fill(row['SeriesInstanceUID']), )
+        sery = series.get(uid_sery)
+        if sery is None:
+            sery = {
+                'SeriesNumber': int(_fill(row['SeriesNumber'])),
+                'SeriesDescription': _fill(row['SeriesDescription']),
+                'SeriesInstanceUID': uid_sery[2],
+                'instances': {},
+            }
+            series[uid_sery] = sery
+            study['series'].append(sery)
+
+        # If the same instance is found in more than one file, 
+        # only the first one is included.
+        uid_instance = uid_sery + (_fill(row['SOPInstanceUID']), )
+        if uid_instance in instances:
+            continue
+        instances.add(uid_instance)
+        instance_nr = int(_fill(row['InstanceNumber']))
+        sery['instances'][instance_nr] = relpath
+
+    return register.DbTree(summary)
+
+
+def _sort_key(value):
+    # Missing values are sorted last
+    return (value is None, value)
+
+
+def _fill(value):
+    # Missing values are written as 'None' in the register
+    return 'None' if value is None else value
@@ -288,6 +288,42 @@ def pixel_data(ds):
     return np.transpose(array)
 
 
+def pixel_data_dtype(ds):
+    # Data type of the array returned by pixel_data(), from the header 
+    # only. Returns None if this can't be known without the pixel data.
+    mod = SOPCLASSMODULE.get(ds.SOPClassUID)
+    if mod is None:
+        return None
+    if hasattr(mod, 'pixel_data_dtype'):
+        return getattr(mod, 'pixel_data_dtype')(ds)
+    if hasattr(mod, 'pixel_data'):
+        return None
+    return np.float32
+
+
+def rescale(ds):
+    # Slope and intercept that map the stored values to the values 
+    # returned by pixel_data().
+    mod = SOPCLASSMODULE[ds.SOPClassUID]
+    if hasattr(mod, 'rescale'):
+        return getattr(mod, 'rescale')(ds)
+    slope = float(getattr(ds, 'RescaleSlope', 1)) 
+    intercept = float(getattr(ds, 'RescaleIntercept', 0)) 
+    return slope, intercept
+
+
+def stored_dtype(ds):
+    # Numpy data type of uncompressed pixel data, or None if the 
+    # values can't be read as they are stored.
+    if ds.get('SamplesPerPixel', 1) != 1:
+        return None
+    bits = ds.get('BitsAllocated')
+    if bits not in [8, 16, 32] or ds.get('BitsStored') != bits:
+        return None
+    kind = 'i' if ds.get('PixelRepresentation') == 1 else 'u'
+    return np.dtype(f"<{kind}{bits//8}")
+
+
 def set_pixel_data(ds, array):
     if array is None:
         raise ValueError('The pixel array cannot be set to an empty value.')
@@ -4,7 +4,11 @@ import json
 from typing import Union
 import zipfile
 import re
+import math
+import tempfile
 from copy import deepcopy
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 from tqdm import tqdm
 import numpy as np
@@ -13,9 +17,18 @@ from pydicom.dataset import Dataset
 import pydicom
 
 import dbdicom.utils.arrays
+import dbdicom.utils.files as filetools
+import dbdicom.utils.multiframe as mf
+from dbdicom.utils.pixel_map import PixelMap, PixelFiles, LazyVolume
+from dbdicom.utils.slice_cache import SliceCache
+from dbdicom.utils.encoder import TemplateEncoder
+from dbdicom.utils.image import affine_matrix
 import dbdicom.dataset as dbdataset
+from dbdicom.sop_classes import enhanced_mr_image
 import dbdicom.database as dbdatabase
 import dbdicom.register as register
+import dbdicom.register_sqlite as register_sqlite
+import dbdicom.header_cache as header_cache
 import dbdicom.const as const
 from dbdicom.utils.pydicom_dataset import (
     get_values, 
@@ -25,24 +38,186 @@ from dbdicom.utils.pydicom_dataset import (
 
 
 
+BACKENDS = ['json', 'sqlite']
+MODES = ['r', 'a']
+
+
 class DataBaseDicom():
     """Class to read and write a DICOM folder.
 
     Args:
         path (str): path to the DICOM folder.
+        workers (int, optional): number of processes used when the 
+            folder needs to be scanned. If workers is None, all 
+            available CPUs are used. Defaults to 1.
+        engine (str, optional): how to read the file headers when the 
+            folder needs to be scanned ('pydicom' or 'raw'). 
+            Defaults to 'pydicom'.
+        backend (str, optional): where the register is saved. With 
+            'json' the register is held in memory and saved in 
+            dbtree.json when the database is closed. With 'sqlite' 
+            the register is saved in an SQLite database dbtree.sqlite, 
+            and changes are written to disk as they are made. A 
+            register saved with the other backend is converted. If 
+            backend is None, 'sqlite' is used if the folder has an 
+            SQLite register and 'json' otherwise. Defaults to None.
+        mode (str, optional): with 'a' the database can be read and 
+            modified, and the folder is created if it does not exist. 
+            With 'r' the database is read-only: the register is loaded 
+            once, and functions that modify the database raise an 
+            error. Nothing is written to the folder, and the backend 
+            of the existing register is used. If the folder has no 
+            register, it is scanned but the result is not saved. 
+            Defaults to 'a'.
+        cache (int, optional): memory budget in bytes for a cache of 
+            decoded files. When this is set, the headers and pixel 
+            arrays that are read are kept in memory, so that reading 
+            the same files again does not decode them again. The 
+            least recently used files are dropped when the cache is 
+            full. If cache is None, files are read from disk each 
+            time. Defaults to None.
+        columns (list, optional): attributes to save in the register 
+            for each file, in addition to those needed to identify 
+            the files. values(), unique() and split_series() read 
+            them from the register instead of the files. If these 
+            are not yet in the register, the folder is read again 
+            to add them. Columns added before are kept. 
+            Defaults to None.
+        split_multiframe (bool, optional): if True, multiframe files 
+            found when the folder is read are replaced by single-frame 
+            files. If False, the files are left as they are, and each 
+            frame is a virtual instance in the register. The path of 
+            a virtual instance is the path of the file with the frame 
+            number added, as returned by multiframe.frame_path(), and 
+            the frame is read from the multiframe file. Multiframe 
+            classes that can't be read in this way are still split. 
+            The setting is saved with the register. If it is None, 
+            the saved setting is used, or True if there is none. 
+            Defaults to None.
     """
 
-    def __init__(self, path):
+    def __init__(self, path, workers=1, engine='pydicom', backend=None, mode='a', cache=None, columns=None, split_multiframe=None):
 
+        if mode not in MODES:
+            raise ValueError(
+                f"Mode {mode} is not supported. "
+                f"Please choose one of {MODES}."
+            )
+        self.mode = mode
         if not os.path.exists(path):
+            if mode == 'r':
+                raise FileNotFoundError(f"The folder {path} does not exist.")
             os.makedirs(path)
         self.path = path
+        # True if the register has changes that are not saved
+        self.dirty = False
+        self.cache = None if cache is None else SliceCache(path, cache)
+        # Fingerprints {rel_path: [size, mtime_ns]} - None if not recorded
+        self.fingerprints = None
+        # Extra columns {rel_path: [values]} - None if there are none
+        self.columns = [] if columns is None else list(columns)
+        self.column_values = None
+        if split_multiframe is None:
+            split_multiframe = self._read_settings().get('split_multiframe', True)
+        self.split_multiframe = split_multiframe
+        # Buffer of register changes while in batch() - None otherwise
+        self._batch = None
+
+        if mode == 'r':
+            self._open_readonly(workers, engine)
+            self._add_columns(columns, workers, engine)
+            return
+
+        if backend is None:
+            backend = 'sqlite' if os.path.exists(self._sqlite_file()) else 'json'
+        if backend not in BACKENDS:
+            raise ValueError(
+                f"Backend {backend} is not supported. "
+                f"Please choose one of {BACKENDS}."
+            )
+        self.backend = backend
+        if backend == 'sqlite':
+            self._open_sqlite(workers, engine)
+        else:
+            self._open_json(workers, engine)
+        self._save_settings()
+        self._add_columns(columns, workers, engine)
+
+
+    def _add_columns(self, columns, workers, engine):
+        # Read the folder again if columns are requested that are not 
+        # in the register yet.
+        if columns is None or set(columns) <= set(self.columns):
+            return
+        if self.mode == 'r' and self.backend == 'sqlite':
+            raise ValueError(
+                f"Cannot add columns {columns} to the register. The "
+                f"database is open in read-only mode."
+            )
+        self.columns = self.columns + [c for c in columns if c not in self.columns]
+        self.read(workers, engine)
+
+
+    def _read_settings(self):
+        # Settings saved with the register, in the backend it is saved in
+        if os.path.exists(self._sqlite_file()):
+            dbtree = register_sqlite.SqliteTree(self._sqlite_file(), readonly=True)
+            try:
+                return dbtree.settings()
+            finally:
+                dbtree.close()
+        file = self._settings_file()
+        if not os.path.exists(file):
+            return {}
+        try:
+            with open(file, 'r') as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def _save_settings(self):
+        # With the json backend, the settings are saved on close()
+        settings = {'split_multiframe': self.split_multiframe}
+        if self.backend == 'sqlite':
+            if self.register.settings() != settings:
+                self.register.set_settings(settings)
+        elif self._read_settings() != settings:
+            self.dirty = True
+
+    def _set_columns(self, stored):
+        # Use the columns saved with the register: (names, values) or None
+        if stored is None:
+            self.columns, self.column_values = [], None
+        else:
+            self.columns, self.column_values = stored
+
+
+    def _open_json(self, workers, engine):
+        sqlite_file = self._sqlite_file()
+        if os.path.exists(sqlite_file):
+            # Convert from the SQLite register
+            dbtree = register_sqlite.SqliteTree(sqlite_file)
+            self.register = register.DbTree(dbtree.to_list())
+            self.fingerprints = dbtree.fingerprints()
+            if self.fingerprints is not None:
+                self.fingerprints = dict(self.fingerprints.items())
+            stored = dbtree.columns()
+            if stored is not None:
+                stored = (stored[0], dict(stored[1].items()))
+            self._set_columns(stored)
+            dbtree.close()
+            self.dirty = True
+            self.close()
+            os.remove(sqlite_file)
+            return
 
         file = self._register_file()
         if os.path.exists(file):
             try:
                 with open(file, 'r') as f:
-                    self.register = json.load(f)
+                    self.register = register.DbTree(json.load(f))
+                self.fingerprints = self._read_fingerprints()
+                self._set_columns(self._read_columns())
                 # remove the json file after reading it. If the database
                 # is not properly closed this will prevent that changes
                 # have been made which are not reflected in the json 
@@ -56,22 +231,234 @@ class DataBaseDicom():
                 # )
                 # If the file can't be read, delete it and load again
                 os.remove(file)
-                self.read()
+                self.read(workers, engine)
+        else:
+            self.read(workers, engine)
+
+
+    def _open_readonly(self, workers, engine):
+        if os.path.exists(self._sqlite_file()):
+            self.backend = 'sqlite'
+            self.register = register_sqlite.SqliteTree(self._sqlite_file(), readonly=True)
+            self.fingerprints = self.register.fingerprints()
+            self._set_columns(self.register.columns())
+            return
+        self.backend = 'json'
+        file = self._register_file()
+        try:
+            with open(file, 'r') as f:
+                self.register = register.DbTree(json.load(f))
+        except Exception:
+            # Missing or unreadable - scan the folder instead
+            self.read(workers, engine)
+        else:
+            self.fingerprints = self._read_fingerprints()
+            self._set_columns(self._read_columns())
+
+
+    def _check_writable(self):
+        if self.mode == 'r':
+            raise ValueError(
+                f"Cannot modify {self.path}. The database is open in "
+                f"read-only mode."
+            )
+
+
+    def _open_sqlite(self, workers, engine):
+        file = self._sqlite_file()
+        exists = os.path.exists(file)
+        self.register = register_sqlite.SqliteTree(file)
+        if exists:
+            self.fingerprints = self.register.fingerprints()
+            self._set_columns(self.register.columns())
+            return
+
+        # Convert from dbtree.json
+        json_file = self._register_file()
+        if not os.path.exists(json_file):
+            self.read(workers, engine)
+            return
+        try:
+            with open(json_file, 'r') as f:
+                self.register.load(json.load(f))
+        except Exception:
+            self.read(workers, engine)
         else:
-            self.read()
+            fingerprints = self._read_fingerprints()
+            if fingerprints is None:
+                self.fingerprints = None
+            else:
+                self.fingerprints = self.register.set_fingerprints(fingerprints)
+            stored = self._read_columns()
+            if stored is not None:
+                stored = (stored[0], self.register.set_columns(*stored))
+            self._set_columns(stored)
+        os.remove(json_file)
+        for file in [self._fingerprint_file(), self._columns_file(), self._settings_file()]:
+            if os.path.exists(file):
+                os.remove(file)
 
 
-    def read(self):
+    def read(self, workers=1, engine='pydicom'):
         """Read the DICOM folder again
+
+        Args:
+            workers (int, optional): number of processes used to 
+                scan the folder. If workers is None, all available 
+                CPUs are used. Defaults to 1.
+            engine (str, optional): how to read the file headers. With 
+                'pydicom' the headers are read by pydicom. With 'raw' 
+                the header bytes are parsed directly, which is faster 
+                but falls back on pydicom for less common encodings. 
+                Defaults to 'pydicom'.
         """
-        self.register = dbdatabase.read(self.path)
+        if self.backend == 'sqlite':
+            self._check_writable()
+        fingerprints = filetools.fingerprints(self.path, self._db_files())
+        files = [os.path.join(self.path, f) for f in fingerprints]
+        if self.columns == []:
+            dbtree = dbdatabase.read(self.path, workers, files, engine, self.split_multiframe)
+        else:
+            dbtree, values = dbdatabase.read_columns(self.path, self.columns, workers, files, engine, self.split_multiframe)
+        if self.backend == 'sqlite':
+            self.register.load(dbtree)
+        else:
+            self.register = dbtree
+        self.fingerprints = self._reconcile_fingerprints(fingerprints)
+        if self.columns != []:
+            # Only keep values of files in the register
+            indexed = register.index(self.register, self.path)
+            values = {f: values[f] for f in indexed}
+            if self.backend == 'sqlite':
+                values = self.register.set_columns(self.columns, values)
+            self.column_values = values
+        self.dirty = True
         # For now ensure all series have just a single CIOD
         # Leaving this out for now until the issue occurs again.
         # self._split_series()
         return self
+    
+
+    def refresh(self, workers=1, engine='pydicom'):
+        """Update the register with changes in the DICOM folder
+
+        Only files that are new or have changed since the last scan 
+        are read. Files that have been removed are dropped from the 
+        register. If the folder has not been fingerprinted before, 
+        this reads the whole folder again.
 
+        Args:
+            workers (int, optional): number of processes used to 
+                read the new files. If workers is None, all available 
+                CPUs are used. Defaults to 1.
+            engine (str, optional): how to read the file headers 
+                ('pydicom' or 'raw'). Defaults to 'pydicom'.
+        """
+        if self.backend == 'sqlite':
+            self._check_writable()
+        if self.fingerprints is None:
+            return self.read(workers, engine)
+        fingerprints = filetools.fingerprints(self.path, self._db_files())
+        # With the sqlite backend these are read in one query
+        old = dict(self.fingerprints.items())
+        removed = [f for f, fp in old.items() if fingerprints.get(f) != fp]
+        added = [f for f, fp in fingerprints.items() if old.get(f) != fp]
+        removed = self._instances_in(removed)
+        register.drop(self.register, removed)
+        if self.column_values is not None:
+            for f in removed:
+                self.column_values.pop(f, None)
+        if added != []:
+            files = [os.path.join(self.path, f) for f in added]
+            columns = self.columns if self.column_values is not None else None
+            new_instances = dbdatabase.instances(self.path, files, workers, engine, columns, self.split_multiframe)
+            for rel_path, attr in new_instances.items():
+                register.add_instance(self.register, attr, rel_path)
+                if columns is not None:
+                    self.column_values[rel_path] = [attr[c] for c in columns]
+        self.fingerprints = self._reconcile_fingerprints(fingerprints, old)
+        self.dirty = True
+        return self
     
 
+    def _reconcile_fingerprints(self, fingerprints, old=None):
+        # Multiframe files are replaced by single frame files while 
+        # reading, so fingerprints taken before reading need updating.
+        # Virtual instances are fingerprinted by their file. With the 
+        # sqlite backend only the fingerprints that differ from the 
+        # old ones are written.
+        indexed = {mf.source(f) for f in register.index(self.register, self.path)}
+        for rel_path in indexed - set(fingerprints):
+            fingerprints[rel_path] = filetools.fingerprint(os.path.join(self.path, rel_path))
+        for rel_path in set(fingerprints) - indexed:
+            if not os.path.exists(os.path.join(self.path, rel_path)):
+                del fingerprints[rel_path]
+        if self.backend != 'sqlite':
+            return fingerprints
+        if self.fingerprints is None:
+            return self.register.set_fingerprints(fingerprints)
+        if old is None:
+            old = dict(self.fingerprints.items())
+        self.fingerprints.update({f: fp for f, fp in fingerprints.items() if old.get(f) != fp})
+        self.fingerprints.drop([f for f in old if f not in fingerprints])
+        return self.fingerprints
+
+    def _instances_in(self, rel_paths):
+        # Instances held by files: the files themselves, and frames 
+        # of multiframe files that are virtual instances.
+        if rel_paths == []:
+            return []
+        files = set(rel_paths)
+        frames = [
+            f for f in register.index(self.register, self.path) 
+            if f not in files and mf.source(f) in files
+        ]
+        return list(rel_paths) + frames
+
+    def _remove_files(self, removed):
+        # Delete the files of instances that have been removed from the 
+        # register. A multiframe file is only deleted when none of its 
+        # frames are left.
+        sources = {mf.source(idx) for idx in removed}
+        if sources != set(removed):
+            left = {mf.source(f) for f in register.index(self.register, self.path)}
+            sources -= left
+        for idx in removed:
+            file = os.path.join(self.path, idx)
+            if self.cache is not None:
+                self.cache.invalidate(file)
+            if self.column_values is not None:
+                self.column_values.pop(idx, None)
+        for idx in sources:
+            file = os.path.join(self.path, idx)
+            if os.path.exists(file): 
+                os.remove(file)
+            if self.fingerprints is not None:
+                self.fingerprints.pop(idx, None)
+    
+    def _read_columns(self):
+        file = self._columns_file()
+        if not os.path.exists(file):
+            return None
+        try:
+            with open(file, 'r') as f:
+                stored = json.load(f)
+            return stored['columns'], stored['values']
+        except Exception:
+            return None
+
+    def _read_fingerprints(self):
+        file = self._fingerprint_file()
+        if not os.path.exists(file):
+            return None
+        try:
+            with open(file, 'r') as f:
+                return json.load(f)
+        except Exception:
+            # If the file can't be read the next refresh reads all files
+            return None
+
+
     def delete(self, entity, not_exists_ok=False):
         """Delete a DICOM entity from the database
 
@@ -80,6 +467,8 @@ class DataBaseDicom():
             not_exists_ok (bool): By default, an exception is raised when attempting 
                 to delete an entity that does not exist. Set this to True to pass over this silently.
         """
+        self._check_writable()
+        self._flush()
         # delete datasets on disk
         try:
             removed = register.index(self.register, entity)
@@ -91,12 +480,17 @@ class DataBaseDicom():
                     f"The entity you are trying to delete does not exist. \n"
                     f"You can set not_exists_ok=True in dbdicom.delete() to avoid this error."
                 )
-        for index in removed:
-            file = os.path.join(self.path, index)
-            if os.path.exists(file): 
-                os.remove(file)
+        if os.path.isdir(os.path.join(self.path, header_cache.FOLDER)):
+            if isinstance(entity, str) or len(entity) < 4:
+                series = self.series(entity)
+            else:
+                series = [entity]
+            for s in series:
+                header_cache.remove(self.path, register.series_uid(self.register, s))
         # drop the entity from the register
         register.remove(self.register, entity)
+        self._remove_files(removed)
+        self.dirty = True
         # cleanup empty folders
         remove_empty_folders(entity[0])
         return self
@@ -105,16 +499,56 @@ class DataBaseDicom():
     def close(self): 
         """Close the DICOM folder
         
-        This also saves changes in the header file to disk.
+        This also saves changes in the header file to disk, if 
+        there are any. In read-only mode nothing is saved.
         """
+        if self.mode == 'r':
+            if self.backend == 'sqlite':
+                self.register.close()
+            return self
+        self._flush()
+        if self.backend == 'sqlite':
+            # Changes are already on disk
+            self.register.close()
+            self.dirty = False
+            return self
+        if not self.dirty:
+            return self
         file = self._register_file()
         with open(file, 'w') as f:
             json.dump(self.register, f, indent=4)
+        if self.fingerprints is not None:
+            with open(self._fingerprint_file(), 'w') as f:
+                json.dump(self.fingerprints, f)
+        if self.column_values is not None:
+            with open(self._columns_file(), 'w') as f:
+                stored = {'columns': self.columns, 'values': self.column_values}
+                json.dump(stored, f, default=register_sqlite._to_json)
+        with open(self._settings_file(), 'w') as f:
+            json.dump({'split_multiframe': self.split_multiframe}, f)
+        self.dirty = False
         return self
 
     def _register_file(self):
         return os.path.join(self.path, 'dbtree.json') 
     
+    def _sqlite_file(self):
+        return os.path.join(self.path, 'dbtree.sqlite')
+
+    def _fingerprint_file(self):
+        return os.path.join(self.path, 'dbfiles.json')
+
+    def _columns_file(self):
+        return os.path.join(self.path, 'dbcolumns.json')
+
+    def _settings_file(self):
+        return os.path.join(self.path, 'dbsettings.json')
+    
+    def _db_files(self):
+        # Files in the folder that are not part of the DICOM data
+        sqlite_files = ['dbtree.sqlite' + f for f in [''] + register_sqlite.SIDE_FILES]
+        return ['dbtree.json', 'dbfiles.json', 'dbcolumns.json', 'dbsettings.json', header_cache.FOLDER] + sqlite_files
+    
 
     def summary(self):
         """Return a summary of the contents of the database.
@@ -221,13 +655,26 @@ class DataBaseDicom():
             return register.series(self.register, entity, desc, contains, isin)
 
 
-    def volume(self, entity:Union[list, str], dims:list=None, verbose=1) -> vreg.Volume3D:
+    def volume(self, entity:Union[list, str], dims:list=None, verbose=1, workers=1, bbox=None, slices=None) -> vreg.Volume3D:
         """Read volume.
 
         Args:
             entity (list, str): DICOM series to read
             dims (list, optional): Non-spatial dimensions of the volume. Defaults to None.
             verbose (bool, optional): If set to 1, shows progress bar. Defaults to 1.
+            workers (int, optional): number of files read at the same 
+                time. Files are read in threads, or in processes if the 
+                pixel data are compressed. If workers is None, all 
+                available CPUs are used. Defaults to 1.
+            bbox (tuple, optional): in-plane window ((xmin, xmax), 
+                (ymin, ymax)) to read, in pixel indices along the first 
+                two axes, with the maximum excluded. Where the files are 
+                uncompressed, only the window is read from disk. If 
+                this is None, whole slices are read. Defaults to None.
+            slices (tuple, optional): range (min, max) of slice 
+                locations to read, limits included. Only the files in 
+                this range are decoded. If this is None, all slices 
+                are read. Defaults to None.
 
         Returns:
             vreg.Volume3D:
@@ -249,66 +696,164 @@ class DataBaseDicom():
         values = [[] for _ in dims]
         volumes = []
 
-        files = register.files(self.register, entity)
-        for f in tqdm(files, desc='Reading volume..', disable=(verbose==0)):
-            ds = pydicom.dcmread(f)
-            values_f = get_values(ds, dims)
+        files = self._slice_files(entity, slices, verbose)
+        for values_f, vol in _read_slices(files, dims, False, workers, verbose, bbox, self.cache):
             for d in range(len(dims)):
                 values[d].append(values_f[d])
-            volumes.append(dbdataset.volume(ds))
+            volumes.append(vol)
 
-        # Format coordinates as mesh
-        coords = [np.array(v) for v in values]
-        coords, inds = dbdicom.utils.arrays.meshvals(coords)
-
-        # Check that all slices have the same coordinates
-        if len(dims) > 1:
-            # Loop over all coordinates after slice location
-            for c in coords[1:]:
-                # Loop over all slice locations
-                for k in range(1, c.shape[0]):
-                    # Coordinate c of slice k
-                    if not np.array_equal(c[k,...], c[0,...]):
-                        raise ValueError(
-                            "Cannot build a single volume. Not all slices "
-                            "have the same coordinates."     
-                        )
+        coords, inds = _sort_slices(values)
 
         # Build volumes
         vols = np.array(volumes)
         vols = vols[inds].reshape(coords[0].shape)
+        return _join_slices(vols, coords, dims)
 
-        # Infer spacing between slices from slice locations
-        # Technically only necessary if SpacingBetweenSlices not set or incorrect
-        vols = infer_slice_spacing(vols)
 
-        # Join 2D volumes into 3D volumes
-        try:
-            vol = vreg.join(vols)
-        except ValueError:
-            # some vendors define the slice vector as -cross product 
-            # of row and column vector. Check if that solves the issue.
-            for v in vols.reshape(-1):
-                v.affine[:3,2] = -v.affine[:3,2]
-                # Then try again
-            vol = vreg.join(vols)
-
-        # For multi-dimensional volumes, set dimensions and coordinates
-        if vol.ndim > 3:
-            # Coordinates of slice 0
-            c0 = [c[0,...] for c in coords[1:]]
-            vol.set_coords(c0)
-            vol.set_dims(dims[1:])
-        return vol
-
-
-    def volumes_2d(self, entity:Union[list, str], dims:list=None, verbose=1) -> list:
+    def lazy_volume(self, entity:list, dims:list=None, verbose=1) -> LazyVolume:
+        """Read the geometry of a volume, but not the pixel data.
+
+        The slices are sorted and the affine is built from the headers 
+        only. The pixel data of a slice are read when they are 
+        indexed, so that parts of a large series can be inspected 
+        without reading all of it.
+
+        Args:
+            entity (list): DICOM series to read
+            dims (list, optional): Non-spatial dimensions of the volume. Defaults to None.
+            verbose (bool, optional): If set to 1, shows progress bar. Defaults to 1.
+
+        Returns:
+            LazyVolume: array-like object with the same shape, affine, 
+            dims and coords as the result of volume(). Indexing it 
+            returns a numpy array, and volume() returns the vreg.Volume3D.
+        """
+        if dims is None:
+            dims = []
+        elif isinstance(dims, str):
+            dims = [dims]
+        else:
+            dims = list(dims)
+        dims = ['SliceLocation'] + dims
+
+        # Read the headers, or the cached header values
+        geometry = [
+            'NumberOfFrames', 'Columns', 'Rows', 'ImageOrientationPatient', 
+            'ImagePositionPatient', 'PixelSpacing', 'SpacingBetweenSlices', 
+            'SliceThickness',
+        ]
+        files = register.files(self.register, entity)
+        headers = self._header_values(entity, geometry + dims)
+        if headers is None:
+            headers, dtypes = [], []
+            for f in tqdm(files, desc='Reading headers..', disable=(verbose==0)):
+                ds = mf.dcmread(f, stop_before_pixels=True)
+                headers.append(get_values(ds, geometry + dims))
+                dtypes.append(dbdataset.pixel_data_dtype(ds))
+        else:
+            # The data type is not cached
+            dtypes = [None]
+
+        # Build a 1-pixel volume for the geometry of each slice
+        values = [[] for _ in dims]
+        volumes = []
+        shape = None
+        for f, row in zip(files, headers):
+            frames, columns, rows, orientation, position, spacing = row[:6]
+            if int(frames or 1) != 1:
+                raise ValueError(
+                    f"Cannot read a lazy volume from {f}. This is only "
+                    f"possible for single-frame images."
+                )
+            if shape is None:
+                shape = (columns, rows)
+            elif (columns, rows) != shape:
+                raise ValueError(
+                    "Cannot build a single volume. Not all slices have "
+                    "the same shape."
+                )
+            # As in dbdicom.dataset.affine()
+            slice_spacing = row[6] if row[6] is not None else row[7]
+            affine = affine_matrix(orientation, position, spacing, slice_spacing)
+            volumes.append(vreg.volume(np.zeros((1, 1)), affine))
+            for d in range(len(dims)):
+                values[d].append(row[len(geometry) + d])
+
+        coords, inds = _sort_slices(values)
+        vols = np.array(volumes)
+        vols = vols[inds].reshape(coords[0].shape)
+        vol = _join_slices(vols, coords, dims)
+        files = np.array(files)[inds].reshape(coords[0].shape)
+
+        # If the data type is not known from the headers, it is taken 
+        # from the first slice that is read.
+        dtype = None if None in dtypes else np.result_type(*dtypes)
+        values = PixelFiles(files, shape, dtype)
+        return LazyVolume(values, vol.affine, vol.dims, vol.coords)
+
+
+    def iter_volumes(self, entity:list, dims:list=None, over='AcquisitionTime', verbose=1, workers=1):
+        """Iterate over the volumes along one non-spatial dimension.
+
+        The headers are read and sorted once, and then the pixel data 
+        of one volume are read at each iteration. Only one volume is 
+        in memory at any time, so this can process series that are 
+        too large to read with volume().
+
+        Args:
+            entity (list): DICOM series to read
+            dims (list, optional): Non-spatial dimensions of the series. 
+                If over is not in dims, it is added as the last 
+                dimension. Defaults to None.
+            over (str, optional): Dimension to iterate over. 
+                Defaults to 'AcquisitionTime'.
+            verbose (bool, optional): If set to 1, shows progress bar 
+                when reading the headers. Defaults to 1.
+            workers (int, optional): number of files read at the same 
+                time, as in volume(). Defaults to 1.
+
+        Yields:
+            vreg.Volume3D: the volume at each value of over, in 
+            ascending order. The volumes have the dimensions in dims 
+            other than over.
+        """
+        if dims is None:
+            dims = []
+        elif isinstance(dims, str):
+            dims = [dims]
+        else:
+            dims = list(dims)
+        if over not in dims:
+            dims.append(over)
+        lazy = self.lazy_volume(entity, dims, verbose)
+        axis = dims.index(over)
+        other_dims = dims[:axis] + dims[axis+1:]
+        for k in range(lazy.shape[3 + axis]):
+            files = np.take(lazy.values.files, k, axis=1 + axis)
+            slices = _read_slices(files.reshape(-1), [], False, workers, 0, cache=self.cache)
+            values = np.stack([v.values[...,0] for _, v in slices], axis=-1)
+            values = values.reshape(values.shape[:2] + files.shape)
+            vol = vreg.volume(values, lazy.affine.copy())
+            if other_dims:
+                coords = lazy.coords[:axis] + lazy.coords[axis+1:]
+                vol.set_coords([np.take(c, k, axis=axis) for c in coords])
+                vol.set_dims(other_dims)
+            yield vol
+
+
+    def volumes_2d(self, entity:Union[list, str], dims:list=None, verbose=1, workers=1, bbox=None, slices=None) -> list:
         """Read 2D volumes from the series
 
         Args:
             entity (list, str): DICOM series to read
             dims (list, optional): Non-spatial dimensions of the volume. Defaults to None.
             verbose (bool, optional): If set to 1, shows progress bar. Defaults to 1.
+            workers (int, optional): number of files read at the same 
+                time, as in volume(). Defaults to 1.
+            bbox (tuple, optional): in-plane window to read, as in 
+                volume(). Defaults to None.
+            slices (tuple, optional): range of slice locations to 
+                read, as in volume(). Defaults to None.
 
         Returns:
             list of vreg.Volume3D
@@ -330,11 +875,8 @@ class DataBaseDicom():
         values = {}
         volumes = {}
 
-        files = register.files(self.register, entity)
-        for f in tqdm(files, desc='Reading volume..', disable=(verbose==0)):
-            ds = pydicom.dcmread(f)
-            values_f = get_values(ds, dims)
-            vol = dbdataset.volume(ds, multislice=True)
+        files = self._slice_files(entity, slices, verbose)
+        for values_f, vol in _read_slices(files, dims, True, workers, verbose, bbox, self.cache):
             slice_loc = values_f[0]
             if slice_loc in volumes:
                 volumes[slice_loc].append(vol)
@@ -397,7 +939,7 @@ class DataBaseDicom():
         return volumes_2d
 
 
-    def pixel_data(self, series:list, dims:list=None, verbose=1) -> np.ndarray:
+    def pixel_data(self, series:list, dims:list=None, verbose=1, out=None, mmap=False, bbox=None, slices=None) -> np.ndarray:
         """Read the pixel data from a DICOM series
 
         Args:
@@ -406,12 +948,68 @@ class DataBaseDicom():
                 patient or study to read all series in that patient or 
                 study. In those cases a list is returned.
             dims (list, optional): Dimensions of the array.
+            out (numpy.ndarray, optional): array to write the pixel 
+                values into. This must have the shape of the result, 
+                and values are cast to its data type. If this is not 
+                provided, a new array is returned.
+            mmap (bool, optional): if True, the pixel data are not 
+                read but memory-mapped, and a PixelMap is returned. 
+                This reads the values, and applies the rescale slope 
+                and intercept, only for the part of the array that is 
+                indexed. It requires uncompressed little endian files 
+                with one frame each. Defaults to False.
+            bbox (tuple, optional): in-plane window to read, as in 
+                volume(). This can't be combined with mmap - index 
+                the PixelMap instead. Defaults to None.
+            slices (tuple, optional): range of slice locations to 
+                read, as in volume(). Defaults to None.
 
         Returns:
             numpy.ndarray or tuple: numpy array with pixel values, with 
                 at least 3 dimensions (x,y,z). 
         """
-        vols = self.volumes_2d(series, dims, verbose)
+        if dims is None:
+            dims = []
+        elif isinstance(dims, str):
+            dims = [dims]
+        else:
+            dims = list(dims)
+
+        # If the shape and data type can be found from the headers, 
+        # each slice is decoded straight into the final array.
+        files = self._slice_files(series, slices, verbose)
+        layout = _pixel_layout(files, ['SliceLocation'] + dims, verbose, self.cache)
+        if mmap:
+            if bbox is not None:
+                raise ValueError(
+                    "A bounding box can't be used with mmap=True. Index "
+                    "the memory-mapped array instead."
+                )
+            if layout is None:
+                raise ValueError(
+                    "Cannot memory-map the pixel data. This is only possible "
+                    "for single-frame images of a supported type."
+                )
+            return _pixel_map(files, *layout)
+        if layout is not None:
+            shape, dtype, positions, headers = layout
+            key = _bbox_key(bbox)
+            shape = np.broadcast_to(False, shape[:2])[key].shape + shape[2:]
+            if out is None:
+                out = np.empty(shape, dtype=dtype)
+            elif out.shape != shape:
+                raise ValueError(
+                    f"The out array has shape {out.shape} but the pixel "
+                    f"array has shape {shape}."
+                )
+            for f, ds, pos in tqdm(zip(files, headers, positions), total=len(files), desc='Reading pixel data..', disable=(verbose==0)):
+                if self.cache is None:
+                    out[pos] = _pixel_window(f, ds, key)
+                else:
+                    out[pos] = self.cache.read(f)[1][key]
+            return out
+
+        vols = self.volumes_2d(series, dims, verbose, bbox=bbox, slices=slices)
         for v in vols[1:]:
             if v.shape != vols[0].shape:
                 raise ValueError(
@@ -420,7 +1018,15 @@ class DataBaseDicom():
                 )
         slices = [v.values for v in vols]
         pixel_array = np.concatenate(slices, axis=2)
-        return pixel_array
+        if out is None:
+            return pixel_array
+        if out.shape != pixel_array.shape:
+            raise ValueError(
+                f"The out array has shape {out.shape} but the pixel "
+                f"array has shape {pixel_array.shape}."
+            )
+        out[...] = pixel_array
+        return out
         
     
 
@@ -453,14 +1059,17 @@ class DataBaseDicom():
         attr_values = [[] for _ in attr]
 
         files = register.files(self.register, series)
-        for f in tqdm(files, desc='Reading values..', disable=(verbose==0)):
-            ds = pydicom.dcmread(f)
-            coord_values_f = get_values(ds, dims)
+        headers = self._header_values(series, dims + list(attr))
+        if headers is None:
+            headers = []
+            for f in tqdm(files, desc='Reading values..', disable=(verbose==0)):
+                ds = mf.dcmread(f) if self.cache is None else self.cache.header(f)
+                headers.append(get_values(ds, dims) + get_values(ds, attr))
+        for row in headers:
             for d in range(len(dims)):
-                coord_values[d].append(coord_values_f[d])
-            attr_values_f = get_values(ds, attr)
+                coord_values[d].append(row[d])
             for a in range(len(attr)):
-                attr_values[a].append(attr_values_f[a])
+                attr_values[a].append(row[len(dims) + a])
 
         # Format coordinates as mesh
         coords = [np.array(v) for v in coord_values]
@@ -479,7 +1088,8 @@ class DataBaseDicom():
 
     def write_volume(
             self, vol:Union[vreg.Volume3D, tuple], series:list, 
-            ref:list=None, append=False, verbose=1,
+            ref:list=None, append=False, verbose=1, workers=1, 
+            multiframe=False,
         ):
         """Write a vreg.Volume3D to a DICOM series
 
@@ -492,7 +1102,21 @@ class DataBaseDicom():
                To overrule this behaviour and add the volume to an existing series, set append to True. 
                Default is False.
             verbose (bool): if set to 1, a progress bar is shown
+            workers (int, optional): number of processes used to write 
+                the slices. If workers is None, all available CPUs are 
+                used. UIDs and instance numbers are assigned in the order 
+                of the slices before writing, so the result does not 
+                depend on the number of workers. Defaults to 1.
+            multiframe (bool, optional): if True, the volume is written 
+                to a single Enhanced MR file, or a concatenation of a 
+                few files if the pixel data exceed 2GB. The frames are 
+                registered as instances of the series, and read in the 
+                same way as single-frame files. The pixel values are 
+                saved in 16 bit, as in single-frame files. 
+                Defaults to False.
         """
+        self._check_writable()
+        self._flush()
         series_full_name = full_name(series)
         if series_full_name in self.series():
             if not append:
@@ -510,33 +1134,85 @@ class DataBaseDicom():
                 ref_mgr = DataBaseDicom(ref[0])
             files = register.files(ref_mgr.register, ref)
             ref_mgr.close()
-            ds = pydicom.dcmread(files[0]) 
+            ds = mf.dcmread(files[0])
 
         # Get the attributes of the destination series
         attr = self._series_attributes(series)
         n = self._max_instance_number(attr['SeriesInstanceUID'])
 
+        if multiframe:
+            with self.batch():
+                self._write_multiframe(vol, ds, attr, n)
+            return self
+
         if vol.ndim==3:
             slices = vol.split()
-            for i, sl in tqdm(enumerate(slices), desc='Writing volume..', disable=verbose==0):
-                dbdataset.set_volume(ds, sl)
-                self._write_dataset(ds, attr, n + 1 + i)
         else:
-            i=0
-            vols = vol.separate().reshape(-1)
-            for vt in tqdm(vols, desc='Writing volume..', disable=verbose==0):
-                slices = vt.split()
-                for sl in slices:
-                    dbdataset.set_volume(ds, sl)
-                    sl_coords = [c.ravel()[0] for c in sl.coords]
-                    set_value(ds, sl.dims, sl_coords)
-                    self._write_dataset(ds, attr, n + 1 + i)
-                    i+=1
+            slices = [sl for vt in vol.separate().reshape(-1) for sl in vt.split()]
+        if workers is None:
+            workers = os.cpu_count()
+        with self.batch():
+            if workers == 1 or len(slices) < 2:
+                # Only the elements that change are encoded for each slice
+                encoder = TemplateEncoder()
+                for i, sl in tqdm(enumerate(slices), total=len(slices), desc='Writing volume..', disable=verbose==0):
+                    _set_slice(ds, sl, vol.ndim)
+                    self._write_dataset(ds, attr, n + 1 + i, encoder)
+            else:
+                self._write_slices(ds, slices, vol.ndim, attr, n, workers, verbose)
         return self
+
+
+    def _write_multiframe(self, vol, ref, attr, n):
+        # Each file is registered as virtual instances, one per frame.
+        # The frames are numbered after the existing instances.
+        for ds in enhanced_mr_image.concatenation(vol, ref, offset=n):
+            rel_path = self._new_file(attr, ds.InstanceNumber)
+            set_values(ds, list(attr.keys()), list(attr.values()))
+            file = os.path.join(self.path, rel_path)
+            dbdataset.write(ds, file)
+            if self.fingerprints is not None:
+                self._batch['fingerprints'][rel_path] = filetools.fingerprint(file)
+            if self.column_values is not None:
+                values = mf.frame_values(file, self.columns)
+            offset = int(ds.get('ConcatenationFrameOffsetNumber', 0))
+            for i in range(ds.NumberOfFrames):
+                frame = mf.frame_path(rel_path, i + 1)
+                if self.column_values is not None:
+                    self._batch['column_values'][frame] = values[i]
+                frame_attr = dict(attr, InstanceNumber=str(offset + i + 1))
+                self._batch['instances'].append((frame_attr, frame))
+
+
+    def _write_slices(self, ds, slices, ndim, attr, n, workers, verbose):
+        # The new files are set up here, in the order of the slices, 
+        # and written by chunks in separate processes. Each process 
+        # gets its own copy of the template ds.
+        attrs, files = [], []
+        for i in range(len(slices)):
+            files.append(self._new_file(attr, n + 1 + i))
+            attrs.append(dict(attr))
+        chunksize = math.ceil(len(slices) / (4 * workers))
+        chunks = [slice(k, k + chunksize) for k in range(0, len(slices), chunksize)]
+        columns = None if self.column_values is None else self.columns
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(
+                    _write_slices, ds, slices[c], ndim, attrs[c], 
+                    [os.path.join(self.path, f) for f in files[c]], columns,
+                ) for c in chunks
+            ]
+            values = []
+            for future in tqdm(futures, desc='Writing volume..', disable=verbose==0):
+                values += future.result()
+        for a, f, v in zip(attrs, files, values):
+            self._add_file(a, f, v)
+
     
 
     def edit(
-            self, series:list, new_values:dict, dims:list=None, verbose=1,
+            self, series:list, new_values:dict, dims:list=None, verbose=1, 
+            inplace=False,
         ):
         """Edit attribute values in a new DICOM series
 
@@ -545,8 +1221,15 @@ class DataBaseDicom():
             new_values (dict): dictionary with attribute: value pairs to write to the series
             dims (list, optional): Non-spatial dimensions of the volume. Defaults to None.
             verbose (bool, optional): If set to 1, shows progress bar. Defaults to 1.
+            inplace (bool, optional): If True, the values are changed in 
+                the existing files rather than in new copies. Each file 
+                is replaced in one step by a temporary copy, and keeps 
+                its UIDs and instance number unless these are edited. 
+                Frames of multi-frame files can't be edited in place. 
+                Defaults to False.
         """
-
+        self._check_writable()
+        self._flush()
         if dims is None:
             dims = ['InstanceNumber']
         elif np.isscalar(dims):
@@ -564,13 +1247,30 @@ class DataBaseDicom():
                     f"Incorrect value lengths. All values need to have {len(files)} elements"
                 )
 
-        # Read dicom files to sort them
+        if inplace and any(mf.split_path(f)[1] is not None for f in files):
+            raise ValueError(
+                "Frames of multi-frame files can't be edited in place. "
+                "Use inplace=False to edit them in new files."
+            )
+
+        # Scalar values do not depend on the order of the files
+        if inplace and all(np.isscalar(a) for a in new_values.values()):
+            return self._edit_files(files, new_values, verbose)
+
+        # Read dicom headers to sort them
         coord_values = [[] for _ in dims]
-        for f in tqdm(files, desc='Sorting series..', disable=(verbose==0)):
-            ds = pydicom.dcmread(f)
-            coord_values_f = get_values(ds, dims)
+        headers = self._header_values(series, dims)
+        if headers is None:
+            headers = []
+            for f in tqdm(files, desc='Sorting series..', disable=(verbose==0)):
+                if self.cache is None:
+                    ds = mf.dcmread(f, stop_before_pixels=True) 
+                else:
+                    ds = self.cache.header(f)
+                headers.append(get_values(ds, dims))
+        for row in headers:
             for d in range(len(dims)):
-                coord_values[d].append(coord_values_f[d])
+                coord_values[d].append(row[d])
 
         # Format coordinates as mesh
         coords = [np.array(v) for v in coord_values]
@@ -578,6 +1278,8 @@ class DataBaseDicom():
 
         # Sort files accordingly
         files = np.array(files)[inds]
+        if inplace:
+            return self._edit_files(files, new_values, verbose)
 
         # Now edit and write the files
         attr = self._series_attributes(series)
@@ -591,20 +1293,23 @@ class DataBaseDicom():
          
         # Write the instances
         tags = list(new_values.keys())
-        for i, f in tqdm(enumerate(files), desc='Writing values..', disable=(verbose==0)):
-            ds = pydicom.dcmread(f)
-            values = []
-            for a in new_values.values():
-                if np.isscalar(a):
-                    values.append(a)
-                else:
-                    values.append(np.array(a).reshape(-1)[i])
-            set_values(ds, tags, values)
-            self._write_dataset(ds, attr, n + 1 + i)
+        with self.batch():
+            for i, f in tqdm(enumerate(files), desc='Writing values..', disable=(verbose==0)):
+                ds = mf.dcmread(f)
+                values = []
+                for a in new_values.values():
+                    if np.isscalar(a):
+                        values.append(a)
+                    else:
+                        values.append(np.array(a).reshape(-1)[i])
+                set_values(ds, tags, values)
+                self._write_dataset(ds, attr, n + 1 + i)
+            # Register the new files before the originals are removed
+            self._flush()
 
         # Delete the originals files
         register.drop(self.register, to_drop)
-        [os.remove(os.path.join(self.path, idx)) for idx in to_drop]
+        self._remove_files(to_drop)
 
         return self
 
@@ -652,7 +1357,9 @@ class DataBaseDicom():
                 study. 
 
         Returns:
-            list: list of valid dicom files.
+            list: list of valid dicom files. Frames that are virtual 
+            instances are listed with the path returned by 
+            multiframe.frame_path().
         """
         if isinstance(entity, str): # path to folder
             files = []
@@ -721,6 +1428,9 @@ class DataBaseDicom():
             entity: the copied entity. If th to_entity is provided, this is 
             returned.
         """
+        if to_entity is None or to_entity[0] == from_entity[0]:
+            self._check_writable()
+            self._flush()
         if len(from_entity) == 4:
             if to_entity is None:
                 to_entity = deepcopy(from_entity)
@@ -795,14 +1505,20 @@ class DataBaseDicom():
             list: list of two-element tuples, where the first element is
             is the value and the second element is the series corresponding to that value.         
         """
+        self._check_writable()
+        self._flush()
 
         # Find all values of the attr and list files per value
         all_files = register.files(self.register, series)
+        headers = self._header_values(series, [attr])
         files = []
         values = []
-        for f in tqdm(all_files, desc=f'Reading {attr}'):
-            ds = pydicom.dcmread(f)
-            v = get_values(ds, attr)
+        for i, f in tqdm(enumerate(all_files), desc=f'Reading {attr}'):
+            if headers is None:
+                ds = mf.dcmread(f)
+                v = get_values(ds, attr)
+            else:
+                v = headers[i][0]
             if key is not None:
                 v = key(v)
             if v in values:
@@ -823,16 +1539,77 @@ class DataBaseDicom():
         return split_series
 
 
+    def _slice_files(self, series, slices=None, verbose=1):
+        # Files of a series with a slice location in the range 
+        # slices=(min, max). Only the slice locations are read, from 
+        # the header cache if possible.
+        files = register.files(self.register, series)
+        if slices is None:
+            return files
+        zmin, zmax = slices
+        locations = self._header_values(series, ['SliceLocation'])
+        if locations is None:
+            locations = []
+            for f in tqdm(files, desc='Reading slice locations..', disable=(verbose==0)):
+                if self.cache is None:
+                    ds = mf.dcmread(f, stop_before_pixels=True, specific_tags=['SliceLocation'])
+                else:
+                    ds = self.cache.header(f)
+                locations.append(get_values(ds, ['SliceLocation']))
+        selected = []
+        for f, (z, ) in zip(files, locations):
+            if z is not None and zmin <= z <= zmax:
+                selected.append(f)
+        if selected == []:
+            raise ValueError(f"There are no slices in the range {slices}.")
+        return selected
+
+
+    def _header_values(self, series, attributes):
+        # Values of the attributes in each file of a series, from the 
+        # columns of the register or else the header cache. Returns 
+        # None if they are not all available. In read-only mode the 
+        # header cache is used but not updated.
+        if self.column_values is not None and set(attributes) <= set(self.columns):
+            cols = [self.columns.index(a) for a in attributes]
+            index = register.index(self.register, series)
+            if all(f in self.column_values for f in index):
+                values = [self.column_values[f] for f in index]
+                return [[v[c] for c in cols] for v in values]
+        if isinstance(series, str) or len(series) != 4:
+            return None
+        if not set(attributes) <= set(header_cache.COLUMNS):
+            return None
+        uid = register.series_uid(self.register, series)
+        index = register.index(self.register, series)
+        return header_cache.read(self.path, uid, index, attributes, save=(self.mode != 'r'))
+
+
     def _values(self, attributes:list, entity:list):
         # Create a np array v with values for each instance and attribute
         # if set(attributes) <= set(dbdatabase.COLUMNS):
         #     index = register.index(self.register, entity)
         #     v = self.register.loc[index, attributes].values
         # else:
+        if isinstance(entity, str) or len(entity) < 4:
+            series = self.series(entity)
+        else:
+            series = [entity]
+        headers = []
+        for s in series:
+            headers_s = self._header_values(s, attributes)
+            if headers_s is None:
+                break
+            headers += headers_s
+        else:
+            v = np.empty((len(headers), len(attributes)), dtype=object)
+            for i, row in enumerate(headers):
+                v[i,:] = row
+            return v
         files = register.files(self.register, entity)
         v = np.empty((len(files), len(attributes)), dtype=object)
         for i, f in enumerate(files):
-            ds = pydicom.dcmread(f)
+            ds = mf.dcmread(f)
             v[i,:] = get_values(ds, attributes)
         return v
 
@@ -882,47 +1659,25 @@ class DataBaseDicom():
     def _files_to_series(self, files, to_series):
 
         # Get the attributes of the destination series
+        self._flush()
         attr = self._series_attributes(to_series)
         n = self._max_instance_number(attr['SeriesInstanceUID'])
         
         # Copy the files to the new series 
-        for i, f in tqdm(enumerate(files), total=len(files), desc=f'Copying series {to_series[1:]}'):
-            # Read dataset and assign new properties
-            ds = pydicom.dcmread(f)
-            self._write_dataset(ds, attr, n + 1 + i)
+        with self.batch():
+            for i, f in tqdm(enumerate(files), total=len(files), desc=f'Copying series {to_series[1:]}'):
+                # Read dataset and assign new properties
+                ds = mf.dcmread(f)
+                self._write_dataset(ds, attr, n + 1 + i)
 
     def _max_study_id(self, patient_id):
-        for pt in self.register:
-            if pt['PatientID'] == patient_id:
-                # Find the largest integer StudyID
-                n = []
-                for st in pt['studies']:
-                    try:
-                        n.append(int(st['StudyID']))
-                    except:
-                        pass
-                if n == []:
-                    return 0
-                else:
-                    return int(np.amax(n))
-        return 0
+        return register.max_study_id(self.register, patient_id)
     
     def _max_series_number(self, study_uid):
-        for pt in self.register:
-            for st in pt['studies']:
-                if st['StudyInstanceUID'] == study_uid:
-                    n = [sr['SeriesNumber'] for sr in st['series']]
-                    return int(np.amax(n))
-        return 0
+        return register.max_series_number(self.register, study_uid)
 
     def _max_instance_number(self, series_uid):
-        for pt in self.register:
-            for st in pt['studies']:
-                for sr in st['series']:
-                    if sr['SeriesInstanceUID'] == series_uid:
-                        n = list(sr['instances'].keys())
-                        return int(np.amax([int(i) for i in n]))
-        return 0
+        return register.max_instance_number(self.register, series_uid)
 
     # def _attributes(self, entity):
     #     if len(entity)==4:
@@ -938,7 +1693,7 @@ class DataBaseDicom():
             # If the patient exists and has files, read from file
             files = register.files(self.register, patient)
             attr = const.PATIENT_MODULE
-            ds = pydicom.dcmread(files[0])
+            ds = mf.dcmread(files[0])
             vals = get_values(ds, attr)
         except:
             # If the patient does not exist, generate values
@@ -958,7 +1713,7 @@ class DataBaseDicom():
             # If the study exists and has files, read from file
             files = register.files(self.register, study)
             attr = const.STUDY_MODULE
-            ds = pydicom.dcmread(files[0])
+            ds = mf.dcmread(files[0])
             vals = get_values(ds, attr)
         except register.AmbiguousError as e:
             raise register.AmbiguousError(e)
@@ -982,7 +1737,7 @@ class DataBaseDicom():
             # If the series exists and has files, read from file
             files = register.files(self.register, series)
             attr = const.SERIES_MODULE
-            ds = pydicom.dcmread(files[0])
+            ds = mf.dcmread(files[0])
             vals = get_values(ds, attr)
         except register.AmbiguousError as e:
             raise register.AmbiguousError(e)
@@ -1001,27 +1756,139 @@ class DataBaseDicom():
         return study_attr | {attr[i]:vals[i] for i in range(len(attr)) if vals[i] is not None}
 
         
-    def _write_dataset(self, ds:Dataset, attr:dict, instance_nr:int):
-        # Set new attributes 
+    def _edit_files(self, files, new_values, verbose):
+        # Set the values in the files, in place. The register is only 
+        # updated if some of its attributes are edited.
+        tags = list(new_values.keys())
+        update = not set(tags).isdisjoint(dbdatabase.COLUMNS)
+        edited = []
+        with self.batch():
+            try:
+                for i, f in tqdm(enumerate(files), total=len(files), desc='Writing values..', disable=(verbose==0)):
+                    ds = pydicom.dcmread(f)
+                    values = []
+                    for a in new_values.values():
+                        if np.isscalar(a):
+                            values.append(a)
+                        else:
+                            values.append(np.array(a).reshape(-1)[i])
+                    set_values(ds, tags, values)
+                    _replace(ds, f)
+                    rel_path = os.path.relpath(f, self.path)
+                    if self.cache is not None:
+                        self.cache.invalidate(f)
+                    if self.fingerprints is not None:
+                        self._batch['fingerprints'][rel_path] = filetools.fingerprint(f)
+                    if self.column_values is not None:
+                        self._batch['column_values'][rel_path] = get_values(ds, self.columns)
+                    if update:
+                        edited.append((dbdatabase.attributes(ds), rel_path))
+            finally:
+                # Register the files that have been edited
+                if edited != []:
+                    register.drop(self.register, [rel_path for _, rel_path in edited])
+                    self._batch['instances'] += edited
+                self.dirty = True
+        return self
+
+
+    def _write_dataset(self, ds:Dataset, attr:dict, instance_nr:int, encoder=None):
+        self._check_writable()
+        if self._batch is None:
+            with self.batch():
+                return self._write_dataset(ds, attr, instance_nr, encoder)
+        rel_path = self._new_file(attr, instance_nr)
+        set_values(ds, list(attr.keys()), list(attr.values()))
+        if encoder is None:
+            dbdataset.write(ds, os.path.join(self.path, rel_path))
+        else:
+            encoder.write(ds, os.path.join(self.path, rel_path))
+        values = None if self.column_values is None else get_values(ds, self.columns)
+        self._add_file(attr, rel_path, values)
+
+
+    def _new_file(self, attr:dict, instance_nr:int):
+        # Set new attributes and return the path of the new file
         attr['SOPInstanceUID'] = pydicom.uid.generate_uid()
         attr['InstanceNumber'] = str(instance_nr)
-        set_values(ds, list(attr.keys()), list(attr.values()))
-        # Save results in a new file
         rel_dir = os.path.join(
             f"Patient__{attr['PatientID']}", 
             f"Study__{attr['StudyID']}__{attr['StudyDescription']}", 
             f"Series__{attr['SeriesNumber']}__{attr['SeriesDescription']}",
         )
-        os.makedirs(os.path.join(self.path, rel_dir), exist_ok=True)
-        rel_path = os.path.join(rel_dir, pydicom.uid.generate_uid() + '.dcm')
-        dbdataset.write(ds, os.path.join(self.path, rel_path))
-        # Add an entry in the register
-        register.add_instance(self.register, attr, rel_path)
+        if rel_dir not in self._batch['folders']:
+            os.makedirs(os.path.join(self.path, rel_dir), exist_ok=True)
+            self._batch['folders'].add(rel_dir)
+        return os.path.join(rel_dir, pydicom.uid.generate_uid() + '.dcm')
+
+
+    def _add_file(self, attr:dict, rel_path:str, values:list=None):
+        # Add a file that has been written to the batch
+        if self.cache is not None:
+            self.cache.invalidate(os.path.join(self.path, rel_path))
+        if self.column_values is not None:
+            self._batch['column_values'][rel_path] = values
+        if self.fingerprints is not None:
+            self._batch['fingerprints'][rel_path] = filetools.fingerprint(os.path.join(self.path, rel_path))
+        # Add an entry in the register when the batch is flushed
+        self._batch['instances'].append((dict(attr), rel_path))
+
+
+    @contextmanager
+    def batch(self):
+        """Add files written to the database to the register in one go
+
+        Inside this context, files that are written by write_volume(), 
+        copy(), move(), edit() and split_series() are saved straight 
+        away, but the register is only updated before the next of 
+        these calls, and when the context exits. Folders are created 
+        once, and with the sqlite backend all new entries are saved 
+        in a single transaction. Other functions, such as series() or 
+        volume(), do not see the series that are being written until 
+        the register is updated.
+
+        Writing a single volume already uses a batch, so this is 
+        useful when writing many volumes.
+
+        Example:
+
+            with dbd.batch():
+                for i, vol in enumerate(vols):
+                    dbd.write_volume(vol, [path, '007', 'test', f'vol_{i}'])
+        """
+        self._check_writable()
+        if self._batch is not None:
+            # Nested - the outer batch is flushed on exit
+            yield self
+            return
+        self._batch = {'instances': [], 'fingerprints': {}, 'column_values': {}, 'folders': set()}
+        try:
+            yield self
+        finally:
+            # Files that have been written are always registered
+            self._flush()
+            self._batch = None
+
+
+    def _flush(self):
+        # Add the files written in a batch to the register
+        if self._batch is None:
+            return
+        batch = self._batch
+        if not (batch['instances'] or batch['fingerprints'] or batch['column_values']):
+            return
+        register.add_instances(self.register, batch['instances'])
+        if self.fingerprints is not None:
+            self.fingerprints.update(batch['fingerprints'])
+        if self.column_values is not None:
+            self.column_values.update(batch['column_values'])
+        batch['instances'], batch['fingerprints'], batch['column_values'] = [], {}, {}
+        self.dirty = True
 
 
     def archive(self, archive_path):
         # TODO add flat=True option for zipping at patient level
-        for pt in tqdm(self.register, desc='Archiving '):
+        for pt in tqdm(register.to_list(self.register), desc='Archiving '):
             for st in pt['studies']:
                 zip_dir = os.path.join(
                     archive_path,
@@ -1038,7 +1905,9 @@ class DataBaseDicom():
                         continue
                     try:
                         with zipfile.ZipFile(zip_file, 'w') as zipf:
-                            for rel_path in sr['instances'].values():
+                            # Frames of a multiframe file are archived once
+                            rel_paths = {mf.source(f): None for f in sr['instances'].values()}
+                            for rel_path in rel_paths:
                                 file = os.path.join(self.path, rel_path)
                                 zipf.write(file, arcname=os.path.basename(file))
                     except Exception as e:
@@ -1049,6 +1918,256 @@ class DataBaseDicom():
 
 
 
+def _pixel_layout(files, dims, verbose=1, cache=None):
+    # Reads the headers to find the shape and data type of the pixel 
+    # array, and the position of each file in it. Positions are 
+    # assigned as in volumes_2d: slice locations in the order they 
+    # are found, and the other dims sorted with meshvals. Returns None 
+    # if the slices can't be read straight into an array. The headers 
+    # are returned as well.
+    shape = None
+    dtype = None
+    headers = []
+    slice_locs = {} # slice_loc: [indices of files]
+    values = {} # slice_loc: [values of dims]
+    for i, f in tqdm(enumerate(files), total=len(files), desc='Reading headers..', disable=(verbose==0)):
+        ds = _read_header(f, cache)
+        headers.append(ds)
+        if int(ds.get('NumberOfFrames') or 1) != 1:
+            return None
+        dtype_f = dbdataset.pixel_data_dtype(ds)
+        if dtype_f is None:
+            return None
+        dtype = dtype_f if dtype is None else np.result_type(dtype, dtype_f)
+        shape_f = (ds.Columns, ds.Rows)
+        if shape is None:
+            shape = shape_f
+        elif shape_f != shape:
+            raise ValueError(
+                "Cannot return a pixel array because slices have different shapes." 
+                "Instead try using volumes_2d to return a list of 2D volumes."
+            )
+        values_f = get_values(ds, dims)
+        slice_loc = values_f[0]
+        if slice_loc in slice_locs:
+            slice_locs[slice_loc].append(i)
+            for d in range(len(dims)):
+                values[slice_loc][d].append(values_f[d])
+        else:
+            slice_locs[slice_loc] = [i]
+            values[slice_loc] = [[values_f[d]] for d in range(len(dims))]
+    
+    # Position of each file in the array
+    dims_shape = None
+    positions = [None] * len(files)
+    for k, slice_loc in enumerate(slice_locs):
+        coords = [np.array(v) for v in values[slice_loc]]
+        coords, inds = dbdicom.utils.arrays.meshvals(coords)
+        if dims_shape is None:
+            dims_shape = coords[0].shape[1:]
+        elif coords[0].shape[1:] != dims_shape:
+            raise ValueError(
+                "Cannot return a pixel array because slices have different shapes." 
+                "Instead try using volumes_2d to return a list of 2D volumes."
+            )
+        for m, i in enumerate(inds):
+            idx = np.unravel_index(m, dims_shape) if dims_shape != () else ()
+            positions[slice_locs[slice_loc][i]] = (slice(None), slice(None), k) + tuple(idx)
+    shape = shape + (len(slice_locs), ) + dims_shape
+    return shape, dtype, positions, headers
+
+
+def _pixel_map(files, shape, dtype, positions, headers):
+    # Memory-map the pixel data in the positions found by _pixel_layout
+    slices = []
+    for f, ds in zip(files, headers):
+        offset = mf.pixel_offset(f)
+        stored_dtype = dbdataset.stored_dtype(ds)
+        if offset is None or stored_dtype is None:
+            raise ValueError(
+                f"Cannot memory-map the pixel data in {f}. This is only "
+                f"possible for uncompressed little endian files."
+            )
+        slope, intercept = dbdataset.rescale(ds)
+        slices.append((
+            mf.source(f), offset[0], stored_dtype, ds.Rows, ds.Columns, 
+            slope, intercept, dbdataset.pixel_data_dtype(ds),
+        ))
+    grid = np.empty(shape[2:], dtype=int)
+    for i, pos in enumerate(positions):
+        grid[pos[2:]] = i
+    return PixelMap(slices, grid, dtype)
+
+
+def _sort_slices(values):
+    # Sort the slices by the values of the dims, with SliceLocation 
+    # first. Returns the coordinates as mesh and the sort indices.
+    coords = [np.array(v) for v in values]
+    coords, inds = dbdicom.utils.arrays.meshvals(coords)
+
+    # Check that all slices have the same coordinates
+    if len(values) > 1:
+        # Loop over all coordinates after slice location
+        for c in coords[1:]:
+            # Loop over all slice locations
+            for k in range(1, c.shape[0]):
+                # Coordinate c of slice k
+                if not np.array_equal(c[k,...], c[0,...]):
+                    raise ValueError(
+                        "Cannot build a single volume. Not all slices "
+                        "have the same coordinates."     
+                    )
+    return coords, inds
+
+
+def _join_slices(vols, coords, dims):
+    # Join an array of sorted 2D volumes into a volume
+
+    # Infer spacing between slices from slice locations
+    # Technically only necessary if SpacingBetweenSlices not set or incorrect
+    vols = infer_slice_spacing(vols)
+
+    # Join 2D volumes into 3D volumes
+    try:
+        vol = vreg.join(vols)
+    except ValueError:
+        # some vendors define the slice vector as -cross product 
+        # of row and column vector. Check if that solves the issue.
+        for v in vols.reshape(-1):
+            v.affine[:3,2] = -v.affine[:3,2]
+            # Then try again
+        vol = vreg.join(vols)
+
+    # For multi-dimensional volumes, set dimensions and coordinates
+    if vol.ndim > 3:
+        # Coordinates of slice 0
+        c0 = [c[0,...] for c in coords[1:]]
+        vol.set_coords(c0)
+        vol.set_dims(dims[1:])
+    return vol
+
+
+def _bbox_key(bbox):
+    # In-plane index of a bounding box ((xmin, xmax), (ymin, ymax))
+    if bbox is None:
+        return (slice(None), slice(None))
+    try:
+        (x0, x1), (y0, y1) = bbox
+    except (TypeError, ValueError):
+        raise ValueError(
+            f"Invalid bounding box {bbox}. This must have the form "
+            f"((xmin, xmax), (ymin, ymax))."
+        )
+    return (slice(x0, x1), slice(y0, y1))
+
+
+def _read_header(file, cache=None):
+    # Header without the pixel data, from the cache if there is one
+    if cache is None:
+        return mf.dcmread(file, stop_before_pixels=True)
+    return cache.header(file)
+
+
+def _pixel_window(file, ds, key):
+    # Pixel data of a single-frame file in the in-plane window key. 
+    # Uncompressed data are memory-mapped so that only the window is 
+    # read, otherwise the slice is decoded and then cropped. ds is the 
+    # header of the file, without the pixel data.
+    offset = mf.pixel_offset(file)
+    stored_dtype = dbdataset.stored_dtype(ds)
+    dtype = dbdataset.pixel_data_dtype(ds)
+    if None in (offset, stored_dtype, dtype) or int(ds.get('NumberOfFrames') or 1) != 1:
+        return dbdataset.pixel_data(mf.dcmread(file))[key]
+    slope, intercept = dbdataset.rescale(ds)
+    plane = (mf.source(file), offset[0], stored_dtype, ds.Rows, ds.Columns, slope, intercept, dtype)
+    return PixelMap([plane], np.zeros((), dtype=int), dtype)[key]
+
+
+def _read_slice(file, dims, multislice=False, bbox=None, cache=None):
+    if bbox is None and cache is None:
+        ds = mf.dcmread(file)
+        return get_values(ds, dims), dbdataset.volume(ds, multislice=multislice)
+    key = _bbox_key(bbox)
+    if cache is None:
+        ds = mf.dcmread(file, stop_before_pixels=True)
+        values = _pixel_window(file, ds, key)
+    else:
+        # Cached arrays are shared, so return a copy
+        ds, pixels = cache.read(file)
+        values = pixels[key].copy()
+    # Move the origin to the first pixel of the window
+    affine = dbdataset.affine(ds, multislice=multislice)
+    start = [k.indices(n)[0] for k, n in zip(key, (ds.Columns, ds.Rows))]
+    affine[:3, 3] += affine[:3, 0] * start[0] + affine[:3, 1] * start[1]
+    return get_values(ds, dims), vreg.volume(values, affine)
+
+
+def _replace(ds, file):
+    # Replace a file by a dataset in one step. The dataset is written 
+    # to a temporary file in the same folder first, which is removed 
+    # if this fails.
+    with tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(file), suffix=filetools.TMP_SUFFIX, delete=False,
+        ) as f:
+        tmp = f.name
+    try:
+        dbdataset.write(ds, tmp)
+        shutil.copymode(file, tmp)
+        os.replace(tmp, file)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _set_slice(ds, sl, ndim):
+    dbdataset.set_volume(ds, sl)
+    if ndim > 3:
+        sl_coords = [c.ravel()[0] for c in sl.coords]
+        set_value(ds, sl.dims, sl_coords)
+
+
+def _write_slices(ds, slices, ndim, attrs, files, columns=None):
+    # Write slices to new files and return the values of the columns.
+    # This runs in a separate process.
+    values = []
+    encoder = TemplateEncoder()
+    for sl, attr, file in zip(slices, attrs, files):
+        _set_slice(ds, sl, ndim)
+        set_values(ds, list(attr.keys()), list(attr.values()))
+        encoder.write(ds, file)
+        values.append(None if columns is None else get_values(ds, columns))
+    return values
+
+
+def _read_slices(files, dims, multislice=False, workers=1, verbose=1, bbox=None, cache=None):
+    # Returns (values of dims, volume) for each file, in the order of 
+    # the files. Reading files is mostly waiting for I/O, so this is 
+    # done in threads. Decompressing pixel data holds the GIL, so 
+    # compressed files are read in processes instead. The transfer 
+    # syntax of the first file is assumed to apply to all. A cache 
+    # only exists in this process, so with a cache threads are used.
+    desc = 'Reading volume..'
+    if workers is None:
+        workers = os.cpu_count()
+    if workers == 1 or len(files) < 2:
+        return [
+            _read_slice(f, dims, multislice, bbox, cache) 
+            for f in tqdm(files, desc=desc, disable=(verbose==0))
+        ]
+    meta = pydicom.filereader.read_file_meta_info(mf.source(files[0]))
+    args = (files, [dims]*len(files), [multislice]*len(files), [bbox]*len(files))
+    if cache is not None:
+        args += ([cache]*len(files), )
+    elif meta.TransferSyntaxUID.is_compressed:
+        chunksize = math.ceil(len(files) / (4 * workers))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            slices = pool.map(_read_slice, *args, chunksize=chunksize)
+            return list(tqdm(slices, desc=desc, total=len(files), disable=(verbose==0)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        slices = pool.map(_read_slice, *args)
+        return list(tqdm(slices, desc=desc, total=len(files), disable=(verbose==0)))
+
+
 def full_name(entity):
 
     if len(entity)==3: # study
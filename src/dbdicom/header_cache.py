@@ -0,0 +1,158 @@
+"""Header values of DICOM series, saved next to the register.
+
+Reading a few header values of a series, for instance to sort the
+slices, normally means opening every file in the series. This module
+saves the values of commonly used attributes of each series in a
+.npz file in a hidden folder of the database, so that they can be
+read again without opening the DICOM files.
+
+Each file in the cache is stored with its fingerprint (size and
+modification time). Values of files that have changed since are
+read again from the file, and the cache is updated.
+"""
+
+import os
+import json
+
+import numpy as np
+
+import dbdicom.utils.files as filetools
+import dbdicom.utils.multiframe as multiframe
+from dbdicom.utils.pydicom_dataset import get_values
+
+
+# Hidden folder in the database with one .npz file per series
+FOLDER = '.dbdicom'
+
+# Attributes that are saved in the cache
+COLUMNS = [
+    # Geometry
+    'SliceLocation', 'ImagePositionPatient', 'ImageOrientationPatient',
+    'PixelSpacing', 'SliceThickness', 'SpacingBetweenSlices',
+    'Rows', 'Columns', 'NumberOfFrames',
+    # Common dimensions
+    'InstanceNumber', 'AcquisitionTime', 'TriggerTime', 'EchoTime',
+    'RepetitionTime', 'InversionTime', 'FlipAngle', 'ImageType',
+    'AcquisitionNumber', 'TemporalPositionIdentifier', 'DiffusionBValue',
+    'SOPClassUID',
+]
+
+
+def read(path:str, series_uid:str, files:list, attributes:list, save=True) -> list:
+    """Read header values of the files in a series
+
+    Args:
+        path (str): path to the DICOM folder.
+        series_uid (str): SeriesInstanceUID of the series.
+        files (list): paths of the files relative to the folder.
+        attributes (list): keywords of the attributes to read.
+        save (bool, optional): if True, values that are not in the
+            cache are saved. Defaults to True.
+
+    Returns:
+        list or None: one list of values per file, in the order of
+        attributes, as returned by get_values(). If some of the
+        attributes are not cached, this returns None.
+    """
+    if not set(attributes) <= set(COLUMNS):
+        return None
+    file = _file(path, series_uid)
+    cached = _load(file)
+    fingerprints = {
+        f: filetools.fingerprint(os.path.join(path, multiframe.source(f))) 
+        for f in files
+    }
+    rows = {f: row for f, (fp, row) in cached.items() if fingerprints.get(f) == fp}
+    new = [f for f in files if f not in rows]
+    for f in new:
+        ds = multiframe.dcmread(os.path.join(path, f), stop_before_pixels=True)
+        rows[f] = get_values(ds, COLUMNS)
+    if save and (new != [] or len(rows) != len(cached)):
+        _save(file, {f: (fingerprints[f], rows[f]) for f in files})
+    cols = [COLUMNS.index(a) for a in attributes]
+    return [[rows[f][c] for c in cols] for f in files]
+
+
+def remove(path:str, series_uid:str):
+    """Remove the cached values of a series
+
+    Args:
+        path (str): path to the DICOM folder.
+        series_uid (str): SeriesInstanceUID of the series.
+    """
+    file = _file(path, series_uid)
+    if os.path.exists(file):
+        os.remove(file)
+
+
+def _file(path, series_uid):
+    return os.path.join(path, FOLDER, series_uid + '.npz')
+
+
+def _load(file):
+    # Returns {relpath: (fingerprint, row)}
+    if not os.path.exists(file):
+        return {}
+    try:
+        with np.load(file, allow_pickle=False) as npz:
+            files = npz['files'].tolist()
+            fingerprints = npz['fingerprints'].tolist()
+            columns = []
+            for c in COLUMNS:
+                if c in npz:
+                    columns.append(npz[c].tolist())
+                elif 'json_' + c in npz:
+                    columns.append([json.loads(v) for v in npz['json_' + c]])
+                else:
+                    # Saved with a different list of columns
+                    return {}
+    except Exception:
+        # Treat a damaged file as empty
+        return {}
+    rows = [list(r) for r in zip(*columns)] if files != [] else []
+    return {f: (fp, row) for f, fp, row in zip(files, fingerprints, rows)}
+
+
+def _save(file, rows):
+    files = list(rows.keys())
+    arrays = {
+        'files': np.array(files, dtype=str),
+        'fingerprints': np.array([rows[f][0] for f in files], dtype=np.int64).reshape(-1, 2),
+    }
+    for c, column in enumerate(COLUMNS):
+        values = [rows[f][1][c] for f in files]
+        array = _array(values)
+        if array is not None:
+            arrays[column] = array
+        else:
+            arrays['json_' + column] = np.array(
+                [json.dumps(v, default=_to_json) for v in values], dtype=str,
+            )
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    # Write to a temporary file first so a partial file is never read
+    tmp = file[:-4] + '.tmp.npz'
+    np.savez(tmp, **arrays)
+    os.replace(tmp, file)
+
+
+def _array(values):
+    # Columns of numbers or strings with the same shape are saved as
+    # arrays, anything else as json.
+    if values == [] or any(v is None for v in values):
+        return None
+    items = [x for v in values for x in (v if isinstance(v, list) else [v])]
+    if len({type(x) for x in items}) != 1:
+        return None
+    try:
+        array = np.array(values)
+    except ValueError:
+        return None
+    if array.dtype.kind not in 'iufU':
+        return None
+    return array
+
+
+def _to_json(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value)} can't be saved in the header cache.")
@@ -5,52 +5,306 @@ class AmbiguousError(Exception):
     pass
 
 
+# The functions in this module take a register tree, which is either 
+# a DbTree (the list saved in dbtree.json, with its index) or a 
+# SqliteTree from dbdicom.register_sqlite. Anything that is not a 
+# list is assumed to be a backend that implements the same operations 
+# as methods.
+
+
+class DbTree(list):
+    """Register tree with hash indexes for fast lookup.
+
+    This is the list of patients as it is saved in dbtree.json, which 
+    also holds an Index of the tree. The index is kept in sync when 
+    the tree is modified with the functions in this module.
+    """
+
+    def __init__(self, patients=()):
+        super().__init__(patients)
+        self.index = Index(self)
+
+
+class Index():
+    """Hash indexes over a register tree.
+
+    Maps PatientID, StudyInstanceUID, SeriesInstanceUID and file paths 
+    to the nodes of the tree. The sorted lists of patients, studies 
+    and series, and the (description, index) names of studies and 
+    series, are computed when they are first needed and cached, so 
+    they only need recomputing when the patients, the studies of that 
+    patient or the series of that study change.
+
+    Args:
+        dbtree (list): register tree.
+    """
+
+    def __init__(self, dbtree):
+        self.dbtree = dbtree
+        self.patients = {}  # PatientID: patient
+        self.studies = {}   # StudyInstanceUID: (patient, study)
+        self.series = {}    # SeriesInstanceUID: (patient, study, series)
+        self.files = {}     # rel_path: (patient, study, series, InstanceNumber)
+        self._study_names = {}  # PatientID: {(desc, idx): study}
+        self._series_names = {} # StudyInstanceUID: {(desc, idx): series}
+        self._patients = None   # patients sorted by PatientID
+        self._children = {}     # id(node): sorted studies or series
+        # Insert in sorted order so that duplicate UIDs resolve to the 
+        # first node, as in a linear search of the sorted tree.
+        for pt in self.sorted_patients():
+            self._insert_patient(pt)
+            for st in self.sorted_studies(pt):
+                self._insert_study(pt, st)
+                for sr in self.sorted_series(st):
+                    self._insert_series(pt, st, sr)
+                    for nr, rel_path in sr['instances'].items():
+                        self.files[rel_path] = (pt, st, sr, nr)
+
+    def patient(self, patient_id):
+        try:
+            return self.patients[patient_id]
+        except KeyError:
+            raise ValueError(f"Patient {patient_id} not found.")
+
+    def study(self, study):
+        # study = [database, patient_id, study_name]
+        return self.study_names(study[1])[_name(self.study_names(study[1]), study[2], 'study', study[1])]
+
+    def sery(self, series):
+        # series = [database, patient_id, study_name, series_name]
+        st = self.study(series[:3])
+        names = self.series_names(st['StudyInstanceUID'])
+        return names[_name(names, series[3], 'series', series[2])]
+
+    def study_names(self, patient_id):
+        if patient_id not in self._study_names:
+            pt = self.patient(patient_id)
+            self._study_names[patient_id] = _names(self.sorted_studies(pt), 'StudyDescription')
+        return self._study_names[patient_id]
+
+    def series_names(self, study_uid):
+        if study_uid not in self._series_names:
+            _, st = self.studies[study_uid]
+            self._series_names[study_uid] = _names(self.sorted_series(st), 'SeriesDescription')
+        return self._series_names[study_uid]
+
+    def sorted_patients(self):
+        if self._patients is None:
+            self._patients = _sorted_patients(self.dbtree)
+        return self._patients
+
+    def sorted_studies(self, pt):
+        if id(pt) not in self._children:
+            self._children[id(pt)] = _sorted_studies(pt)
+        return self._children[id(pt)]
+
+    def sorted_series(self, st):
+        if id(st) not in self._children:
+            self._children[id(st)] = _sorted_series(st)
+        return self._children[id(st)]
+
+    def add_patient(self, pt):
+        self.dbtree.append(pt)
+        self._insert_patient(pt)
+        self._patients = None
+
+    def add_study(self, pt, st):
+        pt['studies'].append(st)
+        self._insert_study(pt, st)
+        self._study_names.pop(pt['PatientID'], None)
+        self._children.pop(id(pt), None)
+
+    def add_series(self, pt, st, sr):
+        st['series'].append(sr)
+        self._insert_series(pt, st, sr)
+        self._series_names.pop(st['StudyInstanceUID'], None)
+        self._children.pop(id(st), None)
+
+    def add_file(self, pt, st, sr, nr, rel_path):
+        if nr in sr['instances']:
+            self.files.pop(sr['instances'][nr], None)
+        sr['instances'][nr] = rel_path
+        self.files[rel_path] = (pt, st, sr, nr)
+
+    def remove_patient(self, pt):
+        for st in pt['studies'][:]:
+            self.remove_study(pt, st)
+        _remove(self.dbtree, pt)
+        if self.patients.get(pt['PatientID']) is pt:
+            del self.patients[pt['PatientID']]
+        self._study_names.pop(pt['PatientID'], None)
+        self._children.pop(id(pt), None)
+        self._patients = None
+
+    def remove_study(self, pt, st):
+        for sr in st['series'][:]:
+            self.remove_series(pt, st, sr)
+        _remove(pt['studies'], st)
+        if self.studies.get(st['StudyInstanceUID'], (None, None))[1] is st:
+            del self.studies[st['StudyInstanceUID']]
+        self._study_names.pop(pt['PatientID'], None)
+        self._series_names.pop(st['StudyInstanceUID'], None)
+        self._children.pop(id(pt), None)
+        self._children.pop(id(st), None)
+
+    def remove_series(self, pt, st, sr):
+        for rel_path in sr['instances'].values():
+            self.files.pop(rel_path, None)
+        _remove(st['series'], sr)
+        if self.series.get(sr['SeriesInstanceUID'], (None, None, None))[2] is sr:
+            del self.series[sr['SeriesInstanceUID']]
+        self._series_names.pop(st['StudyInstanceUID'], None)
+        self._children.pop(id(st), None)
+
+    def remove_file(self, rel_path):
+        pt, st, sr, nr = self.files.pop(rel_path)
+        del sr['instances'][nr]
+        return pt, st, sr
+
+    def _insert_patient(self, pt):
+        self.patients.setdefault(pt['PatientID'], pt)
+
+    def _insert_study(self, pt, st):
+        self.studies.setdefault(st['StudyInstanceUID'], (pt, st))
+
+    def _insert_series(self, pt, st, sr):
+        self.series.setdefault(sr['SeriesInstanceUID'], (pt, st, sr))
+
+
+def index_of(dbtree) -> Index:
+    # Return the index of a tree. Trees are indexed once, when they 
+    # are loaded, so a list without an index is an error.
+    if not isinstance(dbtree, DbTree):
+        raise TypeError(
+            "The register tree has no index. Please convert it with "
+            "DbTree() when it is loaded."
+        )
+    return dbtree.index
+
+
+def _sorted_patients(dbtree):
+    return sorted(dbtree, key=lambda pt: pt['PatientID'])
+
+def _sorted_studies(pt):
+    return sorted(pt['studies'], key=lambda st: st['StudyInstanceUID'])
+
+def _sorted_series(st):
+    return sorted(st['series'], key=lambda sr: sr['SeriesNumber'])
+
+
+def _names(nodes, desc_attr):
+    # Name each node by its description and a counter over nodes 
+    # with the same description.
+    names = {}
+    idx = {}
+    for node in nodes:
+        desc = node[desc_attr]
+        idx[desc] = idx[desc] + 1 if desc in idx else 0
+        names[(desc, idx[desc])] = node
+    return names
+
+
+def _name(names, name, entity, parent):
+    # Resolve a name provided by the user to a key in names
+    if isinstance(name, str):
+        cnt = len([n for n in names if n[0]==name])
+        if cnt == 1:
+            return (name, 0)
+        elif cnt > 1:
+            raise AmbiguousError(
+                f"Multiple {entity} with name {name}. "
+                f"Please specify the index along with the description. "
+                f"For instance ({name}, {cnt-1})'. "
+            )
+    elif isinstance(name, tuple):
+        if name in names:
+            return name
+    entity = entity[0].upper() + entity[1:]
+    raise ValueError(f"{entity} {name} not found in {parent}.")
+
+
+def _remove(nodes, node):
+    # Remove by identity rather than equality
+    for i, n in enumerate(nodes):
+        if n is node:
+            del nodes[i]
+            return
+
+
 def add_instance(dbtree:list, attr, rel_path):
+
+    if not isinstance(dbtree, list):
+        return dbtree.add_instance(attr, rel_path)
+
+    ix = index_of(dbtree)
     
     # Get patient and create if needed
-    pts = [pt for pt in sorted(dbtree, key=lambda pt: pt['PatientID']) if pt['PatientID']==attr['PatientID']]
-    if pts==[]:
+    pt = ix.patients.get(attr['PatientID'])
+    if pt is None:
         pt = {
             'PatientName': attr['PatientName'],
             'PatientID': attr['PatientID'],
             'studies': [],
         }
-        dbtree.append(pt)
-    else:
-        pt = pts[0]
+        ix.add_patient(pt)
     
     # Get study and create if needed
-    sts = [st for st in sorted(pt['studies'], key=lambda st: st['StudyInstanceUID']) if st['StudyInstanceUID']==attr['StudyInstanceUID']]
-    if sts==[]:
+    st = _child(pt, ix.sorted_studies, ix.studies, attr['StudyInstanceUID'], 'StudyInstanceUID')
+    if st is None:
         st = {
             'StudyDescription': attr['StudyDescription'],
             'StudyID': attr['StudyID'],
             'StudyInstanceUID': attr['StudyInstanceUID'],
             'series': [],
         }
-        pt['studies'].append(st)
-    else:
-        st = sts[0]
+        ix.add_study(pt, st)
 
     # Get series and create if needed
-    srs = [sr for sr in sorted(st['series'], key=lambda sr: sr['SeriesNumber']) if sr['SeriesInstanceUID']==attr['SeriesInstanceUID']]
-    if srs==[]:
+    sr = _child(st, ix.sorted_series, ix.series, attr['SeriesInstanceUID'], 'SeriesInstanceUID')
+    if sr is None:
         sr = {
             'SeriesNumber': attr['SeriesNumber'],
             'SeriesDescription': attr['SeriesDescription'],
             'SeriesInstanceUID': attr['SeriesInstanceUID'],
             'instances': {},
         }
-        st['series'].append(sr)
-    else:
-        sr = srs[0]
+        ix.add_series(pt, st, sr)
 
     # Add instance
-    sr['instances'][attr['InstanceNumber']] = rel_path
+    ix.add_file(pt, st, sr, attr['InstanceNumber'], rel_path)
+
+    return dbtree
+
 
+def add_instances(dbtree:list, instances:list):
+    # instances is a list of (attr, rel_path). The patient, study and 
+    # series of each series are only looked up once.
+    if not isinstance(dbtree, list):
+        return dbtree.add_instances(instances)
+    ix = index_of(dbtree)
+    nodes = {} # (PatientID, StudyInstanceUID, SeriesInstanceUID): (pt, st, sr)
+    for attr, rel_path in instances:
+        key = (attr['PatientID'], attr['StudyInstanceUID'], attr['SeriesInstanceUID'])
+        if key in nodes:
+            ix.add_file(*nodes[key], attr['InstanceNumber'], rel_path)
+        else:
+            add_instance(dbtree, attr, rel_path)
+            nodes[key] = ix.files[rel_path][:3]
     return dbtree
 
 
+def _child(parent, children, uid_index, uid, uid_attr):
+    # Find the child with a given UID of a parent node. The index is 
+    # tried first, but UIDs may not be unique over the whole tree, so 
+    # this falls back on searching the children.
+    if uid in uid_index:
+        if uid_index[uid][-2] is parent:
+            return uid_index[uid][-1]
+    for child in children(parent):
+        if child[uid_attr] == uid:
+            return child
+
+
 def files(dbtree, entity):
     # Raises an error if the entity does not exist or has no files
     relpath = index(dbtree, entity)
@@ -63,72 +317,63 @@ def files(dbtree, entity):
     
 
 def index(dbtree, entity):
+    if not isinstance(dbtree, list):
+        return dbtree.index(entity)
+    ix = index_of(dbtree)
     if isinstance(entity, str):
-        idx = []
-        for pt in sorted(dbtree, key=lambda pt: pt['PatientID']):
-            for st in sorted(pt['studies'], key=lambda st: st['StudyInstanceUID']):
-                for sr in sorted(st['series'], key=lambda sr: sr['SeriesNumber']):
-                    idx += list(sr['instances'].values())
-        return idx
+        patients = ix.sorted_patients()
     elif len(entity)==2:
-        patient_id = entity[1]
-        idx = []
-        for pt in sorted(dbtree, key=lambda pt: pt['PatientID']):
-            if pt['PatientID'] == patient_id:
-                for st in sorted(pt['studies'], key=lambda st: st['StudyInstanceUID']):
-                    for sr in sorted(st['series'], key=lambda sr: sr['SeriesNumber']):
-                        idx += list(sr['instances'].values())
-                return idx
+        patients = [ix.patient(entity[1])]
     elif len(entity)==3:
-        study_uid = uid(dbtree, entity)
-        idx = []
-        for pt in sorted(dbtree, key=lambda pt: pt['PatientID']):
-            for st in sorted(pt['studies'], key=lambda st: st['StudyInstanceUID']):
-                if st['StudyInstanceUID'] == study_uid:
-                    for sr in sorted(st['series'], key=lambda sr: sr['SeriesNumber']):
-                        idx += list(sr['instances'].values())
-                    return idx
+        return _study_index(ix, ix.study(entity))
     elif len(entity)==4:
-        series_uid = uid(dbtree, entity)
-        for pt in sorted(dbtree, key=lambda pt: pt['PatientID']):
-            for st in sorted(pt['studies'], key=lambda st: st['StudyInstanceUID']):
-                for sr in sorted(st['series'], key=lambda sr: sr['SeriesNumber']):
-                    if sr['SeriesInstanceUID'] == series_uid:
-                        return list(sr['instances'].values())
+        return list(ix.sery(entity)['instances'].values())
+    idx = []
+    for pt in patients:
+        for st in ix.sorted_studies(pt):
+            idx += _study_index(ix, st)
+    return idx
+
+
+def _study_index(ix, st):
+    idx = []
+    for sr in ix.sorted_series(st):
+        idx += list(sr['instances'].values())
+    return idx
+
                     
 def remove(dbtree, entity):
+    if not isinstance(dbtree, list):
+        return dbtree.remove(entity)
+    ix = index_of(dbtree)
     if len(entity)==2:
-        patient_id = entity[1]
-        for pt in sorted(dbtree, key=lambda pt: pt['PatientID']):
-            if pt['PatientID'] == patient_id:
-                dbtree.remove(pt)
+        if entity[1] in ix.patients:
+            ix.remove_patient(ix.patients[entity[1]])
     elif len(entity)==3:
-        study_uid = uid(dbtree, entity)
-        for pt in sorted(dbtree, key=lambda pt: pt['PatientID']):
-            for st in sorted(pt['studies'], key=lambda st: st['StudyInstanceUID']):
-                if st['StudyInstanceUID'] == study_uid:
-                    pt['studies'].remove(st)
+        st = ix.study(entity)
+        pt, _ = ix.studies[st['StudyInstanceUID']]
+        ix.remove_study(pt, st)
     elif len(entity)==4:
-        series_uid = uid(dbtree, entity)
-        for pt in sorted(dbtree, key=lambda pt: pt['PatientID']):
-            for st in sorted(pt['studies'], key=lambda st: st['StudyInstanceUID']):
-                for sr in sorted(st['series'], key=lambda sr: sr['SeriesNumber']):
-                    if sr['SeriesInstanceUID'] == series_uid:
-                        st['series'].remove(sr)
+        sr = ix.sery(entity)
+        pt, st, _ = ix.series[sr['SeriesInstanceUID']]
+        ix.remove_series(pt, st, sr)
     return dbtree
                     
 
 def drop(dbtree, relpaths):
-    for pt in sorted(dbtree[:], key=lambda pt: pt['PatientID']):
-        for st in sorted(pt['studies'][:], key=lambda st: st['StudyInstanceUID']):
-            for sr in sorted(st['series'][:], key=lambda sr: sr['SeriesNumber']):
-                for nr, relpath in list(sr['instances'].items()):
-                    if relpath in relpaths:
-                        del sr['instances'][nr]
-                if sr['instances'] == []:
-                    st['series'].remove(sr)
-            if st['series'] == []:
-                pt['studies'].remove(st)
+    if not isinstance(dbtree, list):
+        return dbtree.drop(relpaths)
+    ix = index_of(dbtree)
+    for relpath in relpaths:
+        if relpath not in ix.files:
+            continue
+        pt, st, sr = ix.remove_file(relpath)
+        if sr['instances'] == {}:
+            ix.remove_series(pt, st, sr)
+        if st['series'] == []:
+            ix.remove_study(pt, st)
+        if pt['studies'] == []:
+            ix.remove_patient(pt)
     return dbtree
 
 
@@ -143,76 +388,62 @@ def uid(dbtree, entity): # uid from entity
     
 
 def study_uid(dbtree, study):
-    patient_id, study = study[1], study[2]
-    for pt in sorted(dbtree, key=lambda pt: pt['PatientID']):
-        if pt['PatientID'] == patient_id:
-
-            uid_studies = {}
-            study_idx = {}
-            for st in sorted(pt['studies'], key=lambda st: st['StudyInstanceUID']):
-                study_desc = st['StudyDescription']
-                uid_study = st['StudyInstanceUID']
-                if study_desc in study_idx:
-                    study_idx[study_desc] += 1
-                else:
-                    study_idx[study_desc] = 0
-                study_desc = (study_desc, study_idx[study_desc])
-                if study == study_desc:
-                    return uid_study
-                uid_studies[study_desc] = uid_study
-
-            if isinstance(study, str):
-                studies_list = [s for s in uid_studies.keys() if s[0]==study]
-                if len(studies_list) == 1:
-                    return uid_studies[(study, 0)]
-                elif len(studies_list) > 1:
-                    raise AmbiguousError(
-                        f"Multiple studies with name {study}. "
-                        f"Please specify the index along with the description. "
-                        f"For instance ({study}, {len(uid_studies)-1})'. "
-                    )
-            raise ValueError(f"Study {study} not found in patient {patient_id}.")
+    if not isinstance(dbtree, list):
+        return dbtree.study_uid(study)
+    return index_of(dbtree).study(study)['StudyInstanceUID']
 
 
 def series_uid(dbtree, series): # absolute path to series
-    uid_study = study_uid(dbtree, series[:-1])
-    study, sery = series[2], series[3]
-    for pt in sorted(dbtree, key=lambda pt: pt['PatientID']):
-        for st in sorted(pt['studies'], key=lambda st: st['StudyInstanceUID']):
-            if st['StudyInstanceUID'] == uid_study:
-
-                series = {}
-                series_idx = {}
-                for sr in sorted(st['series'], key=lambda sr: sr['SeriesNumber']):
-                    series_desc = sr['SeriesDescription']
-                    uid_series = sr['SeriesInstanceUID']
-                    if series_desc in series_idx:
-                        series_idx[series_desc] += 1
-                    else:
-                        series_idx[series_desc] = 0
-                    series_desc = (series_desc, series_idx[series_desc])
-                    if sery == series_desc:
-                        return uid_series
-                    series[series_desc] = uid_series
-
-                if isinstance(sery, str):
-                    series_list = [s for s in series.keys() if s[0]==sery]
-                    if len(series_list) == 1:
-                        return series[(sery, 0)]
-                    elif len(series_list) > 1:
-                        raise AmbiguousError(
-                            f"Multiple series with name {sery}. "
-                            f"Please specify the index along with the description. "
-                            f"For instance ({sery}, {len(series)-1})'. "
-                        )
-                raise ValueError(f"Series {sery} not found in study {study}.")
+    if not isinstance(dbtree, list):
+        return dbtree.series_uid(series)
+    return index_of(dbtree).sery(series)['SeriesInstanceUID']
+
+
+def max_study_id(dbtree, patient_id):
+    # Largest integer StudyID in a patient
+    if not isinstance(dbtree, list):
+        return dbtree.max_study_id(patient_id)
+    pt = index_of(dbtree).patients.get(patient_id)
+    if pt is None:
+        return 0
+    n = []
+    for st in pt['studies']:
+        try:
+            n.append(int(st['StudyID']))
+        except:
+            pass
+    return max(n) if n != [] else 0
+
+
+def max_series_number(dbtree, study_uid):
+    if not isinstance(dbtree, list):
+        return dbtree.max_series_number(study_uid)
+    ix = index_of(dbtree)
+    if study_uid not in ix.studies:
+        return 0
+    _, st = ix.studies[study_uid]
+    return max([int(sr['SeriesNumber']) for sr in st['series']], default=0)
+
+
+def max_instance_number(dbtree, series_uid):
+    if not isinstance(dbtree, list):
+        return dbtree.max_instance_number(series_uid)
+    ix = index_of(dbtree)
+    if series_uid not in ix.series:
+        return 0
+    _, _, sr = ix.series[series_uid]
+    return max([int(i) for i in sr['instances'].keys()], default=0)
 
 
 def patients(dbtree, database, name=None, contains=None, isin=None):
 
+    if isinstance(dbtree, list):
+        all_patients = [(pt['PatientID'], pt['PatientName']) for pt in index_of(dbtree).sorted_patients()]
+    else:
+        all_patients = dbtree.patients()
+
     patients = []
-    for pt in sorted(dbtree, key=lambda pt: pt['PatientID']):
-        patient_name = pt['PatientName']
+    for patient_id, patient_name in all_patients:
         append = True
         if name is not None:
             append = append and (patient_name==name)
@@ -221,24 +452,21 @@ def patients(dbtree, database, name=None, contains=None, isin=None):
         if isin is not None:
             append = append and (patient_name in isin)
         if append:
-            patients.append(pt['PatientID'])
+            patients.append(patient_id)
 
     return [[database, p] for p in patients]
 
 
 def studies(dbtree, pat, desc=None, contains=None, isin=None):
     database, patient_id = pat[0], pat[1]
-    studies = []
-    for pt in sorted(dbtree, key=lambda pt: pt['PatientID']):
-        if pt['PatientID'] == patient_id:
-            study_idx = {}
-            for st in sorted(pt['studies'], key=lambda st: st['StudyInstanceUID']):
-                study_desc = st['StudyDescription']
-                if study_desc in study_idx:
-                    study_idx[study_desc] += 1
-                else:
-                    study_idx[study_desc] = 0
-                studies.append((study_desc, study_idx[study_desc]))
+    if not isinstance(dbtree, list):
+        studies = dbtree.studies(patient_id)
+    else:
+        ix = index_of(dbtree)
+        if patient_id in ix.patients:
+            studies = list(ix.study_names(patient_id).keys())
+        else:
+            studies = []
 
     # Apply filters
     if desc is not None:   
@@ -255,36 +483,21 @@ def studies(dbtree, pat, desc=None, contains=None, isin=None):
 
 def series(dbtree, stdy, desc=None, contains=None, isin=None):
     database, patient_id, study = stdy[0], stdy[1], stdy[2]
-    study_as_str = isinstance(study, str)
-    if study_as_str:
-        study = (study, 0)
+    ix = index_of(dbtree) if isinstance(dbtree, list) else None
     series = []
-    for pt in sorted(dbtree, key=lambda pt: pt['PatientID']):
-        if pt['PatientID'] == patient_id:
-            study_idx = {}
-            for st in sorted(pt['studies'], key=lambda st: st['StudyInstanceUID']):
-                study_desc = st['StudyDescription']
-                if study_desc in study_idx:
-                    study_idx[study_desc] += 1
-                else:
-                    study_idx[study_desc] = 0
-                if study[0] == study_desc:
-                    if study_as_str:
-                        if study_idx[study_desc] > 0:
-                            raise AmbiguousError(
-                                f"Multiple studies named {study_desc} in patient {patient_id}. Please provide an index along with the study description."
-                            )
-                if study == (study_desc, study_idx[study_desc]):
-                    series_idx = {}
-                    for sr in sorted(st['series'], key=lambda sr: sr['SeriesNumber']):
-                        series_desc = sr['SeriesDescription']
-                        if series_desc in series_idx:
-                            series_idx[series_desc] += 1
-                        else:
-                            series_idx[series_desc] = 0
-                        series.append((series_desc, series_idx[series_desc]))
-                    if not study_as_str:
-                        break
+    if ix is None:
+        series = dbtree.series(patient_id, study)
+    elif patient_id in ix.patients:
+        study_names = ix.study_names(patient_id)
+        if isinstance(study, str):
+            if (study, 1) in study_names:
+                raise AmbiguousError(
+                    f"Multiple studies named {study} in patient {patient_id}. Please provide an index along with the study description."
+                )
+            study = (study, 0)
+        if study in study_names:
+            st = study_names[study]
+            series = list(ix.series_names(st['StudyInstanceUID']).keys())
 
     # Apply filters (if any)
     if desc is not None:    
@@ -328,6 +541,12 @@ def series(dbtree, stdy, desc=None, contains=None, isin=None):
 #     return study + [(desc, cnt)]
 
 
+def to_list(dbtree):
+    # The register as a tree of lists and dictionaries
+    if not isinstance(dbtree, list):
+        return dbtree.to_list()
+    return dbtree
+
 
 def print_tree(dbtree):
     tree = summary(dbtree)
@@ -342,30 +561,17 @@ def print_tree(dbtree):
 def summary(dbtree):
     # A human-readable summary tree
 
+    if not isinstance(dbtree, list):
+        return dbtree.summary()
+
+    ix = index_of(dbtree)
     summary = {}
 
-    for patient in sorted(dbtree, key=lambda pt: pt['PatientID']):
+    for patient in ix.sorted_patients():
         pat_id, pat_name = patient['PatientID'], patient['PatientName']
         summary[pat_id, pat_name] = {}
-
-        study_idx = {}
-        for study in sorted(patient['studies'], key=lambda st: st['StudyInstanceUID']):
-            study_desc = study['StudyDescription']
-            if study_desc in study_idx:
-                study_idx[study_desc] += 1
-            else:
-                study_idx[study_desc] = 0
-            summary[pat_id, pat_name][study_desc, study_idx[study_desc]] = []
-
-            series_idx = {}
-            for series in sorted(study['series'], key=lambda sr: sr['SeriesNumber']):
-                series_desc = series['SeriesDescription']
-                if series_desc in series_idx:
-                    series_idx[series_desc] += 1
-                else:
-                    series_idx[series_desc] = 0
-                summary[pat_id, pat_name][study_desc, study_idx[study_desc]].append((series_desc, series_idx[series_desc]))
+        for study_name, study in ix.study_names(pat_id).items():
+            series_names = ix.series_names(study['StudyInstanceUID'])
+            summary[pat_id, pat_name][study_name] = list(series_names.keys())
     
-    return summary
-
-
+    return summary
\ No newline at end of file
@@ -0,0 +1,613 @@
+"""Register stored in an SQLite database.
+
+This is an alternative to the register in dbtree.json. The tree is
+held in tables of patients, studies, series and instances, which
+are queried as needed instead of being loaded in memory. Changes
+are written to disk when they are made, one transaction at a time,
+so there is nothing to save when the database is closed.
+
+The functions in dbdicom.register accept a SqliteTree wherever they
+accept a list, and call the methods of this class.
+"""
+
+import os
+import json
+import sqlite3
+from collections.abc import MutableMapping
+from urllib.request import pathname2url
+
+import dbdicom.register as register
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS patients (
+    id INTEGER PRIMARY KEY,
+    PatientID TEXT,
+    PatientName TEXT
+);
+CREATE TABLE IF NOT EXISTS studies (
+    id INTEGER PRIMARY KEY,
+    patient INTEGER REFERENCES patients(id) ON DELETE CASCADE,
+    StudyInstanceUID TEXT,
+    StudyDescription TEXT,
+    StudyID TEXT,
+    StudyDate TEXT
+);
+CREATE TABLE IF NOT EXISTS series (
+    id INTEGER PRIMARY KEY,
+    study INTEGER REFERENCES studies(id) ON DELETE CASCADE,
+    SeriesInstanceUID TEXT,
+    SeriesDescription TEXT,
+    SeriesNumber INTEGER
+);
+CREATE TABLE IF NOT EXISTS instances (
+    id INTEGER PRIMARY KEY,
+    series INTEGER REFERENCES series(id) ON DELETE CASCADE,
+    InstanceNumber,
+    path TEXT,
+    UNIQUE (series, InstanceNumber)
+);
+CREATE INDEX IF NOT EXISTS patients_uid ON patients(PatientID);
+CREATE INDEX IF NOT EXISTS studies_patient ON studies(patient, StudyInstanceUID);
+CREATE INDEX IF NOT EXISTS studies_uid ON studies(StudyInstanceUID);
+CREATE INDEX IF NOT EXISTS studies_desc ON studies(StudyDescription);
+CREATE INDEX IF NOT EXISTS series_study ON series(study, SeriesNumber);
+CREATE INDEX IF NOT EXISTS series_uid ON series(SeriesInstanceUID);
+CREATE INDEX IF NOT EXISTS series_desc ON series(SeriesDescription);
+CREATE INDEX IF NOT EXISTS instances_path ON instances(path);
+"""
+
+FINGERPRINTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fingerprints (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER
+);
+"""
+
+COLUMNS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS columns (
+    position INTEGER PRIMARY KEY,
+    name TEXT
+);
+CREATE TABLE IF NOT EXISTS column_values (
+    path TEXT PRIMARY KEY,
+    vals TEXT
+);
+"""
+
+SETTINGS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Files that SQLite may create next to the database
+SIDE_FILES = ['-journal', '-wal', '-shm']
+
+
+class SqliteTree():
+    """Register tree in an SQLite database file.
+
+    The connection is opened when it is first needed, and closed
+    by close(). It is opened again if the tree is used after that.
+
+    Args:
+        file (str): path to the database file. The file is created
+            if it does not exist.
+        readonly (bool, optional): open the file read-only. 
+            Defaults to False.
+    """
+
+    def __init__(self, file, readonly=False):
+        self.file = file
+        self.readonly = readonly
+        self._con = None
+
+    @property
+    def con(self):
+        if self._con is None and self.readonly:
+            uri = 'file:' + pathname2url(os.path.abspath(self.file)) + '?mode=ro'
+            self._con = sqlite3.connect(uri, uri=True)
+            self._con.row_factory = sqlite3.Row
+        elif self._con is None:
+            self._con = sqlite3.connect(self.file)
+            self._con.row_factory = sqlite3.Row
+            self._con.execute("PRAGMA foreign_keys = ON")
+            # With a write-ahead log, commits do not wait for the
+            # disk. A crash may lose the last few transactions but
+            # does not corrupt the database.
+            self._con.execute("PRAGMA journal_mode = WAL")
+            self._con.execute("PRAGMA synchronous = NORMAL")
+            self._con.executescript(SCHEMA)
+        return self._con
+
+    def close(self):
+        if self._con is not None:
+            self._con.close()
+            self._con = None
+
+    def load(self, dbtree:list):
+        """Replace the contents by a register tree"""
+        with self.con as con:
+            con.execute("DELETE FROM patients")
+            for pt in dbtree:
+                pt_id = con.execute(
+                    "INSERT INTO patients (PatientID, PatientName) VALUES (?, ?)",
+                    (pt['PatientID'], pt['PatientName']),
+                ).lastrowid
+                for st in pt['studies']:
+                    st_id = con.execute(
+                        "INSERT INTO studies (patient, StudyInstanceUID, StudyDescription, StudyID, StudyDate) VALUES (?, ?, ?, ?, ?)",
+                        (pt_id, st['StudyInstanceUID'], st['StudyDescription'], st['StudyID'], st.get('StudyDate')),
+                    ).lastrowid
+                    for sr in st['series']:
+                        sr_id = con.execute(
+                            "INSERT INTO series (study, SeriesInstanceUID, SeriesDescription, SeriesNumber) VALUES (?, ?, ?, ?)",
+                            (st_id, sr['SeriesInstanceUID'], sr['SeriesDescription'], sr['SeriesNumber']),
+                        ).lastrowid
+                        con.executemany(
+                            "INSERT INTO instances (series, InstanceNumber, path) VALUES (?, ?, ?)",
+                            [(sr_id, nr, f) for nr, f in sr['instances'].items()],
+                        )
+        return self
+
+    def to_list(self):
+        """Return the register as a tree of lists and dictionaries"""
+        dbtree = []
+        for pt in self._patients():
+            studies = []
+            for st in self._studies(pt['id']):
+                series = []
+                for sr in self._series(st['id']):
+                    series.append({
+                        'SeriesNumber': sr['SeriesNumber'],
+                        'SeriesDescription': sr['SeriesDescription'],
+                        'SeriesInstanceUID': sr['SeriesInstanceUID'],
+                        'instances': {i['InstanceNumber']: i['path'] for i in self._instances(sr['id'])},
+                    })
+                study = {
+                    'StudyDescription': st['StudyDescription'],
+                    'StudyID': st['StudyID'],
+                    'StudyInstanceUID': st['StudyInstanceUID'],
+                }
+                if st['StudyDate'] is not None:
+                    study['StudyDate'] = st['StudyDate']
+                study['series'] = series
+                studies.append(study)
+            dbtree.append({
+                'PatientName': pt['PatientName'],
+                'PatientID': pt['PatientID'],
+                'studies': studies,
+            })
+        return dbtree
+
+    def fingerprints(self):
+        """Return the fingerprints of the files in the folder, or None
+        if they have not been recorded."""
+        row = self.con.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name='fingerprints'"
+        ).fetchone()
+        if row is None:
+            return None
+        return Fingerprints(self)
+
+    def set_fingerprints(self, fingerprints:dict):
+        """Replace the fingerprints of the files in the folder"""
+        with self.con as con:
+            con.executescript(FINGERPRINTS_SCHEMA)
+            con.execute("DELETE FROM fingerprints")
+            con.executemany(
+                "INSERT INTO fingerprints (path, size, mtime_ns) VALUES (?, ?, ?)",
+                [(f, fp[0], fp[1]) for f, fp in fingerprints.items()],
+            )
+        return Fingerprints(self)
+
+    def columns(self):
+        """Return the names of the extra columns and their values for 
+        each file, or None if there are no extra columns."""
+        row = self.con.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name='columns'"
+        ).fetchone()
+        if row is None:
+            return None
+        rows = self.con.execute("SELECT name FROM columns ORDER BY position").fetchall()
+        return [row['name'] for row in rows], ColumnValues(self)
+
+    def set_columns(self, names:list, values:dict):
+        """Replace the extra columns and their values"""
+        with self.con as con:
+            con.executescript(COLUMNS_SCHEMA)
+            con.execute("DELETE FROM columns")
+            con.execute("DELETE FROM column_values")
+            con.executemany(
+                "INSERT INTO columns (position, name) VALUES (?, ?)",
+                list(enumerate(names)),
+            )
+            con.executemany(
+                "INSERT INTO column_values (path, vals) VALUES (?, ?)",
+                [(f, _dumps(v)) for f, v in values.items()],
+            )
+        return ColumnValues(self)
+
+    def settings(self):
+        """Return the settings saved with the register, as a dictionary"""
+        row = self.con.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name='settings'"
+        ).fetchone()
+        if row is None:
+            return {}
+        rows = self.con.execute("SELECT name, value FROM settings").fetchall()
+        return {row['name']: json.loads(row['value']) for row in rows}
+
+    def set_settings(self, settings:dict):
+        """Replace the settings saved with the register"""
+        with self.con as con:
+            con.executescript(SETTINGS_SCHEMA)
+            con.execute("DELETE FROM settings")
+            con.executemany(
+                "INSERT INTO settings (name, value) VALUES (?, ?)",
+                [(name, _dumps(value)) for name, value in settings.items()],
+            )
+
+    def add_instance(self, attr, rel_path):
+        return self.add_instances([(attr, rel_path)])
+
+    def add_instances(self, instances):
+        # All instances are added in a single transaction
+        series = {} # (PatientID, StudyInstanceUID, SeriesInstanceUID): id
+        rows = []
+        with self.con as con:
+            for attr, rel_path in instances:
+                key = (attr['PatientID'], attr['StudyInstanceUID'], attr['SeriesInstanceUID'])
+                if key not in series:
+                    series[key] = self._series_id(con, attr)
+                rows.append((series[key], attr['InstanceNumber'], rel_path))
+            con.executemany(
+                "INSERT INTO instances (series, InstanceNumber, path) VALUES (?, ?, ?) "
+                "ON CONFLICT (series, InstanceNumber) DO UPDATE SET path=excluded.path",
+                rows,
+            )
+        return self
+
+    def _series_id(self, con, attr):
+        # id of the series of an instance, creating it if needed
+        pt = con.execute(
+            "SELECT id FROM patients WHERE PatientID=? ORDER BY id LIMIT 1",
+            (attr['PatientID'],),
+        ).fetchone()
+        if pt is None:
+            pt_id = con.execute(
+                "INSERT INTO patients (PatientID, PatientName) VALUES (?, ?)",
+                (attr['PatientID'], attr['PatientName']),
+            ).lastrowid
+        else:
+            pt_id = pt['id']
+        st = con.execute(
+            "SELECT id FROM studies WHERE patient=? AND StudyInstanceUID=? ORDER BY id LIMIT 1",
+            (pt_id, attr['StudyInstanceUID']),
+        ).fetchone()
+        if st is None:
+            st_id = con.execute(
+                "INSERT INTO studies (patient, StudyInstanceUID, StudyDescription, StudyID) VALUES (?, ?, ?, ?)",
+                (pt_id, attr['StudyInstanceUID'], attr['StudyDescription'], attr['StudyID']),
+            ).lastrowid
+        else:
+            st_id = st['id']
+        sr = con.execute(
+            "SELECT id FROM series WHERE study=? AND SeriesInstanceUID=? ORDER BY SeriesNumber, id LIMIT 1",
+            (st_id, attr['SeriesInstanceUID']),
+        ).fetchone()
+        if sr is None:
+            return con.execute(
+                "INSERT INTO series (study, SeriesInstanceUID, SeriesDescription, SeriesNumber) VALUES (?, ?, ?, ?)",
+                (st_id, attr['SeriesInstanceUID'], attr['SeriesDescription'], attr['SeriesNumber']),
+            ).lastrowid
+        return sr['id']
+
+    def index(self, entity):
+        if isinstance(entity, str):
+            rows = self.con.execute(
+                "SELECT i.path FROM instances i "
+                "JOIN series sr ON i.series=sr.id "
+                "JOIN studies st ON sr.study=st.id "
+                "JOIN patients pt ON st.patient=pt.id "
+                "ORDER BY pt.PatientID, pt.id, st.StudyInstanceUID, st.id, sr.SeriesNumber, sr.id, i.id"
+            )
+        elif len(entity)==2:
+            pt_id = self._patient_id(entity[1])
+            rows = self.con.execute(
+                "SELECT i.path FROM instances i "
+                "JOIN series sr ON i.series=sr.id "
+                "JOIN studies st ON sr.study=st.id "
+                "WHERE st.patient=? "
+                "ORDER BY st.StudyInstanceUID, st.id, sr.SeriesNumber, sr.id, i.id",
+                (pt_id,),
+            )
+        elif len(entity)==3:
+            st_id = self._study(entity)['id']
+            rows = self.con.execute(
+                "SELECT i.path FROM instances i "
+                "JOIN series sr ON i.series=sr.id "
+                "WHERE sr.study=? "
+                "ORDER BY sr.SeriesNumber, sr.id, i.id",
+                (st_id,),
+            )
+        elif len(entity)==4:
+            sr_id = self._sery(entity)['id']
+            rows = self.con.execute(
+                "SELECT path FROM instances WHERE series=? ORDER BY id",
+                (sr_id,),
+            )
+        return [row['path'] for row in rows]
+
+    def remove(self, entity):
+        if len(entity)==2:
+            with self.con as con:
+                con.execute("DELETE FROM patients WHERE PatientID=?", (entity[1],))
+        elif len(entity)==3:
+            st_id = self._study(entity)['id']
+            with self.con as con:
+                con.execute("DELETE FROM studies WHERE id=?", (st_id,))
+        elif len(entity)==4:
+            sr_id = self._sery(entity)['id']
+            with self.con as con:
+                con.execute("DELETE FROM series WHERE id=?", (sr_id,))
+        return self
+
+    def drop(self, relpaths):
+        with self.con as con:
+            con.executemany(
+                "DELETE FROM instances WHERE path=?",
+                [(f,) for f in relpaths],
+            )
+            con.execute("DELETE FROM series WHERE id NOT IN (SELECT series FROM instances)")
+            con.execute("DELETE FROM studies WHERE id NOT IN (SELECT study FROM series)")
+            con.execute("DELETE FROM patients WHERE id NOT IN (SELECT patient FROM studies)")
+        return self
+
+    def study_uid(self, study):
+        return self._study(study)['StudyInstanceUID']
+
+    def series_uid(self, series):
+        return self._sery(series)['SeriesInstanceUID']
+
+    def max_study_id(self, patient_id):
+        rows = self.con.execute(
+            "SELECT st.StudyID FROM studies st JOIN patients pt ON st.patient=pt.id "
+            "WHERE pt.PatientID=?",
+            (patient_id,),
+        )
+        n = []
+        for row in rows:
+            try:
+                n.append(int(row['StudyID']))
+            except:
+                pass
+        return max(n) if n != [] else 0
+
+    def max_series_number(self, study_uid):
+        row = self.con.execute(
+            "SELECT MAX(sr.SeriesNumber) FROM series sr "
+            "WHERE sr.study=(SELECT id FROM studies WHERE StudyInstanceUID=? ORDER BY id LIMIT 1)",
+            (study_uid,),
+        ).fetchone()
+        return 0 if row[0] is None else int(row[0])
+
+    def max_instance_number(self, series_uid):
+        row = self.con.execute(
+            "SELECT MAX(CAST(InstanceNumber AS INTEGER)) FROM instances "
+            "WHERE series=(SELECT id FROM series WHERE SeriesInstanceUID=? ORDER BY id LIMIT 1)",
+            (series_uid,),
+        ).fetchone()
+        return 0 if row[0] is None else int(row[0])
+
+    def patients(self):
+        """Return (PatientID, PatientName) of all patients"""
+        return [(pt['PatientID'], pt['PatientName']) for pt in self._patients()]
+
+    def studies(self, patient_id):
+        """Return the names of the studies in a patient"""
+        pt_id = self._patient_id(patient_id, missing_ok=True)
+        if pt_id is None:
+            return []
+        return list(self._study_names(pt_id).keys())
+
+    def series(self, patient_id, study):
+        """Return the names of the series in a study"""
+        pt_id = self._patient_id(patient_id, missing_ok=True)
+        if pt_id is None:
+            return []
+        study_names = self._study_names(pt_id)
+        if isinstance(study, str):
+            if (study, 1) in study_names:
+                raise register.AmbiguousError(
+                    f"Multiple studies named {study} in patient {patient_id}. Please provide an index along with the study description."
+                )
+            study = (study, 0)
+        if study not in study_names:
+            return []
+        return list(self._series_names(study_names[study]['id']).keys())
+
+    def summary(self):
+        summary = {}
+        for pt in self._patients():
+            pat_id, pat_name = pt['PatientID'], pt['PatientName']
+            summary[pat_id, pat_name] = {}
+            for study_name, st in self._study_names(pt['id']).items():
+                series_names = self._series_names(st['id'])
+                summary[pat_id, pat_name][study_name] = list(series_names.keys())
+        return summary
+
+    def _patients(self):
+        return self.con.execute("SELECT * FROM patients ORDER BY PatientID, id").fetchall()
+
+    def _studies(self, pt_id):
+        return self.con.execute(
+            "SELECT * FROM studies WHERE patient=? ORDER BY StudyInstanceUID, id",
+            (pt_id,),
+        ).fetchall()
+
+    def _series(self, st_id):
+        return self.con.execute(
+            "SELECT * FROM series WHERE study=? ORDER BY SeriesNumber, id",
+            (st_id,),
+        ).fetchall()
+
+    def _instances(self, sr_id):
+        return self.con.execute(
+            "SELECT InstanceNumber, path FROM instances WHERE series=? ORDER BY id",
+            (sr_id,),
+        ).fetchall()
+
+    def _patient_id(self, patient_id, missing_ok=False):
+        row = self.con.execute(
+            "SELECT id FROM patients WHERE PatientID=? ORDER BY id LIMIT 1",
+            (patient_id,),
+        ).fetchone()
+        if row is not None:
+            return row['id']
+        if not missing_ok:
+            raise ValueError(f"Patient {patient_id} not found.")
+
+    def _study_names(self, pt_id):
+        return register._names(self._studies(pt_id), 'StudyDescription')
+
+    def _series_names(self, st_id):
+        return register._names(self._series(st_id), 'SeriesDescription')
+
+    def _study(self, study):
+        # study = [database, patient_id, study_name]
+        names = self._study_names(self._patient_id(study[1]))
+        return names[register._name(names, study[2], 'study', study[1])]
+
+    def _sery(self, series):
+        # series = [database, patient_id, study_name, series_name]
+        names = self._series_names(self._study(series[:3])['id'])
+        return names[register._name(names, series[3], 'series', series[2])]
+
+
+
+class Fingerprints(MutableMapping):
+    """Fingerprints of the files in the folder, stored in the database.
+
+    This behaves like the dictionary {rel_path: [size, mtime_ns]},
+    and writes any changes through to the database.
+
+    Args:
+        dbtree (SqliteTree): the register.
+    """
+
+    def __init__(self, dbtree:SqliteTree):
+        self.dbtree = dbtree
+
+    def __getitem__(self, rel_path):
+        row = self.dbtree.con.execute(
+            "SELECT size, mtime_ns FROM fingerprints WHERE path=?", (rel_path,),
+        ).fetchone()
+        if row is None:
+            raise KeyError(rel_path)
+        return [row['size'], row['mtime_ns']]
+
+    def __setitem__(self, rel_path, fingerprint):
+        with self.dbtree.con as con:
+            con.execute(
+                "INSERT OR REPLACE INTO fingerprints (path, size, mtime_ns) VALUES (?, ?, ?)",
+                (rel_path, fingerprint[0], fingerprint[1]),
+            )
+
+    def __delitem__(self, rel_path):
+        with self.dbtree.con as con:
+            cursor = con.execute("DELETE FROM fingerprints WHERE path=?", (rel_path,))
+        if cursor.rowcount == 0:
+            raise KeyError(rel_path)
+
+    def __iter__(self):
+        rows = self.dbtree.con.execute("SELECT path FROM fingerprints").fetchall()
+        return iter([row['path'] for row in rows])
+
+    def __len__(self):
+        return self.dbtree.con.execute("SELECT COUNT(*) FROM fingerprints").fetchone()[0]
+
+    def update(self, fingerprints):
+        # One transaction rather than one per item
+        with self.dbtree.con as con:
+            con.executemany(
+                "INSERT OR REPLACE INTO fingerprints (path, size, mtime_ns) VALUES (?, ?, ?)",
+                [(f, fp[0], fp[1]) for f, fp in fingerprints.items()],
+            )
+
+    def items(self):
+        # One query rather than one per item
+        rows = self.dbtree.con.execute("SELECT * FROM fingerprints").fetchall()
+        return [(row['path'], [row['size'], row['mtime_ns']]) for row in rows]
+
+    def drop(self, rel_paths):
+        # Remove several files in one transaction
+        with self.dbtree.con as con:
+            con.executemany(
+                "DELETE FROM fingerprints WHERE path=?",
+                [(f,) for f in rel_paths],
+            )
+
+
+class ColumnValues(MutableMapping):
+    """Values of the extra columns, stored in the database.
+
+    This behaves like the dictionary {rel_path: [values]}, and 
+    writes any changes through to the database.
+
+    Args:
+        dbtree (SqliteTree): the register.
+    """
+
+    def __init__(self, dbtree:SqliteTree):
+        self.dbtree = dbtree
+
+    def __getitem__(self, rel_path):
+        row = self.dbtree.con.execute(
+            "SELECT vals FROM column_values WHERE path=?", (rel_path,),
+        ).fetchone()
+        if row is None:
+            raise KeyError(rel_path)
+        return json.loads(row['vals'])
+
+    def __setitem__(self, rel_path, values):
+        with self.dbtree.con as con:
+            con.execute(
+                "INSERT OR REPLACE INTO column_values (path, vals) VALUES (?, ?)",
+                (rel_path, _dumps(values)),
+            )
+
+    def __delitem__(self, rel_path):
+        with self.dbtree.con as con:
+            cursor = con.execute("DELETE FROM column_values WHERE path=?", (rel_path,))
+        if cursor.rowcount == 0:
+            raise KeyError(rel_path)
+
+    def __iter__(self):
+        rows = self.dbtree.con.execute("SELECT path FROM column_values").fetchall()
+        return iter([row['path'] for row in rows])
+
+    def __len__(self):
+        return self.dbtree.con.execute("SELECT COUNT(*) FROM column_values").fetchone()[0]
+
+    def update(self, values):
+        # One transaction rather than one per item
+        with self.dbtree.con as con:
+            con.executemany(
+                "INSERT OR REPLACE INTO column_values (path, vals) VALUES (?, ?)",
+                [(f, _dumps(v)) for f, v in values.items()],
+            )
+
+
+def _dumps(values):
+    return json.dumps(values, default=_to_json)
+
+
+def _to_json(value):
+    # numpy scalars, for instance derived slice locations
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f"{type(value)} can't be saved in the register.")
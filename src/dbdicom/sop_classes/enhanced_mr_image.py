@@ -1,7 +1,7 @@
 # Coded version of DICOM file 'C:\Users\steve\Dropbox\Software\QIB-Sheffield\dbdicom\tests\data\MULTIFRAME\IM_0010'
 # Produced by pydicom codify utility script
 
-import datetime
+from copy import deepcopy
 
 import numpy as np
 import vreg
@@ -12,135 +12,246 @@ from pydicom.sequence import Sequence
 from pydicom.uid import ExplicitVRLittleEndian, generate_uid
 
 import dbdicom.utils.image as image_utils
+from dbdicom.sop_classes import mr_image
 from dbdicom.utils.pydicom_dataset import set_values, get_values
 
 
-def from_volume(vol:vreg.Volume3D):
+# Functional group macros of attributes that are often dimensions 
+# of a volume, and the keyword of the attribute in the macro
+MACROS = {
+    'EchoTime': ('MREchoSequence', 'EffectiveEchoTime'),
+    'FlipAngle': ('MRTimingAndRelatedParametersSequence', 'FlipAngle'),
+    'RepetitionTime': ('MRTimingAndRelatedParametersSequence', 'RepetitionTime'),
+    'InversionTime': ('MRModifierSequence', 'InversionTimes'),
+    'TriggerTime': ('CardiacSynchronizationSequence', 'NominalCardiacTriggerDelayTime'),
+    'ImageType': ('MRImageFrameTypeSequence', 'FrameType'),
+    'DiffusionBValue': ('MRDiffusionSequence', 'DiffusionBValue'),
+    'TemporalPositionIdentifier': ('FrameContentSequence', 'TemporalPositionIndex'),
+}
+
+# Other dimensions are saved in a private macro. The private creator 
+# is also set at the top level, to mark files written by dbdicom.
+PRIVATE_CREATOR = 'dbdicom'
+PRIVATE_GROUP = 0x0071
+
+# Attributes of a reference image that are set per frame, or do not 
+# apply to a multi-frame image
+FRAME_ATTRIBUTES = [
+    'SOPInstanceUID', 'InstanceNumber', 'ImagePositionPatient', 
+    'ImageOrientationPatient', 'PixelSpacing', 'SliceThickness', 
+    'SpacingBetweenSlices', 'SliceLocation', 'RescaleSlope', 
+    'RescaleIntercept', 'RescaleType', 'WindowCenter', 'WindowWidth', 
+    'SmallestImagePixelValue', 'LargestImagePixelValue', 
+    'PixelData', 'FloatPixelData', 'DoubleFloatPixelData',
+]
+
+
+def from_volume(vol:vreg.Volume3D, ref:Dataset=None, frames:slice=None):
     """
     Build an Enhanced MR Image DICOM dataset from N+3D array.
 
+    The frames are ordered by slice first, and then by the other 
+    dimensions in C-order, in the same order as the files written by 
+    write_volume(). Each frame is saved in 16 bit with its own 
+    rescale slope and intercept, as in a single-frame MR image.
+
     Parameters
     ----------
     vol: vreg Volume3D
+        Dimensions beyond the third are saved per frame. These are 
+        DICOM keywords, or 'Sequence/Keyword' to save the attribute 
+        in a specific functional group macro.
+    ref: pydicom Dataset, optional
+        Single-frame image to copy the other attributes from, such 
+        as patient and study. If this is not provided, the attributes 
+        of a new MR image are used.
+    frames: slice, optional
+        Range of frames to include. This is used to save a large 
+        volume as a concatenation of files. Defaults to all frames.
 
     Returns
     -------
     pydicom dataset
     """
-
-    # Flatten frames
-    frames = vol.values.reshape(vol.shape[:2] + (-1,))
+    if ref is None:
+        ref = mr_image.default()
+    values = vol.values.reshape(vol.shape[:3] + (-1,))
+    nframes = values.shape[2] * values.shape[3]
+    frames = range(nframes)[slice(None) if frames is None else frames]
     geom = image_utils.dismantle_affine_matrix(vol.affine)
+    dims = [] if vol.ndim == 3 else list(vol.dims)
+    coords = [] if vol.ndim == 3 else [np.asarray(c).reshape(-1) for c in vol.coords]
 
-    # --- FileDataset ---
+    # Attributes of the reference image
     ds = Dataset()
+    for elem in ref:
+        if elem.keyword in FRAME_ATTRIBUTES + dims:
+            continue
+        if elem.tag in [(0x2005, 0x100E), (0x2005, 0x100D)]: # Philips rescale
+            continue
+        if elem.tag.group == PRIVATE_GROUP:
+            continue
+        ds.add(deepcopy(elem))
+    ds.private_block(PRIVATE_GROUP, PRIVATE_CREATOR, create=True)
 
     # File Meta
     ds.file_meta = FileMetaDataset()
     ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
     ds.file_meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.4.1"  # Enhanced MR
-
-    ds.is_little_endian = True
-    ds.is_implicit_VR = False
     ds.SOPClassUID = ds.file_meta.MediaStorageSOPClassUID
     ds.SOPInstanceUID = generate_uid()
-
-    # Study/Series
-    ds.SeriesInstanceUID = generate_uid()
-    ds.StudyInstanceUID = generate_uid()
-    ds.FrameOfReferenceUID = generate_uid()
-    ds.Modality = "MR"
-    ds.PatientName = "Test^Patient"
-    ds.PatientID = "123456"
-    ds.StudyDate = datetime.date.today().strftime("%Y%m%d")
-    ds.StudyTime = datetime.datetime.now().strftime("%H%M%S")
+    ds.file_meta.MediaStorageSOPInstanceUID = ds.SOPInstanceUID
+    ds.InstanceNumber = 1
 
     # Image attributes
     ds.Columns = vol.shape[0]
     ds.Rows = vol.shape[1]
-    ds.NumberOfFrames = np.prod(vol.shape[2:])
+    ds.NumberOfFrames = len(frames)
     ds.SamplesPerPixel = 1
     ds.PhotometricInterpretation = "MONOCHROME2"
     ds.BitsAllocated = 16
     ds.BitsStored = 16
     ds.HighBit = 15
-    ds.PixelRepresentation = 1
-    ds.PixelSpacing = list(vol.spacing[:2])
-    ds.SliceThickness = vol.spacing[2]
+    ds.PixelRepresentation = 1 if values.dtype == np.int16 else 0
 
     # Dimensions
     ds.DimensionOrganizationSequence = Sequence([Dataset()])
     ds.DimensionOrganizationSequence[0].DimensionOrganizationUID = generate_uid()
     ds.DimensionIndexSequence = Sequence()
-    for axis in ['SliceLocation'] + vol.dims:
-        axis_dimension_item = Dataset()
-        axis_dimension_item.DimensionIndexPointer = pydicom.tag.Tag(axis)  
-        axis_dimension_item.DimensionDescriptionLabel = axis
-        ds.DimensionIndexSequence.append(axis_dimension_item)
+    macros = [('PlanePositionSequence', 'ImagePositionPatient')] + [_macro(d) for d in dims]
+    for sequence, attr in macros:
+        item = Dataset()
+        item.DimensionOrganizationUID = ds.DimensionOrganizationSequence[0].DimensionOrganizationUID
+        if sequence is None:
+            item.DimensionIndexPointer = pydicom.tag.Tag(attr)
+            item.FunctionalGroupPointer = pydicom.tag.Tag(PRIVATE_GROUP, 0x1001)
+            item.DimensionIndexPrivateCreator = PRIVATE_CREATOR
+            item.FunctionalGroupPrivateCreator = PRIVATE_CREATOR
+        else:
+            item.DimensionIndexPointer = pydicom.tag.Tag(attr)
+            item.FunctionalGroupPointer = pydicom.tag.Tag(sequence)
+        item.DimensionDescriptionLabel = attr
+        ds.DimensionIndexSequence.append(item)
 
     # Shared Functional Groups
-    ds.SharedFunctionalGroupsSequence = [Dataset()]
-    ds.SharedFunctionalGroupsSequence[0].PixelMeasuresSequence = [Dataset()]
-    ds.SharedFunctionalGroupsSequence[0].PixelMeasuresSequence[0].PixelSpacing = ds.PixelSpacing
-    ds.SharedFunctionalGroupsSequence[0].PixelMeasuresSequence[0].SliceThickness = ds.SliceThickness
-    ds.SharedFunctionalGroupsSequence[0].PixelMeasuresSequence[0].SpacingBetweenSlices = ds.SliceThickness
-    ds.SharedFunctionalGroupsSequence[0].PlaneOrientationSequence = [Dataset()]
-    ds.SharedFunctionalGroupsSequence[0].PlaneOrientationSequence[0].ImageOrientationPatient = geom['ImageOrientationPatient']
-
-    # Per-frame Functional Groups
-    PerFrameFunctionalGroupsSequence = []
-
-    for flat_index in range(frames.shape[-1]):
+    shared = Dataset()
+    shared.PixelMeasuresSequence = [Dataset()]
+    set_values(shared.PixelMeasuresSequence[0], 'PixelSpacing', geom['PixelSpacing'])
+    set_values(shared.PixelMeasuresSequence[0], 'SliceThickness', geom['SpacingBetweenSlices'])
+    set_values(shared.PixelMeasuresSequence[0], 'SpacingBetweenSlices', geom['SpacingBetweenSlices'])
+    shared.PlaneOrientationSequence = [Dataset()]
+    set_values(shared.PlaneOrientationSequence[0], 'ImageOrientationPatient', geom['ImageOrientationPatient'])
+    ds.SharedFunctionalGroupsSequence = [shared]
+
+    # Per-frame Functional Groups and pixel data
+    per_frame, pixels = [], []
+    for flat_index in frames:
+        vol_idx, slice_idx = divmod(flat_index, values.shape[2])
         frame_ds = Dataset()
-        vol_idx, slice_idx = divmod(flat_index, vol.shape[2])
         indices = np.unravel_index(vol_idx, vol.shape[3:])
-        dim_values = [i + 1 for i in indices]
 
         # Frame content
         frame_ds.FrameContentSequence = [Dataset()]
-        frame_ds.FrameContentSequence[0].DimensionIndexValues = dim_values
+        frame_ds.FrameContentSequence[0].DimensionIndexValues = [slice_idx + 1] + [int(i) + 1 for i in indices]
 
         # Plane position
         frame_ds.PlanePositionSequence = [Dataset()]
-        frame_ds.PlanePositionSequence[0].ImagePositionPatient = list(np.array(geom['ImagePositionPatient']) + slice_idx * vol.spacing[2] * np.array(geom['slice_cosine']))
-
-        # Plane orientation
-        frame_ds.PlaneOrientationSequence = [Dataset()]
-        frame_ds.PlaneOrientationSequence[0].ImageOrientationPatient = geom['ImageOrientationPatient']
+        position = vol.affine[:3, 3] + slice_idx * vol.affine[:3, 2]
+        set_values(frame_ds.PlanePositionSequence[0], 'ImagePositionPatient', position.tolist())
 
         # Assign parameters using dims as DICOM keywords
-        for ax_i, axis in enumerate(vol.dims):
-            val = vol.coords[ax_i][indices]
-
-            sequence, attr = axis.split("/")
-            if not hasattr(frame_ds, sequence):
-                setattr(frame_ds, sequence, [Dataset()])
-            sequence_ds = getattr(frame_ds, sequence)[0]
+        for ax_i, (sequence, attr) in enumerate(macros[1:]):
+            val = coords[ax_i][vol_idx]
+            if sequence is None:
+                block = frame_ds.private_block(PRIVATE_GROUP, PRIVATE_CREATOR, create=True)
+                if 0x01 not in block:
+                    block.add_new(0x01, 'SQ', Sequence([Dataset()]))
+                sequence_ds = block[0x01].value[0]
+            else:
+                if not hasattr(frame_ds, sequence):
+                    setattr(frame_ds, sequence, [Dataset()])
+                sequence_ds = getattr(frame_ds, sequence)[0]
+            if attr == 'InversionTimes':
+                val = [val]
             set_values(sequence_ds, attr, val)
 
-        # Frame anatomy & type
-        frame_ds.FrameAnatomySequence = [Dataset()]
-        frame_ds.FrameAnatomySequence[0].AnatomicRegionSequence = [Dataset()]
-        frame_ds.FrameAnatomySequence[0].AnatomicRegionSequence[0].CodeValue = "12738006"
-        frame_ds.FrameAnatomySequence[0].AnatomicRegionSequence[0].CodingSchemeDesignator = "SCT"
-        frame_ds.FrameAnatomySequence[0].AnatomicRegionSequence[0].CodeMeaning = "Brain"
+        # Pixel values
+        array, slope, intercept = _pixel_values(values[:, :, slice_idx, vol_idx])
+        frame_ds.PixelValueTransformationSequence = [Dataset()]
+        set_values(frame_ds.PixelValueTransformationSequence[0], 'RescaleSlope', slope)
+        set_values(frame_ds.PixelValueTransformationSequence[0], 'RescaleIntercept', intercept)
+        frame_ds.PixelValueTransformationSequence[0].RescaleType = 'US'
+        pixels.append(np.transpose(array).tobytes())
+
+        per_frame.append(frame_ds)
 
-        frame_ds.MRImageFrameTypeSequence = [Dataset()]
-        frame_ds.MRImageFrameTypeSequence[0].FrameType = ["ORIGINAL", "PRIMARY", "M", "NONE"]
+    ds.PerFrameFunctionalGroupsSequence = per_frame
+    ds.PixelData = b"".join(pixels)
+    ds['PixelData'].VR = 'OW'
 
-        # Acquisition datetime
-        frame_ds.FrameAcquisitionDateTime = (
-            datetime.datetime.now() + datetime.timedelta(seconds=flat_index)
-        ).strftime("%Y%m%d%H%M%S.%f")
+    return ds
 
-        PerFrameFunctionalGroupsSequence.append(frame_ds)
 
-    ds.PerFrameFunctionalGroupsSequence = PerFrameFunctionalGroupsSequence
+def concatenation(vol:vreg.Volume3D, ref:Dataset=None, max_bytes=2**31, offset=0):
+    """
+    Build Enhanced MR Image DICOM datasets from N+3D array.
 
-    # Pixel Data
-    ds.PixelData = b"".join([f.tobytes() for f in frames])
+    If the pixel data are too large for one file, the frames are 
+    split over a concatenation of datasets.
 
-    return ds
+    Parameters
+    ----------
+    vol: vreg Volume3D
+        Volume as in from_volume().
+    ref: pydicom Dataset, optional
+        Reference image as in from_volume().
+    max_bytes: int, optional
+        Maximum size of the pixel data of one dataset. Defaults to 2GB.
+    offset: int, optional
+        Number of frames before the first frame. Frames are read as 
+        instances numbered from offset + 1. Defaults to 0.
+
+    Returns
+    -------
+    list of pydicom datasets
+    """
+    nframes = int(np.prod(vol.shape[2:]))
+    frame_bytes = 2 * vol.shape[0] * vol.shape[1]
+    chunk = max(1, max_bytes // frame_bytes)
+    datasets = []
+    for start in range(0, nframes, chunk):
+        datasets.append(from_volume(vol, ref, slice(start, start + chunk)))
+    if len(datasets) == 1 and offset == 0:
+        return datasets
+    uid = generate_uid()
+    for i, ds in enumerate(datasets):
+        ds.ConcatenationUID = uid
+        ds.SOPInstanceUIDOfConcatenationSource = generate_uid()
+        ds.ConcatenationFrameOffsetNumber = offset + i * chunk
+        ds.InConcatenationNumber = i + 1
+        ds.InConcatenationTotalNumber = len(datasets)
+        ds.InstanceNumber = i + 1
+    return datasets
+
+
+def _macro(dim):
+    # Sequence and keyword of a dimension in the per-frame functional 
+    # groups. The sequence is None for the private macro.
+    if '/' in dim:
+        return tuple(dim.split("/"))
+    if dim in MACROS:
+        return MACROS[dim]
+    return None, dim
+
+
+def _pixel_values(array):
+    # Stored values, slope and intercept of a frame, as in a 
+    # single-frame MR image
+    if array.dtype in [np.int16, np.uint16]:
+        return image_utils.clip(array), 1, 0
+    array = image_utils.clip(array.astype(np.float32))
+    array, slope, intercept = image_utils.scale_to_range(array, 16)
+    return array, 1 / slope, - intercept / slope
 
 
 
@@ -42,6 +42,32 @@ def pixel_data(ds):
     return np.transpose(array)
 
 
+def pixel_data_dtype(ds):
+    """Data type of the array returned by pixel_data()"""
+
+    if [0x2005, 0x100E] in ds: # 'Philips Rescale Slope'
+        slope = ds[(0x2005, 0x100E)].value
+        intercept = ds[(0x2005, 0x100D)].value
+    else:
+        slope = float(getattr(ds, 'RescaleSlope', 1)) 
+        intercept = float(getattr(ds, 'RescaleIntercept', 0)) 
+    if (intercept == 0) and (slope == 1): 
+        return np.int16
+    return np.float32
+
+
+def rescale(ds):
+    """Slope and intercept that map stored values to pixel_data()"""
+
+    if [0x2005, 0x100E] in ds: # 'Philips Rescale Slope'
+        slope = ds[(0x2005, 0x100E)].value
+        intercept = ds[(0x2005, 0x100D)].value
+        return 1/slope, -intercept/slope
+    slope = float(getattr(ds, 'RescaleSlope', 1)) 
+    intercept = float(getattr(ds, 'RescaleIntercept', 0)) 
+    return slope, intercept
+
+
 def set_pixel_data(ds, array):
 
     # Delete 'Philips Rescale Slope'
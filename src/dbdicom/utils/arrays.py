@@ -22,6 +22,60 @@ def meshvals(arrays) -> Tuple[List[np.ndarray], np.ndarray]:
     shape : tuple[int, ...]
         Inferred grid shape (number of unique values per axis).
     """
+    # Numbers and strings are sorted as native arrays. Only 
+    # coordinates with other values, such as lists, need the slower 
+    # sort of object arrays.
+    native = [_native(a) for a in arrays]
+    if all(a is not None for a in native):
+        return _meshvals_native(native)
+    return _meshvals_object(arrays, native)
+
+
+def _native(values):
+    # Returns values as a 1D array with a numeric or string dtype, or 
+    # None if that is not possible without changing the values.
+    if isinstance(values, np.ndarray):
+        if values.ndim == 1 and values.dtype.kind in 'biufU':
+            return values
+        if values.dtype != object:
+            return None
+    if len(values) == 0:
+        return None
+    if all(isinstance(v, str) for v in values):
+        return np.asarray(values, dtype=str)
+    if all(isinstance(v, (int, float, np.number)) for v in values):
+        array = np.asarray(values)
+        if array.dtype.kind in 'biuf':
+            return array
+    return None
+
+
+def _meshvals_native(arrays):
+
+    # Lexicographic sort with the first array as primary key
+    indices = np.lexsort(arrays[::-1])
+    sorted_arrays = [a[indices] for a in arrays]
+
+    # After sorting, equal coordinates are next to each other
+    n = len(indices)
+    duplicate = np.ones(max(n - 1, 0), dtype=bool)
+    for a in sorted_arrays:
+        duplicate &= a[1:] == a[:-1]
+    if duplicate.any():
+        raise ValueError(
+            f"Improper coordinates. Coordinate values are not unique."
+        )
+
+    # Infer shape from unique values per axis
+    shape = tuple(np.unique(a).size for a in sorted_arrays)
+    _check_grid(shape, n)
+
+    sorted_arrays = [a.reshape(shape) for a in sorted_arrays]
+    return sorted_arrays, indices
+
+
+def _meshvals_object(arrays, native):
+
     # Remember original type/dtype for each array
     orig_types = [a.dtype if isinstance(a[0], np.ndarray) else type(a[0]) for a in arrays]
 
@@ -39,33 +93,42 @@ def meshvals(arrays) -> Tuple[List[np.ndarray], np.ndarray]:
     indices = np.lexsort(coords.T[::-1])
     sorted_coords = coords[indices]
 
-    # Check that all coordinates are unique
+    # Check that all coordinates are unique. After sorting, equal 
+    # coordinates are next to each other.
     points = [tuple(col) for col in sorted_coords]
-    if not all_elements_unique(points):
-        raise ValueError(
-            f"Improper coordinates. Coordinate values are not unique."
-        )
+    for i in range(len(points) - 1):
+        if points[i] == points[i + 1]:
+            raise ValueError(
+                f"Improper coordinates. Coordinate values are not unique."
+            )
     
     # Infer shape from unique values per axis
     shape = tuple(len(np.unique(sorted_coords[:, i])) for i in range(sorted_coords.shape[1]))
+    _check_grid(shape, sorted_coords.shape[0])
     
-    # Check perfect grid
-    if np.prod(shape) != sorted_coords.shape[0]:
-        raise ValueError(
-            f"Coordinates do not form a perfect Cartesian grid: inferred shape {shape} "
-            f"does not match number of points {sorted_coords.shape[0]}"
-        )
-    
-    # Split back into individual arrays and cast to original type
+    # Split back into individual arrays and cast to original type. 
+    # Numbers and strings are returned as in _meshvals_native() so 
+    # the type does not depend on the other coordinates.
     sorted_arrays = []
     for i, orig_type in enumerate(orig_types):
-        arr = sorted_coords[:, i]
-        arr = arr.astype(orig_type).reshape(shape)
-        sorted_arrays.append(arr)
+        if native[i] is not None:
+            arr = native[i][indices]
+        else:
+            arr = sorted_coords[:, i].astype(orig_type)
+        sorted_arrays.append(arr.reshape(shape))
     
     return sorted_arrays, indices
 
 
+def _check_grid(shape, n):
+    # Check perfect grid
+    if np.prod(shape) != n:
+        raise ValueError(
+            f"Coordinates do not form a perfect Cartesian grid: inferred shape {shape} "
+            f"does not match number of points {n}"
+        )
+
+
 def all_elements_unique(items):
     """
     The most general uniqueness check, but also the slowest (O(n^2)).
@@ -80,7 +143,6 @@ def all_elements_unique(items):
     return True
 
 
-
 # def NEWmeshvals(coords):
 #     stack_coords = [np.array(c, dtype=object) for c in coords]
 #     stack_coords = np.stack(stack_coords)
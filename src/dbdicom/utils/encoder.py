@@ -0,0 +1,238 @@
+"""Writing many datasets that differ in a few elements.
+
+When a volume is written to a series, each slice is saved from the
+same dataset, with new values for a few elements such as the UIDs,
+the position and the pixel data. Saving the dataset with pydicom
+encodes every element again for each slice. A TemplateEncoder keeps
+the bytes of each element that has been encoded, and only encodes
+elements again when their value has changed since the last file.
+
+The files are identical to those written by pydicom with
+write_like_original=False.
+
+Writing a volume is about 2x faster for 200 slices of 64x64, and 
+1.4x faster for 200 slices of 256x256, where more of the time goes 
+into setting the pixel data and writing the file. Each slice still 
+checks every element against its cached value, and encodes again 
+the few that change. See dev/benchmark_encoder.py.
+"""
+
+import struct
+from copy import deepcopy
+
+from pydicom.dataset import Dataset
+from pydicom.dataelem import DataElement, RawDataElement
+from pydicom.filebase import DicomBytesIO
+from pydicom.filewriter import (
+    write_data_element, write_file_meta_info, 
+    correct_ambiguous_vr, correct_ambiguous_vr_element,
+)
+from pydicom.charset import default_encoding
+from pydicom.valuerep import DSfloat, DSdecimal, IS, VR
+from pydicom.uid import DeflatedExplicitVRLittleEndian
+
+import dbdicom.dataset as dbdataset
+
+
+class TemplateEncoder():
+    """Encoder that reuses the bytes of unchanged elements
+
+    An encoder is meant to be used for datasets that are all derived
+    from the same template, such as the slices of a volume. It can be
+    used for any dataset, but then few elements are reused.
+
+    Attributes:
+        hits (int): number of elements reused from a previous file.
+        misses (int): number of elements that were encoded.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        # {tag: (element or None, VR, value, undefined length, bytes)}
+        self._elements = {}
+        # (encoding, character set) of the cached elements
+        self._encoding = None
+        # Encoded file meta elements before and after the instance UID
+        self._meta_key = None
+        self._meta = None
+
+    def write(self, ds:Dataset, file:str):
+        """Save a dataset to file
+
+        Args:
+            ds (pydicom.Dataset): dataset to save.
+            file (str): path to the file. The folder must exist.
+        """
+        encoded = self.encode(ds)
+        if encoded is None:
+            dbdataset.write(ds, file)
+            return
+        with open(file, 'wb') as f:
+            f.write(encoded)
+
+    def encode(self, ds:Dataset) -> bytes:
+        """Encode a dataset as a DICOM file
+
+        Args:
+            ds (pydicom.Dataset): dataset to encode.
+
+        Returns:
+            bytes: contents of the file, or None if the transfer syntax
+            is compressed, deflated or not known. These datasets are
+            best saved with pydicom.
+        """
+        file_meta = getattr(ds, 'file_meta', None)
+        tsyntax = None if file_meta is None else file_meta.get('TransferSyntaxUID')
+        if tsyntax is None or tsyntax.is_private or not tsyntax.is_transfer_syntax:
+            return None
+        if tsyntax.is_compressed or tsyntax == DeflatedExplicitVRLittleEndian:
+            return None
+        encoding = (tsyntax.is_implicit_VR, tsyntax.is_little_endian)
+        # As in pydicom, ambiguous VRs are only corrected when the 
+        # encoding or the character set are changed
+        correct = (
+            encoding != ds.original_encoding
+            or ds.original_character_set != ds._character_set
+        )
+        get_item = ds.__getitem__ if correct else ds.get_item
+        charset = ds.get('SpecificCharacterSet', default_encoding)
+        if (encoding, str(charset)) != self._encoding:
+            self._elements = {}
+            self._encoding = (encoding, str(charset))
+        if 'PixelData' in ds:
+            ds['PixelData'].is_undefined_length = False
+
+        preamble = getattr(ds, 'preamble', None)
+        encoded = [preamble if preamble else b"\x00" * 128, b"DICM"]
+        encoded.append(self._file_meta(ds, file_meta))
+        for tag in sorted(ds.keys(), key=int):
+            # Retired group lengths are not written
+            if tag.element == 0 and tag.group > 6:
+                continue
+            elem = get_item(tag)
+            cached = self._elements.get(tag)
+            if cached is not None and _unchanged(elem, cached):
+                self.hits += 1
+                encoded.append(cached[4])
+                continue
+            if correct:
+                elem = _correct_ambiguous_vr(ds, elem, encoding[1])
+            encoded.append(self._element(elem, charset, encoding))
+        return b''.join(encoded)
+
+    def _element(self, elem, charset, encoding):
+        self.misses += 1
+        encoded = _encode(elem, encoding, charset)
+        if isinstance(elem, RawDataElement):
+            # Raw elements are immutable
+            self._elements[elem.tag] = (elem, None, None, None, encoded)
+        else:
+            self._elements[elem.tag] = (
+                None, elem.VR, _snapshot(elem.value),
+                elem.is_undefined_length, encoded,
+            )
+        return encoded
+
+    def _file_meta(self, ds, file_meta):
+        # The file meta information only differs in the instance UID,
+        # so the other elements are encoded once. The group length is
+        # calculated here.
+        uid = ds.get('SOPInstanceUID', None)
+        key = (
+            ds.get('SOPClassUID', None), 
+            [(e.tag, e.VR, e.value) for e in file_meta if e.tag not in (0x00020000, 0x00020003)],
+        )
+        if uid is None or key != self._meta_key:
+            meta = _file_meta(ds, file_meta)
+            fp = DicomBytesIO()
+            fp.is_implicit_VR, fp.is_little_endian = False, True
+            write_file_meta_info(fp, meta, enforce_standard=True)
+            if uid is None:
+                return fp.getvalue()
+            encoded = {}
+            for elem in meta:
+                if elem.tag not in (0x00020000, 0x00020003):
+                    encoded[elem.tag] = _encode(elem, (False, True))
+            self._meta_key = key
+            self._meta = (
+                b''.join(v for t, v in encoded.items() if t < 0x00020003),
+                b''.join(v for t, v in encoded.items() if t > 0x00020003),
+            )
+        before, after = self._meta
+        elem = DataElement(0x00020003, 'UI', uid)
+        instance = _encode(elem, (False, True))
+        length = len(before) + len(instance) + len(after)
+        group_length = struct.pack('<HH2sHI', 2, 0, b'UL', 4, length)
+        return group_length + before + instance + after
+
+
+def _encode(elem, encoding, charset=default_encoding):
+    fp = DicomBytesIO()
+    fp.is_implicit_VR, fp.is_little_endian = encoding
+    write_data_element(fp, elem, charset)
+    return fp.getvalue()
+
+
+def _correct_ambiguous_vr(ds, elem, is_little_endian):
+    # Same as pydicom.filewriter.correct_ambiguous_vr(), for one element
+    if elem.VR == VR.SQ:
+        for item in elem.value:
+            correct_ambiguous_vr(item, is_little_endian, [item, ds])
+        return elem
+    return correct_ambiguous_vr_element(elem, ds, is_little_endian)
+
+
+def _file_meta(ds, file_meta):
+    # Same as pydicom.dcmwrite() with enforce_file_format=True
+    meta = deepcopy(file_meta)
+    sop_class = ds.get('SOPClassUID', None)
+    if meta.get('MediaStorageSOPClassUID') is None or (sop_class and sop_class != meta.MediaStorageSOPClassUID):
+        meta.MediaStorageSOPClassUID = sop_class
+    sop_instance = ds.get('SOPInstanceUID', None)
+    if meta.get('MediaStorageSOPInstanceUID') is None or (sop_instance and sop_instance != meta.MediaStorageSOPInstanceUID):
+        meta.MediaStorageSOPInstanceUID = sop_instance
+    return meta
+
+
+def _unchanged(elem, cached):
+    if isinstance(elem, RawDataElement):
+        return elem is cached[0]
+    if cached[0] is not None:
+        return False
+    if elem.VR != cached[1] or elem.is_undefined_length != cached[3]:
+        return False
+    return _equal(elem.value, cached[2])
+
+
+def _snapshot(value):
+    # Values can be changed in place, so mutable values are copied
+    if value is None or isinstance(value, (bytes, str, int, float)):
+        return value
+    return deepcopy(value)
+
+
+def _equal(a, b):
+    # Values are equal if they are encoded in the same way
+    if a is b:
+        return True
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, (DSfloat, DSdecimal, IS)):
+        return str(a) == str(b)
+    if isinstance(a, list):
+        return len(a) == len(b) and all(_equal(x, y) for x, y in zip(a, b))
+    if isinstance(a, Dataset):
+        if list(a.keys()) != list(b.keys()):
+            return False
+        for tag in a.keys():
+            x, y = a.get_item(tag), b.get_item(tag)
+            if isinstance(x, RawDataElement) or isinstance(y, RawDataElement):
+                if x != y:
+                    return False
+            elif x.VR != y.VR or x.is_undefined_length != y.is_undefined_length:
+                return False
+            elif not _equal(x.value, y.value):
+                return False
+        return True
+    return a == b
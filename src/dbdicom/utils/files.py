@@ -3,14 +3,51 @@ import platform
 import zipfile
 
 
+# Suffix of temporary files written while a file is replaced. These 
+# are not part of the data, and are left out when a folder is scanned.
+TMP_SUFFIX = '.dbdicom-tmp'
+
 
 def all_files(path):
-    files = [item.path for item in scan_tree(path) if item.is_file()]
+    files = [
+        item.path for item in scan_tree(path) 
+        if item.is_file() and not item.name.endswith(TMP_SUFFIX)
+    ]
     # Windows has maximum path length of 260 - ignore any files that are longer
     if platform.system() == 'Windows':
         files = [f for f in files if len(f) <= 260]
     return files
 
+def fingerprints(path, exclude=None):
+    """Return a fingerprint [size, mtime_ns] of all files in a folder.
+
+    The fingerprints are indexed by the path of the file relative to 
+    the folder. Files with a relative path in exclude, or in a 
+    subfolder of the folder that is in exclude, are ignored, and so 
+    are temporary files ending in TMP_SUFFIX.
+    """
+    if exclude is None:
+        exclude = []
+    fps = {}
+    for item in scan_tree(path):
+        if not item.is_file() or item.name.endswith(TMP_SUFFIX):
+            continue
+        # Windows has maximum path length of 260 - ignore any files that are longer
+        if platform.system() == 'Windows':
+            if len(item.path) > 260:
+                continue
+        relpath = os.path.relpath(item.path, path)
+        if relpath in exclude or relpath.split(os.sep)[0] in exclude:
+            continue
+        stat = item.stat()
+        fps[relpath] = [stat.st_size, stat.st_mtime_ns]
+    return fps
+
+def fingerprint(file):
+    """Return the fingerprint [size, mtime_ns] of a file"""
+    stat = os.stat(file)
+    return [stat.st_size, stat.st_mtime_ns]
+
 def export_path(basepath, folder=None):
     if folder is not None:
         # remove illegal characters
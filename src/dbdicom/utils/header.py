@@ -0,0 +1,274 @@
+"""Minimal reader for the header of little-endian DICOM files.
+
+This reads the values of a few top-level data elements by walking
+the raw bytes of the file, without building a pydicom Dataset. It
+only handles the common cases - explicit and implicit VR little
+endian, with plain ASCII values. Anything else raises an
+UnsupportedError, and the caller is expected to fall back on pydicom.
+"""
+
+import re
+import struct
+import datetime
+
+from pydicom.datadict import tag_for_keyword, dictionary_VR
+
+
+IMPLICIT_VR_LITTLE_ENDIAN = '1.2.840.10008.1.2'
+EXPLICIT_VR_LITTLE_ENDIAN = '1.2.840.10008.1.2.1'
+UNSUPPORTED_TRANSFER_SYNTAX = [
+    '1.2.840.10008.1.2.1.99', # Deflated explicit VR little endian
+    '1.2.840.10008.1.2.2', # Explicit VR big endian
+]
+# VRs with a 4-byte length in explicit VR encoding
+LONG_VR = [b'OB', b'OD', b'OF', b'OL', b'OV', b'OW', b'SQ', b'SV', b'UC', b'UN', b'UR', b'UT', b'UV']
+TEXT_VR = ['LO', 'SH', 'PN']
+
+# Attributes that get_values() derives from others when they are missing
+DERIVED = ['SliceLocation']
+
+PIXEL_DATA = 0x7FE00010
+ITEM = 0xFFFEE000
+ITEM_DELIMITATION = 0xFFFEE00D
+SEQUENCE_DELIMITATION = 0xFFFEE0DD
+UNDEFINED_LENGTH = 0xFFFFFFFF
+
+
+class UnsupportedError(Exception):
+    pass
+
+
+def read(file, tags:list):
+    """Read the values of top-level data elements from a DICOM file
+
+    Only the file meta information and the data elements up to the
+    last of the requested tags are read.
+
+    Args:
+        file (str): path to the file.
+        tags (list): keywords of the data elements, or tags as 
+            integers for private creator elements.
+
+    Raises:
+        UnsupportedError: if the file is encoded in a way that is not
+            supported by this reader, or if an attribute in DERIVED
+            is missing, as get_values() derives these from others.
+
+    Returns:
+        list or None: values in the same format as returned by
+        get_values(), with None for missing data elements. If the
+        file is not a DICOM file with a transfer syntax, this returns
+        None.
+    """
+    codes = [_tag(t) for t in tags]
+    wanted = {c: _VR(t) for c, t in zip(codes, tags)}
+    last = max(codes)
+    values = {}
+    with open(file, 'rb') as f:
+        transfer_syntax = _read_file_meta(f)
+        if transfer_syntax is None:
+            return None
+        explicit = transfer_syntax != IMPLICIT_VR_LITTLE_ENDIAN
+        while True:
+            element = _read_element_header(f, explicit)
+            if element is None: # end of file
+                break
+            tag, VR, length = element
+            if tag > last:
+                break
+            if tag in wanted:
+                if VR is not None and VR != wanted[tag]:
+                    raise UnsupportedError(f"Unexpected VR {VR} for tag {tag:08X}")
+                if length == UNDEFINED_LENGTH:
+                    raise UnsupportedError(f"Undefined length for tag {tag:08X}")
+                values[tag] = _value(f.read(length), wanted[tag])
+            else:
+                _skip(f, VR, length, explicit)
+    for c, t in zip(codes, tags):
+        if c not in values and t in DERIVED:
+            raise UnsupportedError(f"{t} is missing and may need to be derived")
+    return [values.get(c) for c in codes]
+
+
+def pixel_offset(file):
+    """Find the pixel data in a DICOM file
+
+    Args:
+        file (str): path to the file.
+
+    Raises:
+        UnsupportedError: if the file is encoded in a way that is not
+            supported by this reader.
+
+    Returns:
+        tuple or None: position of the first byte of the pixel data 
+        in the file, and length of the pixel data in bytes. If the 
+        file has no pixel data, or if they are compressed, this 
+        returns None.
+    """
+    with open(file, 'rb') as f:
+        transfer_syntax = _read_file_meta(f)
+        if transfer_syntax not in [IMPLICIT_VR_LITTLE_ENDIAN, EXPLICIT_VR_LITTLE_ENDIAN]:
+            return None
+        explicit = transfer_syntax != IMPLICIT_VR_LITTLE_ENDIAN
+        while True:
+            element = _read_element_header(f, explicit)
+            if element is None:
+                return None
+            tag, VR, length = element
+            if tag == PIXEL_DATA:
+                if length == UNDEFINED_LENGTH:
+                    return None
+                return f.tell(), length
+            if tag > PIXEL_DATA:
+                return None
+            _skip(f, VR, length, explicit)
+
+
+def _tag(keyword):
+    if isinstance(keyword, int):
+        return keyword
+    tag = tag_for_keyword(keyword)
+    if tag is None:
+        raise ValueError(f"{keyword} is not a DICOM keyword.")
+    return tag
+
+
+def _VR(keyword):
+    if not isinstance(keyword, int):
+        return dictionary_VR(keyword)
+    group, element = keyword >> 16, keyword & 0xFFFF
+    if group % 2 == 1 and 0x0010 <= element <= 0x00FF:
+        # Private creators are always LO
+        return 'LO'
+    raise ValueError(f"{keyword:08X} is not a private creator.")
+
+
+def _read_file_meta(f):
+    # Returns the transfer syntax UID or None if there is none.
+    preamble = f.read(132)
+    if preamble[128:132] != b'DICM':
+        if preamble[:2] == b'\x02\x00':
+            # File meta without preamble - leave this to pydicom
+            raise UnsupportedError("File meta information without preamble")
+        return None
+    transfer_syntax = None
+    while True:
+        pos = f.tell()
+        group = f.read(2)
+        f.seek(pos)
+        if group != b'\x02\x00':
+            break
+        tag, VR, length = _read_element_header(f, True)
+        if tag == 0x00020010:
+            transfer_syntax = _value(f.read(length), 'UI')
+        else:
+            _skip(f, VR, length, True)
+    if transfer_syntax in UNSUPPORTED_TRANSFER_SYNTAX:
+        raise UnsupportedError(f"Transfer syntax {transfer_syntax}")
+    return transfer_syntax
+
+
+def _read_element_header(f, explicit):
+    # Returns (tag, VR, length) or None at the end of the file.
+    head = f.read(8)
+    if len(head) == 0:
+        return None
+    if len(head) < 8:
+        raise UnsupportedError("Truncated data element")
+    group, element = struct.unpack('<HH', head[:4])
+    tag = (group << 16) | element
+    if group == 0xFFFE: # Items and delimiters have no VR
+        return tag, None, struct.unpack('<I', head[4:])[0]
+    if not explicit:
+        return tag, None, struct.unpack('<I', head[4:])[0]
+    VR = head[4:6]
+    if not VR.isalpha() or not VR.isupper():
+        raise UnsupportedError(f"Invalid VR for tag {tag:08X}")
+    if VR in LONG_VR:
+        length = f.read(4)
+        if len(length) < 4:
+            raise UnsupportedError("Truncated data element")
+        length = struct.unpack('<I', length)[0]
+    else:
+        length = struct.unpack('<H', head[6:])[0]
+    return tag, VR.decode(), length
+
+
+def _skip(f, VR, length, explicit):
+    if length != UNDEFINED_LENGTH:
+        f.seek(length, 1)
+    elif explicit and VR != 'SQ':
+        # Undefined length UN elements are encoded in implicit VR
+        raise UnsupportedError(f"Undefined length for VR {VR}")
+    else:
+        _skip_sequence(f, explicit)
+
+
+def _skip_sequence(f, explicit):
+    while True:
+        element = _read_element_header(f, explicit)
+        if element is None:
+            raise UnsupportedError("Unterminated sequence")
+        tag, _, length = element
+        if tag == SEQUENCE_DELIMITATION:
+            return
+        if tag != ITEM:
+            raise UnsupportedError(f"Unexpected tag {tag:08X} in sequence")
+        if length == UNDEFINED_LENGTH:
+            _skip_item(f, explicit)
+        else:
+            f.seek(length, 1)
+
+
+def _skip_item(f, explicit):
+    while True:
+        element = _read_element_header(f, explicit)
+        if element is None:
+            raise UnsupportedError("Unterminated item")
+        tag, VR, length = element
+        if tag == ITEM_DELIMITATION:
+            return
+        _skip(f, VR, length, explicit)
+
+
+def _value(raw, VR):
+    # Decode in the same format as get_values()
+    if VR == 'US':
+        if len(raw) != 2:
+            raise UnsupportedError("Multi-valued or empty US")
+        return struct.unpack('<H', raw)[0]
+    try:
+        text = raw.decode('ascii')
+    except UnicodeDecodeError:
+        raise UnsupportedError("Non-ASCII characters")
+    if '\\' in text:
+        raise UnsupportedError("Multi-valued text")
+    if not text.rstrip('\x00').isprintable():
+        raise UnsupportedError("Control characters in text")
+    if VR == 'UI':
+        value = text.strip('\x00 ')
+        if re.fullmatch(r'[0-9.]*', value) is None:
+            raise UnsupportedError(f"Invalid UID {value}")
+        return value
+    if VR in TEXT_VR:
+        return text.rstrip('\x00 ')
+    if VR == 'IS':
+        value = text.strip('\x00 ')
+        if value == '':
+            return None
+        if re.fullmatch(r'[+-]?[0-9]+', value) is None:
+            raise UnsupportedError(f"Invalid IS {value}")
+        return int(value)
+    if VR == 'DA':
+        value = text.rstrip('\x00 ')
+        if value == '':
+            return value
+        try:
+            datetime.datetime.strptime(value, "%Y%m%d")
+        except ValueError:
+            raise UnsupportedError(f"Invalid DA {value}")
+        if len(value) != 8:
+            raise UnsupportedError(f"Invalid DA {value}")
+        return value
+    raise UnsupportedError(f"VR {VR} is not supported")
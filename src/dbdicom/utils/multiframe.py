@@ -0,0 +1,464 @@
+"""Split enhanced multi-frame DICOM files into single-frame files.
+
+The attributes of each frame are taken from the shared and per-frame
+functional groups, and written as top-level attributes of a
+single-frame file of the matching classic SOP class. This replaces the
+call to dcm4che's emf2sf for the SOP classes listed in SINGLEFRAME,
+and reads each multi-frame file only once.
+
+The frames can also be read without splitting the file. A frame is
+then identified by the path of the file with the frame number added,
+as returned by frame_path(), and dcmread() reads it as a single-frame
+dataset. The register can hold these paths as virtual instances.
+"""
+
+import os
+import copy
+import shutil
+import functools
+
+import numpy as np
+import pydicom
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+from pydicom.datadict import dictionary_VR, tag_for_keyword
+from pydicom.valuerep import DSfloat
+from pydicom.dataelem import RawDataElement
+
+import dbdicom.utils.header as header
+
+import dbdicom.utils.image as image
+from dbdicom.utils.pydicom_dataset import get_values
+
+
+MR_IMAGE = '1.2.840.10008.5.1.4.1.1.4'
+CT_IMAGE = '1.2.840.10008.5.1.4.1.1.2'
+PET_IMAGE = '1.2.840.10008.5.1.4.1.1.128'
+
+# Separates the path of a multi-frame file from the frame number in
+# the path of a virtual instance
+FRAME = '#frame='
+
+# Multi-frame SOP classes that can be split, and the SOP class of
+# the single-frame files.
+SINGLEFRAME = {
+    '1.2.840.10008.5.1.4.1.1.4.1': MR_IMAGE, # Enhanced MR Image
+    '1.2.840.10008.5.1.4.1.1.4.4': MR_IMAGE, # Legacy Converted Enhanced MR Image
+    '1.2.840.10008.5.1.4.1.1.2.1': CT_IMAGE, # Enhanced CT Image
+    '1.2.840.10008.5.1.4.1.1.2.2': CT_IMAGE, # Legacy Converted Enhanced CT Image
+    '1.2.840.10008.5.1.4.1.1.130': PET_IMAGE, # Enhanced PET Image
+    '1.2.840.10008.5.1.4.1.1.128.1': PET_IMAGE, # Legacy Converted Enhanced PET Image
+    '1.2.840.10008.5.1.4.1.1.30': None, # Parametric Map - depends on Modality
+}
+
+# Attributes that only apply to the multi-frame file
+MULTIFRAME_ONLY = [
+    'NumberOfFrames', 'SharedFunctionalGroupsSequence',
+    'PerFrameFunctionalGroupsSequence', 'DimensionOrganizationSequence',
+    'DimensionIndexSequence', 'DimensionOrganizationType',
+    'FrameIncrementPointer', 'ConcatenationUID',
+    'ConcatenationFrameOffsetNumber', 'InConcatenationNumber',
+    'InConcatenationTotalNumber', 'RepresentativeFrameNumber',
+    'PixelData', 'FloatPixelData', 'DoubleFloatPixelData',
+]
+
+# Attributes of functional groups that identify the multi-frame file
+# rather than the frame.
+SKIP = [
+    tag_for_keyword(k) for k in
+    ['SOPClassUID', 'SOPInstanceUID', 'InstanceNumber']
+]
+
+
+class UnsupportedError(Exception):
+    pass
+
+
+def split_multiframe(filepath, tags=None):
+    """Splits a multi-frame instance into single frames
+
+    The single-frame files are written in a new folder next to the
+    file, in the same way as dcm4che.split_multiframe(). The
+    multi-frame file itself is not removed.
+
+    Args:
+        filepath (str): path to the multi-frame file.
+        tags (list, optional): if provided, the values of these
+            attributes in the single-frame files are also returned.
+            Defaults to None.
+
+    Raises:
+        UnsupportedError: if the SOP class or pixel data of the file
+            can't be split.
+
+    Returns:
+        list or tuple: the paths to the single-frame files. If tags
+        are provided, this returns a tuple with the paths and a list
+        with the values of the tags for each file, as returned by
+        get_values().
+    """
+    ds = pydicom.dcmread(filepath)
+    sop_class = _singleframe_class(ds)
+    frames = _frames(ds)
+    file_meta = ds.file_meta
+    template, per_frame, first = _template(ds)
+
+    outputDir = os.path.join(
+        os.path.dirname(filepath), os.path.basename(filepath) + '_sf'
+    )
+    if os.path.isdir(outputDir):
+        shutil.rmtree(outputDir)
+    os.mkdir(outputDir)
+
+    files, values = [], []
+    for i, (pixels, rescale) in enumerate(frames):
+        frame = _frame(template, file_meta, per_frame, i, sop_class, pixels, rescale, first)
+        file = os.path.join(outputDir, f"single_frame_{i+1:06d}.dcm")
+        frame.save_as(file, enforce_file_format=True)
+        files.append(file)
+        if tags is not None:
+            values.append(get_values(frame, tags))
+    if tags is None:
+        return files
+    return files, values
+
+
+def frame_values(filepath, tags):
+    """Values of attributes in each frame of a multi-frame file
+
+    Args:
+        filepath (str): path to the multi-frame file.
+        tags (list): keywords of the attributes.
+
+    Raises:
+        UnsupportedError: if the SOP class or pixel data of the file
+            can't be split.
+
+    Returns:
+        list: the values of the tags in the single-frame dataset of
+        each frame, as returned by get_values().
+    """
+    nframes = _parse(filepath, os.stat(filepath).st_mtime_ns)[4]
+    return [
+        get_values(read_frame(filepath, n, stop_before_pixels=True), tags)
+        for n in range(1, nframes+1)
+    ]
+
+
+def frame_path(filepath, frame):
+    """Path of a virtual instance
+
+    Args:
+        filepath (str): path to a multi-frame file.
+        frame (int): frame number, starting at 1.
+
+    Returns:
+        str: path that identifies the frame.
+    """
+    return f"{filepath}{FRAME}{frame}"
+
+
+def split_path(file):
+    """Split the path of a virtual instance
+
+    Args:
+        file (str): path to a file or a virtual instance.
+
+    Returns:
+        tuple: path to the file and frame number. For a file that is
+        not a virtual instance the frame number is None.
+    """
+    filepath, sep, frame = file.rpartition(FRAME)
+    if sep == '' or not frame.isdigit():
+        return file, None
+    return filepath, int(frame)
+
+
+def source(file):
+    """Path to the file that holds an instance
+
+    Args:
+        file (str): path to a file or a virtual instance.
+
+    Returns:
+        str: path to the file on disk.
+    """
+    return split_path(file)[0]
+
+
+def read_frame(filepath, frame, stop_before_pixels=False):
+    """Read a frame of a multi-frame file as a single-frame dataset
+
+    The header of the file is kept in memory, so that reading the
+    other frames of the same file does not parse the header again.
+
+    Args:
+        filepath (str): path to the multi-frame file.
+        frame (int): frame number, starting at 1.
+        stop_before_pixels (bool, optional): if True, the pixel data
+            are not read. Defaults to False.
+
+    Raises:
+        UnsupportedError: if the SOP class or pixel data of the file
+            can't be split.
+        IndexError: if the file has no frame with this number.
+
+    Returns:
+        pydicom.Dataset: the frame, with the same attributes as the
+        file written by split_multiframe().
+    """
+    mtime = os.stat(filepath).st_mtime_ns
+    template, file_meta, per_frame, sop_class, nframes, raw, first = _parse(filepath, mtime)
+    if not 1 <= frame <= nframes:
+        raise IndexError(f"{filepath} has no frame {frame}.")
+    i = frame - 1
+    if raw is None:
+        # Compressed or floating point - decode all frames once
+        pixels, rescale = _decoded(filepath, mtime)[i]
+    elif stop_before_pixels:
+        pixels, rescale = None, None
+    else:
+        offset, size = raw
+        with open(filepath, 'rb') as f:
+            f.seek(offset + i*size)
+            pixels, rescale = f.read(size), None
+    frame = _frame(template, file_meta, per_frame, i, sop_class, pixels, rescale, first)
+    if stop_before_pixels and 'PixelData' in frame:
+        del frame.PixelData
+    return frame
+
+
+def dcmread(file, stop_before_pixels=False, **kwargs):
+    """Read a file or a virtual instance
+
+    Args:
+        file (str): path to a file or a virtual instance.
+        stop_before_pixels (bool, optional): if True, the pixel data
+            are not read. Defaults to False.
+        kwargs: other arguments of pydicom.dcmread(), which are
+            ignored for virtual instances.
+
+    Returns:
+        pydicom.Dataset: the dataset.
+    """
+    filepath, frame = split_path(file)
+    if frame is None:
+        return pydicom.dcmread(file, stop_before_pixels=stop_before_pixels, **kwargs)
+    return read_frame(filepath, frame, stop_before_pixels)
+
+
+def pixel_offset(file):
+    """Find the pixel data of a file or a virtual instance
+
+    Args:
+        file (str): path to a file or a virtual instance.
+
+    Returns:
+        tuple or None: position of the first byte of the pixel data
+        in the file returned by source(), and length of the pixel
+        data in bytes, as returned by header.pixel_offset(). If the
+        pixel data can't be read straight from the file, this
+        returns None.
+    """
+    filepath, frame = split_path(file)
+    if frame is None:
+        try:
+            return header.pixel_offset(file)
+        except header.UnsupportedError:
+            return None
+    raw = _parse(filepath, os.stat(filepath).st_mtime_ns)[5]
+    if raw is None:
+        return None
+    offset, size = raw
+    return offset + (frame-1)*size, size
+
+
+@functools.lru_cache(maxsize=8)
+def _parse(filepath, mtime):
+    # Header of a multi-frame file, as needed to build its frames. The
+    # modification time is part of the key so that changed files are
+    # parsed again.
+    ds = pydicom.dcmread(filepath, stop_before_pixels=True)
+    sop_class = _singleframe_class(ds)
+    if ds.get('SamplesPerPixel', 1) != 1:
+        raise UnsupportedError("Only single-sample images can be split.")
+    nframes = int(ds.get('NumberOfFrames', 1))
+    raw = None
+    if not ds.file_meta.TransferSyntaxUID.is_compressed and ds.BitsAllocated in [8, 16, 32]:
+        try:
+            offset = header.pixel_offset(filepath)
+        except header.UnsupportedError:
+            offset = None
+        size = ds.Rows * ds.Columns * ds.BitsAllocated // 8
+        if offset is not None and offset[1] >= nframes * size:
+            raw = (offset[0], size)
+    file_meta = ds.file_meta
+    template, per_frame, first = _template(ds)
+    return template, file_meta, per_frame, sop_class, nframes, raw, first
+
+
+@functools.lru_cache(maxsize=2)
+def _decoded(filepath, mtime):
+    return _frames(pydicom.dcmread(filepath))
+
+
+def _template(ds):
+    # Attributes shared by all frames, the per-frame functional groups
+    # and the number of frames before the first in a concatenation. 
+    # This modifies ds, which becomes the template.
+    shared = ds.get('SharedFunctionalGroupsSequence', [None])[0]
+    per_frame = ds.get('PerFrameFunctionalGroupsSequence', [])
+    first = int(ds.get('ConcatenationFrameOffsetNumber', 0) or 0)
+    for keyword in MULTIFRAME_ONLY:
+        if keyword in ds:
+            delattr(ds, keyword)
+    if shared is not None:
+        _flatten(ds, [shared], copy.deepcopy)
+    return ds, per_frame, first
+
+
+def _frame(template, file_meta, per_frame, i, sop_class, pixels, rescale, first=0):
+    # Single-frame dataset of frame i. Top-level elements are new 
+    # objects, so setting values does not change the template.
+    frame = pydicom.Dataset({
+        tag: elem if isinstance(elem, RawDataElement) else copy.copy(elem)
+        for tag, elem in template.items()
+    })
+    frame.file_meta = copy.deepcopy(file_meta)
+    if i < len(per_frame):
+        _flatten(frame, [per_frame[i]])
+    _set_frame(frame, i, sop_class, pixels, rescale, first)
+    return frame
+
+
+def _singleframe_class(ds):
+    sop_class = ds.get('SOPClassUID')
+    if sop_class not in SINGLEFRAME:
+        raise UnsupportedError(f"Splitting {sop_class} is not supported.")
+    if SINGLEFRAME[sop_class] is not None:
+        return SINGLEFRAME[sop_class]
+    # Parametric maps are saved in the class of the source images
+    modality = ds.get('Modality')
+    if modality == 'CT':
+        return CT_IMAGE
+    if modality == 'PT':
+        return PET_IMAGE
+    return MR_IMAGE
+
+
+def _frames(ds):
+    # Returns a list of (pixel bytes, rescale) for each frame, with
+    # rescale None if the stored values are kept.
+    nframes = int(ds.get('NumberOfFrames', 1))
+    if ds.get('SamplesPerPixel', 1) != 1:
+        raise UnsupportedError("Only single-sample images can be split.")
+    if 'FloatPixelData' in ds or 'DoubleFloatPixelData' in ds:
+        # Classic images have integer pixels - rescale to 16 bit
+        array = ds.pixel_array.reshape((nframes, ds.Rows, ds.Columns))
+        frames = []
+        for frame in array:
+            frame = image.clip(frame.astype(np.float32))
+            frame, slope, intercept = image.scale_to_range(frame, 16)
+            frames.append((frame.tobytes(), (1/slope, -intercept/slope)))
+        return frames
+    if 'PixelData' not in ds:
+        raise UnsupportedError("The file has no pixel data.")
+    tsyntax = ds.file_meta.TransferSyntaxUID
+    if not tsyntax.is_compressed and tsyntax.is_little_endian and ds.BitsAllocated in [8, 16, 32]:
+        # Copy the bytes of each frame without decoding. The frames 
+        # are saved in little endian, so big endian data are decoded.
+        size = ds.Rows * ds.Columns * ds.BitsAllocated // 8
+        data = ds.PixelData
+        if len(data) < nframes * size:
+            raise UnsupportedError("The pixel data are incomplete.")
+        return [(data[i*size:(i+1)*size], None) for i in range(nframes)]
+    array = ds.pixel_array.reshape((nframes, ds.Rows, ds.Columns))
+    if array.dtype.itemsize * 8 != ds.BitsAllocated:
+        raise UnsupportedError(f"{ds.BitsAllocated}-bit pixel data are not supported.")
+    return [(frame.astype(frame.dtype.newbyteorder('<')).tobytes(), None) for frame in array]
+
+
+def _flatten(ds, groups, copy_value=lambda v: v):
+    # Copy the contents of the functional group macros to the top level.
+    # Macros in private sequences are copied first so that the standard
+    # macros take precedence.
+    for private in [True, False]:
+        for group in groups:
+            for macro in group:
+                if macro.VR != 'SQ' or macro.tag.is_private != private:
+                    continue
+                if macro.keyword == 'ReferencedImageSequence':
+                    ds.add_new(macro.tag, macro.VR, copy_value(macro.value))
+                    continue
+                if len(macro.value) == 0:
+                    continue
+                item = macro.value[0]
+                for elem in item:
+                    _copy(ds, item, elem, copy_value)
+
+
+def _copy(ds, item, elem, copy_value):
+    if elem.tag in SKIP or elem.tag.is_private_creator:
+        return
+    if not elem.tag.is_private:
+        ds.add_new(elem.tag, elem.VR, copy_value(elem.value))
+        return
+    # Private elements go in the block of the same creator
+    creator = item.get((elem.tag.group, elem.tag.element >> 8))
+    if creator is None:
+        return
+    block = ds.private_block(elem.tag.group, creator.value, create=True)
+    block.add_new(elem.tag.element & 0xFF, elem.VR, copy_value(elem.value))
+
+
+def _set_frame(ds, i, sop_class, pixels, rescale, first=0):
+    values = {}
+
+    # Attributes with a different name in the functional groups
+    renamed = {
+        'ImageType': 'FrameType',
+        'EchoTime': 'EffectiveEchoTime',
+        'TriggerTime': 'NominalCardiacTriggerDelayTime',
+        'TemporalPositionIdentifier': 'TemporalPositionIndex',
+    }
+    for keyword, fg_keyword in renamed.items():
+        if fg_keyword in ds:
+            values[keyword] = ds[fg_keyword].value
+    if 'InversionTimes' in ds and ds.InversionTimes:
+        values['InversionTime'] = ds.InversionTimes[0]
+    if 'FrameAcquisitionDateTime' in ds:
+        dt = str(ds.FrameAcquisitionDateTime)
+        values['AcquisitionDateTime'] = dt
+        values['AcquisitionDate'] = dt[:8]
+        values['AcquisitionTime'] = dt[8:]
+    if 'ImagePositionPatient' in ds and 'ImageOrientationPatient' in ds:
+        orientation = np.array(ds.ImageOrientationPatient, dtype=float)
+        normal = np.cross(orientation[:3], orientation[3:])
+        loc = np.dot(np.array(ds.ImagePositionPatient, dtype=float), normal)
+        values['SliceLocation'] = DSfloat(loc, auto_format=True)
+
+    # Identity of the new instance
+    values['SOPClassUID'] = sop_class
+    # Derived from the multi-frame instance, so that reading a frame 
+    # again gives the same UID
+    values['SOPInstanceUID'] = generate_uid(entropy_srcs=[str(ds.SOPInstanceUID), str(i+1)])
+    # Frames of a concatenation are numbered across the files
+    values['InstanceNumber'] = first + i + 1
+    ds.file_meta.MediaStorageSOPClassUID = sop_class
+    ds.file_meta.MediaStorageSOPInstanceUID = values['SOPInstanceUID']
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+    # Pixel data
+    if rescale is not None:
+        values['BitsAllocated'] = 16
+        values['BitsStored'] = 16
+        values['HighBit'] = 15
+        values['PixelRepresentation'] = 0
+        values['RescaleSlope'] = DSfloat(rescale[0], auto_format=True)
+        values['RescaleIntercept'] = DSfloat(rescale[1], auto_format=True)
+    for keyword, value in values.items():
+        ds.add_new(keyword, dictionary_VR(keyword), value)
+    if pixels is None:
+        return
+    if len(pixels) % 2 == 1:
+        pixels += b'\x00'
+    ds.add_new('PixelData', 'OB' if ds.BitsAllocated == 8 else 'OW', pixels)
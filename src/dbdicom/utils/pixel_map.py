@@ -0,0 +1,188 @@
+"""Pixel data read on demand.
+
+A PixelMap behaves like a read-only numpy array of pixel values, but
+does not hold the values in memory. Each 2D slice is a memory-mapped
+view on the pixel data in a DICOM file, and only the part of a slice
+that is indexed is read from disk and rescaled.
+
+PixelFiles does the same for any DICOM files, including compressed
+ones, by decoding the slices that are indexed. A LazyVolume adds the
+geometry of a vreg volume to PixelFiles.
+"""
+
+from abc import ABC, abstractmethod
+
+import numpy as np
+import vreg
+
+import dbdicom.dataset as dbdataset
+import dbdicom.utils.multiframe as multiframe
+
+
+class Slices(ABC):
+    """Read-only array of 2D slices
+
+    The first two dimensions are the columns and rows of the slices, 
+    the other dimensions index the slices. Indexing supports integers, 
+    slices and Ellipsis, and returns a numpy array. Subclasses set 
+    shape and dtype, and read the slices in _plane().
+    """
+
+    shape = ()
+    dtype = None
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        array = self[...]
+        return array if dtype is None else array.astype(dtype)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            i = [k is Ellipsis for k in key].index(True)
+            fill = (slice(None),) * (self.ndim - len(key) + 1)
+            key = key[:i] + fill + key[i+1:]
+        for k in key:
+            if not isinstance(k, (int, np.integer, slice)):
+                raise TypeError(
+                    f"Cannot index a {type(self).__name__} with {k}. Only "
+                    f"integers, slices and Ellipsis are supported."
+                )
+        if len(key) > self.ndim:
+            raise IndexError(
+                f"Too many indices for an array with {self.ndim} dimensions."
+            )
+        key = key + (slice(None),) * (self.ndim - len(key))
+        in_plane, slices = key[:2], np.asarray(self.grid[key[2:]])
+        plane_shape = np.broadcast_to(False, self.shape[:2])[in_plane].shape
+        array = np.empty(plane_shape + slices.shape, dtype=self.dtype)
+        for i, s in enumerate(slices.flat):
+            position = np.unravel_index(i, slices.shape) if slices.ndim > 0 else ()
+            array[(Ellipsis,) + tuple(position)] = self._plane(s, in_plane)
+        return array[()] if array.ndim == 0 else array
+
+    @abstractmethod
+    def _plane(self, s, key):
+        # Values of slice s at the in-plane indices key
+        pass
+
+
+class PixelMap(Slices):
+    """Array of pixel values in uncompressed DICOM files
+
+    Args:
+        slices (list): one tuple (file, offset, stored_dtype, rows, 
+            columns, slope, intercept, dtype) per slice, where offset 
+            is the position of the pixel data in the file, and the 
+            values are (stored*slope + intercept) cast to dtype.
+        grid (numpy.ndarray): integer array with the index in slices 
+            of the slice at each position.
+        dtype (numpy.dtype): data type of the array.
+    """
+
+    def __init__(self, slices, grid, dtype):
+        self.slices = slices
+        self.grid = grid
+        self.dtype = np.dtype(dtype)
+        _, _, _, rows, columns, _, _, _ = slices[0]
+        self.shape = (columns, rows) + grid.shape
+
+    def _plane(self, s, key):
+        file, offset, stored_dtype, rows, columns, slope, intercept, dtype = self.slices[s]
+        mm = np.memmap(file, dtype=stored_dtype, mode='r', offset=offset, shape=(rows, columns))
+        values = mm.T[key].astype(np.float32)
+        values *= slope
+        values += intercept
+        return values.astype(dtype)
+
+
+class PixelFiles(Slices):
+    """Array of pixel values decoded from DICOM files
+
+    Args:
+        files (numpy.ndarray): array of paths to single-frame DICOM 
+            files or virtual instances, with the file of the slice at 
+            each position.
+        shape (tuple): columns and rows of the slices.
+        dtype (numpy.dtype, optional): data type of the array. If this 
+            is None, the data type is taken from the first slice when 
+            it is needed. Defaults to None.
+    """
+
+    def __init__(self, files, shape, dtype=None):
+        self.files = np.asarray(files)
+        self.grid = np.arange(self.files.size).reshape(self.files.shape)
+        self.shape = tuple(shape) + self.files.shape
+        self._dtype = None if dtype is None else np.dtype(dtype)
+
+    @property
+    def dtype(self):
+        if self._dtype is None:
+            self._dtype = self._plane(0, ()).dtype
+        return self._dtype
+
+    def _plane(self, s, key):
+        ds = multiframe.dcmread(self.files.flat[s])
+        return dbdataset.pixel_data(ds)[key]
+
+
+class LazyVolume():
+    """Volume with pixel values that are read when they are indexed
+
+    This has the shape, affine, dims and coords of a vreg volume, but 
+    the values are only read from disk when the object is indexed. 
+    Indexing returns a numpy array.
+
+    Args:
+        values (Slices): array-like with the pixel values.
+        affine (numpy.ndarray): 4x4 affine of the volume.
+        dims (list, optional): non-spatial dimensions. Defaults to None.
+        coords (list, optional): coordinates of the non-spatial 
+            dimensions. Defaults to None.
+    """
+
+    def __init__(self, values, affine, dims=None, coords=None):
+        self.values = values
+        self.affine = affine
+        self.dims = dims
+        self.coords = coords
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def ndim(self):
+        return self.values.ndim
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    def __len__(self):
+        return len(self.values)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.values.__array__(dtype)
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def volume(self) -> vreg.Volume3D:
+        """Read all pixel values.
+
+        Returns:
+            vreg.Volume3D: the volume in memory.
+        """
+        vol = vreg.volume(self.values[...], self.affine.copy())
+        if vol.ndim > 3:
+            vol.set_coords(self.coords)
+            vol.set_dims(self.dims)
+        return vol
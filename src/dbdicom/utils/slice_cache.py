@@ -0,0 +1,151 @@
+"""In-memory cache of decoded DICOM files.
+
+A SliceCache holds the parsed headers and decoded pixel arrays of the
+files in a DICOM folder, so that reading the same series again does
+not need to read and decode the files again. Entries are identified by
+the path of the file relative to the folder, and are only used while
+the modification time of the file is unchanged. When the cache holds
+more than its budget, the least recently used files are dropped.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import dbdicom.dataset as dbdataset
+import dbdicom.utils.multiframe as multiframe
+
+
+class SliceCache():
+    """Least recently used cache of headers and pixel arrays
+
+    Args:
+        path (str): path to the DICOM folder.
+        max_bytes (int): memory budget in bytes. The size of an entry
+            is the size of the pixel array plus the size of the
+            header in the file. Headers of the frames of a multiframe
+            file are counted as the size of the frame.
+
+    Attributes:
+        hits (int): number of reads served from the cache.
+        misses (int): number of reads that needed the file.
+        nbytes (int): current size of the cache in bytes.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        # {relpath: [mtime_ns, header, pixel array or None, nbytes]}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, file):
+        return self._relpath(file) in self._entries
+
+    def header(self, file):
+        """Header of a file, without the pixel data
+
+        Args:
+            file (str): path to the file.
+
+        Returns:
+            pydicom.Dataset: header of the file. This is shared with
+            other callers and should not be modified.
+        """
+        key, mtime = self._relpath(file), self._mtime(file)
+        entry = self._get(key, mtime)
+        if entry is not None:
+            return entry[1]
+        ds = multiframe.dcmread(file, stop_before_pixels=True)
+        self._put(key, [mtime, ds, None, self._size(file, ds)])
+        return ds
+
+    def read(self, file):
+        """Header and pixel data of a file
+
+        Args:
+            file (str): path to the file.
+
+        Returns:
+            tuple: the header, as returned by header(), and the pixel
+            array, as returned by dbdicom.dataset.pixel_data(). These
+            are shared with other callers and should not be modified.
+        """
+        key, mtime = self._relpath(file), self._mtime(file)
+        entry = self._get(key, mtime, pixels=True)
+        if entry is not None:
+            return entry[1], entry[2]
+        ds = multiframe.dcmread(file)
+        array = dbdataset.pixel_data(ds)
+        array.flags.writeable = False
+        header_bytes = self._size(file, ds)
+        if 'PixelData' in ds:
+            header_bytes -= len(ds.PixelData)
+            del ds.PixelData
+        self._put(key, [mtime, ds, array, header_bytes + array.nbytes])
+        return ds, array
+
+    def invalidate(self, file):
+        """Drop a file from the cache
+
+        Args:
+            file (str): path to the file.
+        """
+        with self._lock:
+            entry = self._entries.pop(self._relpath(file), None)
+            if entry is not None:
+                self.nbytes -= entry[3]
+
+    def clear(self):
+        """Drop all files from the cache and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def _relpath(self, file):
+        return os.path.relpath(file, self.path)
+
+    def _mtime(self, file):
+        # Frames of a multiframe file change with the file
+        return os.stat(multiframe.source(file)).st_mtime_ns
+
+    def _size(self, file, ds):
+        if multiframe.split_path(file)[1] is None:
+            return os.path.getsize(file)
+        return ds.Rows * ds.Columns * ds.get('BitsAllocated', 8) // 8
+
+    def _get(self, key, mtime, pixels=False):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] != mtime:
+                # The file has changed on disk
+                del self._entries[key]
+                self.nbytes -= entry[3]
+                entry = None
+            if entry is None or (pixels and entry[2] is None):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def _put(self, key, entry):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[3]
+            if entry[3] > self.max_bytes:
+                return
+            self._entries[key] = entry
+            self.nbytes += entry[3]
+            while self.nbytes > self.max_bytes:
+                _, dropped = self._entries.popitem(last=False)
+                self.nbytes -= dropped[3]
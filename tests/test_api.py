@@ -1,7 +1,11 @@
 import os
 import shutil
 import numpy as np
+import pydicom
 import dbdicom as db
+import dbdicom.dataset
+import dbdicom.utils.multiframe
+import dbdicom.utils.files
 import vreg
 
 
@@ -199,6 +203,60 @@ def test_edit():
     shutil.rmtree(tmp)
 
 
+def test_edit_inplace():
+
+    for backend in ['json', 'sqlite']:
+        values = 100*np.random.rand(16, 16, 3, 2).astype(np.float32)
+        dims = ['FlipAngle']
+        vol = vreg.volume(values, dims=dims, coords=([10, 20],))
+        db.open(tmp, backend=backend).close()
+        series = [tmp, '007', 'dbdicom_test', 'vfa']
+        db.write_volume(vol, series)
+        files = sorted(db.files(series))
+        uids = db.values(series, 'SOPInstanceUID')
+
+        # Array values are written in the order of the dimensions
+        dims = ('SliceLocation', 'FlipAngle')
+        new_tr = np.arange(6).reshape((3,2))
+        db.edit(series, {'RepetitionTime': new_tr}, dims=dims, inplace=True)
+        tr = db.values(series, 'RepetitionTime', dims=dims)
+        assert np.array_equal(tr, new_tr)
+        assert sorted(db.files(series)) == files
+        assert np.array_equal(db.values(series, 'SOPInstanceUID'), uids)
+
+        # Register attributes are updated
+        db.edit(series, {'SeriesDescription': 'vfa_edited'}, inplace=True)
+        assert db.series([tmp, '007']) == [[tmp, '007', ('dbdicom_test', 0), ('vfa_edited', 0)]]
+        series = [tmp, '007', 'dbdicom_test', 'vfa_edited']
+        assert sorted(db.files(series)) == files
+        assert np.allclose(db.volume(series, dims='FlipAngle').values, vol.values, atol=1e-2)
+
+        # No temporary files are left, also when writing fails
+        suffix = dbdicom.utils.files.TMP_SUFFIX
+        write = dbdicom.dataset.write
+        def fail(ds, file):
+            write(ds, file)
+            raise OSError('Disk full')
+        dbdicom.dataset.write = fail
+        try:
+            db.edit(series, {'RepetitionTime': 5}, inplace=True)
+        except OSError:
+            assert True
+        else:
+            assert False
+        finally:
+            dbdicom.dataset.write = write
+        assert not any(f.endswith(suffix) for _, _, fs in os.walk(tmp) for f in fs)
+
+        # Temporary files left after a crash are not read
+        shutil.copy(files[0], files[0] + suffix)
+        db.flush(tmp)
+        assert sorted(db.open(tmp).read().files(series)) == files
+        os.remove(files[0] + suffix)
+
+        shutil.rmtree(tmp)
+
+
 def test_write_database():
     values = 100*np.random.rand(16, 16, 4).astype(np.float32)
     vol = vreg.volume(values)
@@ -291,14 +349,669 @@ def test_copy():
     shutil.rmtree(tmp)
 
 
+def test_open_workers():
+
+    values = 100*np.random.rand(16, 16, 4).astype(np.float32)
+    vol = vreg.volume(values)
+    db.write_volume(vol, [tmp, '007', 'test', 'ax'])
+    db.write_volume(vol, [tmp, '007', 'test', 'ax2'])
+    db.write_volume(vol, [tmp, '008', 'test', 'ax'])
+    db.flush()
+
+    # Scan the folder serially and in parallel
+    os.remove(os.path.join(tmp, 'dbtree.json'))
+    serial = db.open(tmp).close().register
+    os.remove(os.path.join(tmp, 'dbtree.json'))
+    parallel = db.open(tmp, workers=2).close().register
+    assert serial == parallel
+
+    shutil.rmtree(tmp)
+
+
+def test_refresh():
+
+    tmp1 = os.path.join(tmp, 'dir1')
+    tmp2 = os.path.join(tmp, 'dir2')
+    values = 100*np.random.rand(16, 16, 4).astype(np.float32)
+    vol = vreg.volume(values)
+    db.write_volume(vol, [tmp1, '007', 'test', 'ax'])
+    db.write_volume(vol, [tmp2, '008', 'test', 'ax'])
+
+    # Add files of a new patient and remove one file of an existing series
+    shutil.copytree(os.path.join(tmp2, 'Patient__008'), os.path.join(tmp1, 'Patient__008'))
+    os.remove(db.files([tmp1, '007', 'test', 'ax'])[0])
+
+    db.refresh(tmp1)
+    assert 2 == len(db.patients(tmp1))
+    assert 3 == len(db.files([tmp1, '007', 'test', 'ax']))
+    assert 4 == len(db.files([tmp1, '008', 'test', 'ax']))
+
+    # The register is identical to a full scan
+    refreshed = db.summary(tmp1)
+    os.remove(os.path.join(tmp1, 'dbtree.json'))
+    assert refreshed == db.summary(tmp1)
+
+    shutil.rmtree(tmp)
+
+def test_sqlite_backend():
+
+    values = 100*np.random.rand(16, 16, 4).astype(np.float32)
+    vol = vreg.volume(values)
+    db.write_volume(vol, [tmp, '007', 'test', 'ax'])
+    db.write_volume(vol, [tmp, '007', 'test', 'cor'])
+    tree = db.tree(tmp)
+
+    # Converting from dbtree.json
+    db.open(tmp, backend='sqlite').close()
+    assert not os.path.exists(os.path.join(tmp, 'dbtree.json'))
+    assert os.path.exists(os.path.join(tmp, 'dbtree.sqlite'))
+    assert tree == db.tree(tmp)
+
+    # The existing backend is used by default
+    db.write_volume(vol, [tmp, '008', 'test', 'ax'])
+    db.delete([tmp, '007', 'test', 'cor'])
+    assert 2 == len(db.patients(tmp))
+    assert [[tmp, '007', 'test', ('ax', 0)]] == db.series([tmp, '007', 'test'])
+    vol2 = db.volume([tmp, '008', 'test', 'ax'])
+    assert np.linalg.norm(vol2.values-values) < 0.0001*np.linalg.norm(values)
+    os.remove(db.files([tmp, '008', 'test', 'ax'])[0])
+    db.refresh(tmp)
+    assert 3 == len(db.files([tmp, '008', 'test', 'ax']))
+    summary = db.summary(tmp)
+
+    # A refresh only writes the fingerprints of changed files
+    db.flush(tmp)
+    dbd = db.open(tmp)
+    con = dbd.register.con
+    changes = con.total_changes
+    dbd.refresh()
+    assert con.total_changes == changes
+    file = dbd.files([tmp, '008', 'test', 'ax'])[0]
+    os.utime(file, ns=(0, 0))
+    dbd.refresh()
+    fingerprints = dict(dbd.fingerprints.items())
+    assert fingerprints[os.path.relpath(file, tmp)] == [os.path.getsize(file), 0]
+    assert len(fingerprints) == 7
+    dbd.close()
+
+    # Converting back to dbtree.json
+    db.open(tmp, backend='json').close()
+    assert not os.path.exists(os.path.join(tmp, 'dbtree.sqlite'))
+    assert summary == db.summary(tmp)
+    os.remove(os.path.join(tmp, 'dbtree.json'))
+    assert summary == db.summary(tmp)
+
+    shutil.rmtree(tmp)
+
+def test_session():
+
+    values = 100*np.random.rand(16, 16, 4).astype(np.float32)
+    vol = vreg.volume(values)
+    study = [tmp, '007', 'test']
+    db.write_volume(vol, study + ['ax'])
+    file = os.path.join(tmp, 'dbtree.json')
+
+    # Reading does not save the register
+    mtime = os.stat(file).st_mtime_ns
+    db.series(study)
+    db.volume(study + ['ax'])
+    assert mtime == os.stat(file).st_mtime_ns
+
+    # Changes are saved on flush
+    db.write_volume(vol, study + ['cor'])
+    assert mtime == os.stat(file).st_mtime_ns
+    db.flush()
+    assert 2 == len(db.open(tmp).series(study))
+
+    # Changes on disk are picked up, and merged with unsaved changes
+    db.write_volume(vol, study + ['sag'])
+    dbd = db.DataBaseDicom(tmp)
+    dbd.delete(study + ['cor'])
+    dbd.close()
+    assert ['ax', 'sag'] == [s[-1][0] for s in db.series(study)]
+    db.flush()
+    assert ['ax', 'sag'] == [s[-1][0] for s in db.open(tmp).series(study)]
+
+    # A database created directly sees changes after a flush
+    db.write_volume(vol, [tmp, '008', 'test', 'ax'])
+    assert [] == db.DataBaseDicom(tmp).series([tmp, '008'])
+    db.flush(tmp)
+    assert 1 == len(db.DataBaseDicom(tmp).series([tmp, '008']))
+
+    # A reference series in another folder can be used before a flush
+    tmp2 = os.path.join(os.getcwd(), 'tests', 'tmp2')
+    db.write_volume(vol, [tmp, '009', 'test', 'ref'])
+    db.write_volume(vol, [tmp2, '009', 'test', 'out'], ref=[tmp, '009', 'test', 'ref'])
+    assert 1 == len(db.series([tmp2, '009', 'test']))
+
+    shutil.rmtree(tmp)
+    shutil.rmtree(tmp2)
+
+def test_read_only():
+
+    values = 100*np.random.rand(16, 16, 4).astype(np.float32)
+    vol = vreg.volume(values)
+    series = [tmp, '007', 'test', 'ax']
+    db.write_volume(vol, series)
+    db.flush()
+    file = os.path.join(tmp, 'dbtree.json')
+    mtime = os.stat(file).st_mtime_ns
+
+    # Reading works but changes are refused
+    dbd = db.open(tmp, mode='r')
+    assert 1 == len(dbd.series(series[:3]))
+    dbd.volume(series)
+    for modify in [
+        lambda: dbd.delete(series),
+        lambda: dbd.write_volume(vol, series[:3] + ['cor']),
+        lambda: dbd.copy(series),
+        lambda: dbd.edit(series, {'SeriesDescription': 'new'}),
+    ]:
+        try:
+            modify()
+        except ValueError:
+            assert True
+        else:
+            assert False
+    dbd.close()
+    assert mtime == os.stat(file).st_mtime_ns
+
+    # Without a register the folder is scanned, but nothing is saved
+    os.remove(file)
+    assert 1 == len(db.open(tmp, mode='r').close().series(series[:3]))
+    assert not os.path.exists(file)
+
+    # Same for an SQLite register
+    db.open(tmp, backend='sqlite').close()
+    dbd = db.open(tmp, mode='r')
+    assert 'sqlite' == dbd.backend
+    assert 4 == len(dbd.files(series))
+    try:
+        dbd.delete(series)
+    except ValueError:
+        assert True
+    else:
+        assert False
+    dbd.close()
+
+    # The folder must exist
+    try:
+        db.open(os.path.join(tmp, 'none'), mode='r')
+    except FileNotFoundError:
+        assert True
+    else:
+        assert False
+
+    shutil.rmtree(tmp)
+
+def test_volume_workers():
+
+    values = 100*np.random.rand(16, 16, 4, 2).astype(np.float32)
+    vol = vreg.volume(values, coords=([1, 2], ), dims=['AcquisitionTime'])
+    series = [tmp, '007', 'test', 'ax']
+    db.write_volume(vol, series)
+
+    # Identical results reading in parallel
+    vol1 = db.volume(series, dims=['AcquisitionTime'])
+    vol2 = db.volume(series, dims=['AcquisitionTime'], workers=3)
+    assert np.array_equal(vol1.values, vol2.values)
+    assert np.array_equal(vol1.affine, vol2.affine)
+    vols1 = db.volumes_2d(series, dims=['AcquisitionTime'])
+    vols2 = db.volumes_2d(series, dims=['AcquisitionTime'], workers=3)
+    for v1, v2 in zip(vols1, vols2):
+        assert np.array_equal(v1.values, v2.values)
+
+    # Identical results writing in parallel
+    db.write_volume(vol, [tmp, '007', 'test', 'ax_par'], workers=3)
+    vol2 = db.volume([tmp, '007', 'test', 'ax_par'], dims=['AcquisitionTime'])
+    assert np.array_equal(vol1.values, vol2.values)
+    assert np.array_equal(vol1.affine, vol2.affine)
+    nrs1 = db.values(series, 'InstanceNumber', dims=['SliceLocation', 'AcquisitionTime'])
+    nrs2 = db.values([tmp, '007', 'test', 'ax_par'], 'InstanceNumber', dims=['SliceLocation', 'AcquisitionTime'])
+    assert np.array_equal(nrs1, nrs2)
+
+    # Compressed files are read in processes
+    for f in db.files(series):
+        ds = pydicom.dcmread(f)
+        ds.compress(pydicom.uid.RLELossless)
+        ds.save_as(f)
+    vol2 = db.volume(series, dims=['AcquisitionTime'], workers=2)
+    assert np.array_equal(vol1.values, vol2.values)
+
+    shutil.rmtree(tmp)
+
+def test_pixel_data():
+
+    values = 100*np.random.rand(16, 12, 5, 3).astype(np.float32)
+    vol = vreg.volume(values, coords=([1, 2, 3], ), dims=['AcquisitionTime'])
+    series = [tmp, '007', 'test', 'ax']
+    db.write_volume(vol, series)
+
+    # Same as joining the 2D volumes
+    array = db.pixel_data(series, dims=['AcquisitionTime'])
+    vols = db.volumes_2d(series, dims=['AcquisitionTime'])
+    assert np.array_equal(array, np.concatenate([v.values for v in vols], axis=2))
+
+    # Write into an existing array
+    out = np.zeros(array.shape, dtype=np.float64)
+    result = db.pixel_data(series, dims=['AcquisitionTime'], out=out)
+    assert result is out
+    assert np.array_equal(out, array)
+    try:
+        db.pixel_data(series, dims=['AcquisitionTime'], out=out[...,0])
+    except ValueError:
+        assert True
+    else:
+        assert False
+
+    # Memory-mapped
+    pixels = db.pixel_data(series, dims=['AcquisitionTime'], mmap=True)
+    assert pixels.shape == array.shape
+    assert np.array_equal(np.asarray(pixels), array)
+    assert pixels[3, 4, 2, 1] == array[3, 4, 2, 1]
+    assert np.array_equal(pixels[..., 1], array[..., 1])
+    assert np.array_equal(pixels[2:5, 4], array[2:5, 4])
+
+    shutil.rmtree(tmp)
+
+
+def test_lazy_volume():
+
+    values = 100*np.random.rand(16, 12, 5, 3).astype(np.float32)
+    vol = vreg.volume(values, coords=([1, 2, 3], ), dims=['AcquisitionTime'])
+    series = [tmp, '007', 'test', 'ax']
+    db.write_volume(vol, series)
+
+    # Same geometry and values as volume()
+    ref = db.volume(series, dims=['AcquisitionTime'])
+    lazy = db.lazy_volume(series, dims=['AcquisitionTime'])
+    assert lazy.shape == ref.shape
+    assert np.array_equal(lazy.affine, ref.affine)
+    assert lazy.dims == ref.dims
+    assert np.array_equal(lazy.coords[0], ref.coords[0])
+    assert np.array_equal(lazy[:, :, 2, 1], ref.values[:, :, 2, 1])
+    assert np.array_equal(lazy[3:6, 4, ...], ref.values[3:6, 4, ...])
+
+    # Convert to a volume
+    vol = lazy.volume()
+    assert np.array_equal(vol.values, ref.values)
+    assert np.array_equal(vol.affine, ref.affine)
+    assert vol.dims == ref.dims
+
+    shutil.rmtree(tmp)
+
+
+def test_iter_volumes():
+
+    values = 100*np.random.rand(16, 12, 5, 3, 2).astype(np.float32)
+    vol = vreg.volume(values, coords=([1, 2, 3], [10, 20]), dims=['AcquisitionTime', 'FlipAngle'])
+    series = [tmp, '007', 'test', 'ax']
+    db.write_volume(vol, series)
+
+    # One volume per acquisition time
+    ref = db.volume(series, dims=['AcquisitionTime', 'FlipAngle'])
+    vols = list(db.iter_volumes(series, dims=['AcquisitionTime', 'FlipAngle']))
+    assert len(vols) == 3
+    for k, v in enumerate(vols):
+        assert v.shape == (16, 12, 5, 2)
+        assert v.dims == ['FlipAngle']
+        assert np.array_equal(v.values, ref.values[:,:,:,k,:])
+        assert np.array_equal(v.affine, ref.affine)
+
+    # Iterate over the other dimension
+    vols = list(db.iter_volumes(series, dims=['AcquisitionTime', 'FlipAngle'], over='FlipAngle', workers=2))
+    assert len(vols) == 2
+    assert np.array_equal(vols[1].values, ref.values[:,:,:,:,1])
+
+    shutil.rmtree(tmp)
+
+
+def test_roi():
+
+    values = 100*np.random.rand(16, 12, 8).astype(np.float32)
+    vol = vreg.volume(values, spacing=[1, 1, 2])
+    series = [tmp, '007', 'test', 'ax']
+    db.write_volume(vol, series)
+    ref = db.volume(series)
+    locs = db.values(series, 'SliceLocation')
+    locs = np.sort(locs)
+
+    # Slices 2 to 4 and an in-plane window
+    slices = (locs[2], locs[4])
+    bbox = ((3, 10), (2, 7))
+    roi = db.volume(series, bbox=bbox, slices=slices)
+    assert roi.shape == (7, 5, 3)
+    assert np.array_equal(roi.values, ref.values[3:10, 2:7, 2:5])
+    assert np.allclose(roi.affine[:3, 3], ref.affine[:3, :3] @ [3, 2, 2] + ref.affine[:3, 3])
+
+    # Same for 2D volumes and pixel data
+    vols = db.volumes_2d(series, bbox=bbox, slices=slices)
+    assert len(vols) == 3
+    assert vols[0].shape == (7, 5, 1)
+    array = db.pixel_data(series, bbox=bbox, slices=slices)
+    assert array.shape == (7, 5, 3)
+    assert np.array_equal(array, np.concatenate([v.values for v in vols], axis=2))
+
+    # Compressed files are decoded and then cropped
+    for f in db.files(series):
+        ds = pydicom.dcmread(f)
+        ds.compress(pydicom.uid.RLELossless)
+        ds.save_as(f)
+    roi = db.volume(series, bbox=bbox, slices=slices)
+    assert np.array_equal(roi.values, ref.values[3:10, 2:7, 2:5])
+
+    shutil.rmtree(tmp)
+
+
+def test_cache():
+
+    values = 100*np.random.rand(16, 12, 4).astype(np.float32)
+    vol = vreg.volume(values)
+    series = [tmp, '007', 'test', 'ax']
+    db.write_volume(vol, series)
+    ref = db.volume(series)
+
+    # Second read comes from the cache
+    dbd = db.open(tmp, cache=10**7)
+    v1 = dbd.volume(series)
+    assert (dbd.cache.hits, dbd.cache.misses) == (0, 4)
+    v2 = dbd.volume(series)
+    assert (dbd.cache.hits, dbd.cache.misses) == (4, 4)
+    assert np.array_equal(v1.values, ref.values)
+    assert np.array_equal(v2.values, ref.values)
+    assert np.array_equal(dbd.pixel_data(series), ref.values)
+    dbd.values(series, 'SliceLocation')
+    assert dbd.cache.misses == 4
+
+    # The budget is respected, dropping the oldest slices
+    nbytes = dbd.cache.nbytes
+    dbd.cache.max_bytes = nbytes // 2
+    dbd.cache.clear()
+    dbd.volume(series)
+    assert 0 < dbd.cache.nbytes <= nbytes // 2
+    assert len(dbd.cache) < 4
+
+    # Edited files are dropped
+    dbd.cache.max_bytes = 10**7
+    dbd.volume(series)
+    dbd.edit(series, {'RepetitionTime': 5.0})
+    assert len(dbd.cache) == 0
+    v3 = dbd.volume(series)
+    assert np.array_equal(v3.values, ref.values)
+    assert len(dbd.cache) == 4
+    dbd.delete(series)
+    assert len(dbd.cache) == 0
+    dbd.close()
+
+    # Cache for the functions of the module
+    series = [tmp, '008', 'test', 'ax']
+    db.write_volume(vol, series)
+    cache = db.set_cache(tmp, 10**7)
+    db.volume(series)
+    db.volume(series)
+    assert cache.hits == 4
+    assert db.set_cache(tmp) is None
+
+    shutil.rmtree(tmp)
+
+
+def test_header_cache():
+
+    values = 100*np.random.rand(16, 12, 4, 3).astype(np.float32)
+    vol = vreg.volume(values, coords=([1, 2, 3], ), dims=['FlipAngle'])
+    series = [tmp, '007', 'test', 'ax']
+    db.write_volume(vol, series)
+    fa = db.values(series, 'FlipAngle', dims=['SliceLocation', 'FlipAngle'])
+    cache_folder = os.path.join(tmp, '.dbdicom')
+    assert len(os.listdir(cache_folder)) == 1
+
+    # Cached values are read without opening the files
+    dcmread = pydicom.dcmread
+    calls = []
+    def counted_dcmread(*args, **kwargs):
+        calls.append(args[0])
+        return dcmread(*args, **kwargs)
+    pydicom.dcmread = counted_dcmread
+    try:
+        fa_cached = db.values(series, 'FlipAngle', dims=['SliceLocation', 'FlipAngle'])
+        assert np.array_equal(fa, fa_cached)
+        assert db.unique('FlipAngle', series) == [1, 2, 3]
+        lazy = db.lazy_volume(series, dims=['FlipAngle'])
+        assert lazy.shape == (16, 12, 4, 3)
+        assert calls == []
+
+        # A changed file is read again
+        file = db.files(series)[0]
+        ds = dcmread(file)
+        ds.FlipAngle = 10
+        ds.save_as(file)
+        fa_changed = db.values(series, 'FlipAngle', dims=['InstanceNumber'])
+        assert calls == [file]
+        assert 10 in fa_changed
+    finally:
+        pydicom.dcmread = dcmread
+
+    # The cache is not part of the DICOM data
+    db.refresh(tmp)
+    assert len(db.files(tmp)) == 12
+    db.delete(series)
+    assert not os.path.isdir(cache_folder) or os.listdir(cache_folder) == []
+
+    shutil.rmtree(tmp)
+
+
+def test_columns():
+
+    values = 100*np.random.rand(16, 12, 4, 3).astype(np.float32)
+    vol = vreg.volume(values, coords=([1, 2, 3], ), dims=['FlipAngle'])
+    series = [tmp, '007', 'test', 'ax']
+    db.write_volume(vol, series)
+
+    for backend in ['json', 'sqlite']:
+
+        # Index extra columns
+        dbd = db.open(tmp, backend=backend, columns=['FlipAngle', 'AcquisitionTime'])
+        assert dbd.columns == ['FlipAngle', 'AcquisitionTime']
+        fa = dbd.values(series, 'FlipAngle', dims=['SliceLocation', 'FlipAngle'])
+        dbd.close()
+
+        # The columns are saved with the register and served without 
+        # reading the files
+        dcmread = pydicom.dcmread
+        calls = []
+        def counted_dcmread(*args, **kwargs):
+            calls.append(args[0])
+            return dcmread(*args, **kwargs)
+        pydicom.dcmread = counted_dcmread
+        try:
+            dbd = db.open(tmp)
+            assert dbd.columns == ['FlipAngle', 'AcquisitionTime']
+            assert np.array_equal(dbd.values(series, 'FlipAngle', dims=['SliceLocation', 'FlipAngle']), fa)
+            assert dbd.unique('FlipAngle', series[:3]) == [1, 2, 3]
+            assert len(dbd.unique('AcquisitionTime', series)) == 1
+            assert calls == []
+        finally:
+            pydicom.dcmread = dcmread
+
+        # Written files are added
+        dbd.write_volume(vol, [tmp, '007', 'test', 'cor'])
+        assert len(dbd.column_values) == 24
+        split = dbd.split_series([tmp, '007', 'test', 'cor'], 'FlipAngle')
+        assert [v for v, _ in split] == [1, 2, 3]
+        dbd.delete([tmp, '007', 'test', 'cor'])
+        for _, s in split:
+            dbd.delete(s)
+        assert len(dbd.column_values) == 12
+        dbd.close()
+
+    shutil.rmtree(tmp)
+def test_virtual_frames():
+
+    if os.path.isdir(tmp):
+        shutil.rmtree(tmp)
+    multiframe = os.path.join(os.path.dirname(__file__), 'data', 'MULTIFRAME')
+    shutil.copytree(multiframe, tmp)
+
+    for backend in ['json', 'sqlite']:
+
+        # Frames are registered without splitting the files
+        dbd = db.open(tmp, backend=backend, split_multiframe=False)
+        assert sorted(os.listdir(tmp))[:2] == ['IM_0010', 'IM_0014']
+        series = dbd.series()
+        assert [s[-1][0] for s in series] == ['Ax_localiser_BH', 'Cor_B0map_BH']
+        assert len(dbd.files(series[1])) == 104
+
+        # and read from the multiframe file
+        vol = dbd.volume(series[0], verbose=0)
+        assert vol.shape == (256, 256, 20)
+        assert np.array_equal(dbd.pixel_data(series[0], verbose=0), vol.values)
+        frame = dbd.files(series[0])[0]
+        assert frame == os.path.join(tmp, 'IM_0010#frame=1')
+        ds = dbdicom.utils.multiframe.dcmread(frame)
+        assert np.array_equal(dbdicom.dataset.pixel_data(ds), vol.values[:,:,0])
+        dbd.close()
+
+        # The register is unchanged by a refresh
+        dbd = db.open(tmp)
+        assert dbd.refresh().series() == series
+        dbd.close()
+
+        # The setting is saved with the register, so the files are 
+        # not split when the folder is read again
+        dbd = db.DataBaseDicom(tmp)
+        assert dbd.split_multiframe is False
+        assert dbd.read().series() == series
+        assert os.path.exists(os.path.join(tmp, 'IM_0010'))
+        dbd.close()
+
+    # Copies are single-frame files, and the multiframe file is 
+    # removed with its last frame
+    dbd = db.open(tmp)
+    dbd.copy(series[0], [tmp, '007', 'test', 'ax'])
+    assert dbd.volume([tmp, '007', 'test', 'ax'], verbose=0).shape == (256, 256, 20)
+    dbd.delete(series[0])
+    assert not os.path.exists(os.path.join(tmp, 'IM_0010'))
+    assert os.path.exists(os.path.join(tmp, 'IM_0014'))
+    dbd.close()
+
+    shutil.rmtree(tmp)
+
+
+def test_batch():
+
+    for backend in ['json', 'sqlite']:
+
+        if os.path.isdir(tmp):
+            shutil.rmtree(tmp)
+        dbd = db.open(tmp, backend=backend)
+        vol = vreg.volume(np.random.rand(8, 8, 4))
+        with dbd.batch():
+            for i in range(3):
+                dbd.write_volume(vol, [tmp, '007', 'test', f'vol_{i}'], verbose=0)
+            # The files are on disk before the register is updated
+            assert len(dbd._batch['instances']) == 4
+        assert dbd._batch is None
+        assert [s[-1][0] for s in dbd.series()] == ['vol_0', 'vol_1', 'vol_2']
+        assert len(dbd.files([tmp, '007'])) == 12
+        assert len(dbd.fingerprints) == 12
+        for i in range(3):
+            assert np.allclose(dbd.volume([tmp, '007', 'test', f'vol_{i}'], verbose=0).values, vol.values, atol=1e-3)
+        dbd.close()
+
+        # The batch is saved with the register
+        dbd = db.open(tmp)
+        assert len(dbd.series()) == 3
+        assert len(dbd.files([tmp, '007'])) == 12
+        dbd.close()
+
+    shutil.rmtree(tmp)
+
+
+def test_write_multiframe():
+
+    values = 100*np.random.rand(16, 12, 5, 3).astype(np.float32)
+    vol = vreg.volume(values, coords=([1., 2., 3.], ), dims=['FlipAngle'])
+    for backend in ['json', 'sqlite']:
+
+        if os.path.isdir(tmp):
+            shutil.rmtree(tmp)
+        dbd = db.open(tmp, backend=backend)
+        dbd.write_volume(vol, [tmp, '007', 'test', 'sf'], verbose=0)
+        dbd.write_volume(vol, [tmp, '007', 'test', 'mf'], verbose=0, multiframe=True)
+
+        # One file, read in the same way as single-frame files
+        files = dbd.files([tmp, '007', 'test', 'mf'])
+        assert len(files) == 15
+        assert len({dbdicom.utils.multiframe.source(f) for f in files}) == 1
+        sf = dbd.volume([tmp, '007', 'test', 'sf'], dims=['FlipAngle'], verbose=0)
+        mf = dbd.volume([tmp, '007', 'test', 'mf'], dims=['FlipAngle'], verbose=0)
+        assert np.array_equal(sf.values, mf.values)
+        assert np.allclose(sf.affine, mf.affine)
+        assert np.array_equal(sf.coords[0], mf.coords[0])
+
+        # Appended frames are numbered after the existing instances
+        vol2 = vol.translate([0, 0, 10], coords='volume')
+        dbd.write_volume(vol2, [tmp, '007', 'test', 'mf'], verbose=0, multiframe=True, append=True)
+        assert len(dbd.files([tmp, '007', 'test', 'mf'])) == 30
+
+        # Writing with a reference series
+        ref = [tmp, '007', 'test', 'sf']
+        dbd.write_volume(vol, [tmp, '007', 'test', 'ref_sf'], ref=ref, verbose=0)
+        dbd.write_volume(vol, [tmp, '007', 'test', 'ref_mf'], ref=ref, verbose=0, multiframe=True)
+        for desc in ['ref_sf', 'ref_mf']:
+            v = dbd.volume([tmp, '007', 'test', desc], dims=['FlipAngle'], verbose=0)
+            assert np.array_equal(v.values, sf.values)
+        dbd.close()
+
+        # The frames are still registered after reopening, and the 
+        # files are not split when the folder is read again
+        dbd = db.open(tmp, split_multiframe=True)
+        assert len(dbd.files([tmp, '007', 'test', 'mf'])) == 30
+        dbd.read()
+        files = dbd.files([tmp, '007', 'test', 'mf'])
+        assert len(files) == 30
+        sources = {dbdicom.utils.multiframe.source(f) for f in files}
+        assert len(sources) == 2
+        assert all(os.path.isfile(f) for f in sources)
+        assert not any(os.path.exists(f + '_sf') for f in sources)
+        dbd.close()
+
+    # Other dimensions are saved in a private macro
+    dbd = db.open(tmp)
+    vol = vreg.volume(values, coords=([1., 2., 3.], ), dims=['AcquisitionTime'])
+    dbd.write_volume(vol, [tmp, '007', 'test', 'time'], verbose=0, multiframe=True)
+    mf = dbd.volume([tmp, '007', 'test', 'time'], dims=['AcquisitionTime'], verbose=0)
+    assert np.array_equal(mf.coords[0], [1., 2., 3.])
+    dbd.close()
+
+    shutil.rmtree(tmp)
+
+
 if __name__ == '__main__':
 
     test_write_volume()
     test_volumes_2d()
     test_values()
     test_edit()
+    test_edit_inplace()
     test_volume()
     test_write_database()
     test_copy()
+    test_open_workers()
+    test_refresh()
+    test_sqlite_backend()
+    test_session()
+    test_read_only()
+    test_volume_workers()
+    test_pixel_data()
+    test_lazy_volume()
+    test_iter_volumes()
+    test_roi()
+    test_cache()
+    test_header_cache()
+    test_columns()
+    test_virtual_frames()
+    test_batch()
+    test_write_multiframe()
 
     print('All api tests have passed!!!')
\ No newline at end of file
@@ -1,8 +1,11 @@
 import os
+import shutil
 
 import numpy as np
 import vreg
 from dbdicom.sop_classes import enhanced_mr_image
+import dbdicom.dataset as dataset
+import dbdicom.utils.multiframe as multiframe
 
 
 
@@ -29,5 +32,34 @@ def test_enhanced_mri_volume():
 
 
 
+def test_enhanced_mri_concatenation():
+
+    values = np.random.rand(16, 12, 5, 2) * 100
+    vol = vreg.volume(values, coords=([10., 20.], ), dims=['EchoTime'])
+
+    # Split over files of at most 4 frames
+    datasets = enhanced_mr_image.concatenation(vol, max_bytes=4*16*12*2, offset=3)
+    assert [ds.NumberOfFrames for ds in datasets] == [4, 4, 2]
+    assert [ds.ConcatenationFrameOffsetNumber for ds in datasets] == [3, 7, 11]
+
+    path = os.path.join(os.getcwd(), 'tmp')
+    os.makedirs(path, exist_ok=True)
+    for i, ds in enumerate(datasets):
+        file = os.path.join(path, f'test_concatenation_{i}.dcm')
+        ds.save_as(file, enforce_file_format=True)
+
+    # Frames are numbered across the concatenation
+    file = os.path.join(path, 'test_concatenation_1.dcm')
+    frame = multiframe.dcmread(multiframe.frame_path(file, 2))
+    assert frame.InstanceNumber == 9
+    assert frame.EchoTime == 20
+    assert np.allclose(frame.ImagePositionPatient, [0, 0, 0])
+    array = dataset.pixel_data(frame)
+    assert np.allclose(array, values[:, :, 0, 1], atol=1e-2)
+
+    shutil.rmtree(path)
+
+
 if __name__ == '__main__':
-    test_enhanced_mri_volume()
\ No newline at end of file
+    test_enhanced_mri_volume()
+    test_enhanced_mri_concatenation()
\ No newline at end of file
@@ -2,8 +2,15 @@ import os
 import shutil
 import numpy as np
 import vreg
+import pydicom
 
+import dbdicom.dataset
 import dbdicom.utils.arrays
+import dbdicom.utils.files
+import dbdicom.utils.multiframe
+import dbdicom.utils.encoder
+import dbdicom.database
+import dbdicom.register
 import dbdicom.dbd
 import dbdicom as db
 
@@ -60,6 +67,41 @@ def test_meshvals():
     else:
         assert False
 
+    # Large grid of native values, in random order
+    z = np.repeat(np.arange(100.0), 200)
+    t = np.tile(np.arange(200), 100)
+    order = np.random.permutation(z.size)
+    coords, inds = dbdicom.utils.arrays.meshvals([z[order], t[order]])
+    assert coords[0].shape == (100, 200)
+    assert coords[0].dtype == np.float64
+    assert coords[1].dtype == t.dtype
+    assert np.array_equal(coords[0], z.reshape((100, 200)))
+    assert np.array_equal(coords[1], t.reshape((100, 200)))
+    assert np.array_equal(order[inds], np.arange(z.size))
+
+    # Numbers and strings have the same type with or without 
+    # coordinates that are lists
+    z = [0, 1.5, 2, 0, 1.5, 2]
+    p = ['A','A','A','B','B','B']
+    q = [[1],[1],[1],[2],[2],[2]]
+    native, _ = dbdicom.utils.arrays.meshvals([z, p])
+    mixed, _ = dbdicom.utils.arrays.meshvals([z, q])
+    assert native[0].dtype == mixed[0].dtype
+    assert type(native[0][0,0]) == type(mixed[0][0,0])
+    assert np.array_equal(native[0], mixed[0])
+    assert np.array_equal(mixed[0][:,0], [0, 1.5, 2])
+
+    # Duplicates in a large grid
+    z = np.repeat(np.arange(100.0), 200)
+    z[1] = z[0]
+    t[1] = t[0]
+    try:
+        dbdicom.utils.arrays.meshvals([z, t])
+    except ValueError:
+        assert True
+    else:
+        assert False
+
 
 def test_full_name():
 
@@ -93,9 +135,200 @@ def test_full_name():
 
 
 
+def test_tree():
+
+    columns = dbdicom.database.COLUMNS
+    def row(pid, study, series, sop, nr):
+        values = [pid, study, series, sop, 'Anonymous', 'test', None, '1', 'ax', 1, nr]
+        return dict(zip(columns, values))
+
+    rows = {
+        'a': row('2', '1.1', '2.1', '3.1', 1),
+        'b': row('1', '1.2', '2.2', '3.2', 2),
+        'c': row('1', '1.2', '2.2', '3.3', 1),
+        'd': row('1', '1.2', '2.2', '3.3', 1), # duplicate instance
+        'e': row(None, '1.3', '2.3', '3.4', 1),
+    }
+    tree = dbdicom.database._tree(rows)
+    assert [pt['PatientID'] for pt in tree] == ['1', '2', 'None']
+    assert tree[0]['studies'][0]['StudyDate'] == 'None'
+    assert tree[0]['studies'][0]['series'][0]['instances'] == {2: 'b', 1: 'c'}
+
+
+def test_header_read():
+
+    tmp = os.path.join(os.getcwd(), 'tests', 'tmp')
+    os.makedirs(tmp, exist_ok=True)
+    shutil.rmtree(tmp)
+    os.makedirs(tmp, exist_ok=True)
+
+    values = 100*np.random.rand(16, 16, 4).astype(np.float32)
+    vol = vreg.volume(values)
+    db.write_volume(vol, [tmp, '007', 'test', 'ax'])
+
+    datapath = os.path.join(os.path.dirname(__file__), 'data')
+    files = dbdicom.utils.files.all_files(datapath) + dbdicom.utils.files.all_files(tmp)
+    tags = dbdicom.database.COLUMNS + ['NumberOfFrames', dbdicom.database.PRIVATE_CREATOR]
+    for f in files:
+        row = dbdicom.database._read_dataset(f, tags)
+        assert row == dbdicom.database._read_header(f, tags)
+
+    # Same register with both engines
+    os.remove(os.path.join(tmp, 'dbtree.json'))
+    assert dbdicom.database.read(tmp) == dbdicom.database.read(tmp, engine='raw')
+
+    # Also for extra columns that are derived when they are missing
+    files = [f for f in dbdicom.utils.files.all_files(tmp) if f.endswith('.dcm')]
+    file = files[0]
+    ds = pydicom.dcmread(file)
+    del ds.SliceLocation
+    ds.save_as(file)
+    columns = ['SliceLocation']
+    pydicom_rows = dbdicom.database.instances(tmp, files, columns=columns)
+    raw_rows = dbdicom.database.instances(tmp, files, engine='raw', columns=columns)
+    assert pydicom_rows == raw_rows
+    assert pydicom_rows[os.path.relpath(file, tmp)]['SliceLocation'] is not None
+    dbtree, values = dbdicom.database.read_columns(tmp, columns, engine='raw')
+    assert dbtree == dbdicom.database.read(tmp)
+    assert values == {f: [row['SliceLocation']] for f, row in pydicom_rows.items()}
+
+    shutil.rmtree(tmp)
+
+
+def test_register_index():
+
+    columns = dbdicom.database.COLUMNS
+    def row(pid, study, series, sop, desc, nr):
+        values = [pid, study, series, sop, 'Anonymous', 'test', None, '1', desc, int(series[-1]), nr]
+        return dict(zip(columns, values))
+
+    rows = {
+        'a': row('1', '1.1', '2.1', '3.1', 'ax', 1),
+        'b': row('1', '1.1', '2.2', '3.2', 'ax', 1),
+        'c': row('1', '1.1', '2.3', '3.3', 'cor', 1),
+        'd': row('1', '1.2', '2.4', '3.4', 'ax', 1),
+    }
+    dbtree = dbdicom.database._tree(rows)
+    study = ['db', '1', ('test', 1)]
+    series = ['db', '1', ('test', 0), ('ax', 1)]
+
+    # The tree is indexed when it is read
+    assert isinstance(dbtree, dbdicom.register.DbTree)
+    assert dbdicom.register.study_uid(dbtree, study) == '1.2'
+    assert dbdicom.register.series_uid(dbtree, series) == '2.2'
+    assert dbdicom.register.index(dbtree, series) == ['b']
+    assert dbdicom.register.index(dbtree, ['db', '1']) == ['a', 'b', 'c', 'd']
+    assert dbdicom.register.series(dbtree, study) == [study + [('ax', 0)]]
+    assert dbdicom.register.max_series_number(dbtree, '1.1') == 3
+    try:
+        dbdicom.register.index(list(dbtree), series)
+    except TypeError:
+        assert True
+    else:
+        assert False
+    try:
+        dbdicom.register.study_uid(dbtree, ['db', '1', 'test'])
+    except dbdicom.register.AmbiguousError:
+        assert True
+    else:
+        assert False
+
+    # The index follows changes to the tree
+    dbdicom.register.add_instance(dbtree, row('1', '1.2', '2.4', '3.5', 'ax', 2), 'e')
+    assert dbdicom.register.index(dbtree, study) == ['d', 'e']
+    dbdicom.register.add_instance(dbtree, row('1', '1.1', '2.0', '3.6', 'sag', 1), 'f')
+    assert dbdicom.register.index(dbtree, ['db', '1', ('test', 0)]) == ['f', 'a', 'b', 'c']
+    dbdicom.register.drop(dbtree, ['f'])
+    dbdicom.register.drop(dbtree, ['d', 'e'])
+    assert dbdicom.register.studies(dbtree, ['db', '1']) == [['db', '1', ('test', 0)]]
+    assert dbdicom.register.study_uid(dbtree, ['db', '1', 'test']) == '1.1'
+    dbdicom.register.remove(dbtree, ['db', '1', 'test', 'cor'])
+    assert dbdicom.register.index(dbtree, 'db') == ['a', 'b']
+    assert dbtree == dbdicom.register.DbTree(dbtree)
+
+def test_multiframe_split():
+
+    tmp = os.path.join(os.getcwd(), 'tests', 'tmp')
+    if os.path.isdir(tmp):
+        shutil.rmtree(tmp)
+    datapath = os.path.join(os.path.dirname(__file__), 'data')
+    shutil.copytree(os.path.join(datapath, 'MULTIFRAME'), tmp)
+
+    # Frames are split natively, with the pixels unchanged
+    file = os.path.join(tmp, 'IM_0010')
+    files, values = dbdicom.utils.multiframe.split_multiframe(file, ['SeriesDescription', 'InstanceNumber'])
+    assert len(files) == 20
+    assert values[0] == ['Ax_localiser_BH', 1]
+    mf = pydicom.dcmread(file)
+    ds = pydicom.dcmread(files[5])
+    assert ds.SOPClassUID == '1.2.840.10008.5.1.4.1.1.4'
+    assert 'NumberOfFrames' not in ds
+    assert np.array_equal(ds.pixel_array, mf.pixel_array[5])
+    pos = mf.PerFrameFunctionalGroupsSequence[5].PlanePositionSequence[0].ImagePositionPatient
+    assert ds.ImagePositionPatient == pos
+    shutil.rmtree(file + '_sf')
+
+    # Big endian pixel data are saved in little endian
+    mf.PixelData = mf.pixel_array.astype('>u2').tobytes()
+    mf.file_meta.TransferSyntaxUID = pydicom.uid.ExplicitVRBigEndian
+    be_file = os.path.join(tmp, 'IM_0010_BE')
+    pydicom.dcmwrite(be_file, mf, enforce_file_format=True)
+    files = dbdicom.utils.multiframe.split_multiframe(be_file)
+    ds = pydicom.dcmread(files[5])
+    assert np.array_equal(ds.pixel_array, pydicom.dcmread(file).pixel_array[5])
+    shutil.rmtree(be_file + '_sf')
+    os.remove(be_file)
+
+    # Reading the folder replaces the multiframe files
+    series = db.series(tmp)
+    assert [s[-1][0] for s in series] == ['Ax_localiser_BH', 'Cor_B0map_BH']
+    assert not os.path.exists(file)
+
+    # Also when they are converted in parallel
+    shutil.rmtree(tmp)
+    shutil.copytree(os.path.join(datapath, 'MULTIFRAME'), tmp)
+    dbtree = dbdicom.database.read(tmp, workers=2)
+    assert len(dbdicom.register.index(dbtree, tmp)) == 124
+    assert not os.path.exists(file)
+
+    shutil.rmtree(tmp)
+
+
+def test_template_encoder():
+
+    vol = vreg.volume(100*np.random.rand(32, 24, 5).astype(np.float32))
+    multiframe = os.path.join(os.path.dirname(__file__), 'data', 'MULTIFRAME', 'IM_0014')
+    templates = [
+        dbdicom.dataset.new_dataset('MRImage'),
+        dbdicom.utils.multiframe.dcmread(multiframe + '#frame=1'),
+    ]
+    for ds in templates:
+        encoder = dbdicom.utils.encoder.TemplateEncoder()
+        for i, sl in enumerate(vol.split()):
+            dbdicom.dataset.set_volume(ds, sl)
+            ds.SOPInstanceUID = pydicom.uid.generate_uid()
+            ds.InstanceNumber = i + 1
+            encoded = encoder.encode(ds)
+            # Same bytes as pydicom
+            fp = pydicom.filebase.DicomBytesIO()
+            ds.save_as(fp, enforce_file_format=True)
+            assert encoded == fp.getvalue()
+        assert encoder.hits > encoder.misses
+
+    # Compressed datasets are left to pydicom
+    ds = templates[0]
+    ds.compress(pydicom.uid.RLELossless)
+    assert encoder.encode(ds) is None
+
+
 if __name__=='__main__':
 
     # test_meshvals()
     test_full_name()
+    test_tree()
+    test_header_read()
+    test_register_index()
+    test_multiframe_split()
+    test_template_encoder()
 
     print('All utils tests have passed!!!')
\ No newline at end of file